@@ -68,13 +68,13 @@ def create_app(config_class=None):
     login_manager.login_view = 'auth.login'
     login_manager.init_app(app)
     
-    from .models import User
+    from .user_cache import load_cached_user
     
     @login_manager.user_loader
     def load_user(user_id):
-        """Load user by ID for Flask-Login."""
+        """Load user by ID for Flask-Login, served from the user cache."""
         try:
-            return User.query.get(int(user_id))
+            return load_cached_user(int(user_id))
         except Exception as e:
             app.logger.error(f"Error loading user: {str(e)}")
             return None
@@ -85,6 +85,13 @@ def create_app(config_class=None):
         """Add current date to all templates."""
         return {'now': datetime.utcnow()}
     
+    # Add context processor to provide the current user's role names to all templates
+    @app.context_processor
+    def inject_user_roles():
+        """Add the current user's role names (resolved once per request) to all templates."""
+        from .utils import get_user_role_names
+        return {'current_user_roles': get_user_role_names(current_user)}
+    
     # Register custom filters
     @app.template_filter('nl2br')
     def nl2br_filter(text):
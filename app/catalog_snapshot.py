@@ -0,0 +1,152 @@
+"""
+Catalog snapshot.
+
+The product catalog (product groups with their elements, products and the
+phase durations groups default to) changes rarely but is read by every
+project creation. It is served as one JSON document built in three queries
+plus the cached reference lists, kept per worker and tagged with an ETag, so
+the project builder downloads it once and afterwards only revalidates it.
+
+Every gunicorn worker keeps its own snapshot, so changes are signalled
+through a version file in the instance folder. Commits that change product
+groups, elements or products replace it, including the bulk element
+deletes of the group form; duration changes come in through the reference
+data version.
+"""
+import hashlib
+import json
+import threading
+from sqlalchemy import select
+from .models import db, ProductElement, ProductGroup, ProductService
+from .project_schedule import parse_duration
+from .reference_data import get_list_items
+from .utils import get_cache_version, bump_cache_version, track_cache_invalidation
+
+# List holding the phase durations of groups and phases
+DURATION_LIST = 'PhaseDuration'
+
+def build_catalog_snapshot():
+    """
+    Build the catalog snapshot.
+
+    Returns:
+        dict: 'groups' by name, each with its 'elements' in creation order
+        and its 'product_ids'; 'products' by name; 'durations' in list
+        order with their length in working 'days' where it is understood
+    """
+    groups = {}
+    for group_id, name, description, duration_id in db.session.execute(
+        select(ProductGroup.id, ProductGroup.name, ProductGroup.description, ProductGroup.duration_id)
+        .order_by(ProductGroup.name, ProductGroup.id)
+    ):
+        groups[group_id] = {
+            'id': group_id,
+            'name': name,
+            'description': description,
+            'duration_id': duration_id,
+            'elements': [],
+            'product_ids': [],
+        }
+    for element_id, group_id, label, activity in db.session.execute(
+        select(ProductElement.id, ProductElement.group_id, ProductElement.label, ProductElement.activity)
+        .order_by(ProductElement.group_id, ProductElement.id)
+    ):
+        if group_id in groups:
+            groups[group_id]['elements'].append({'id': element_id, 'label': label, 'activity': activity})
+    products = []
+    for product_id, name, description, product_type, group_id in db.session.execute(
+        select(ProductService.id, ProductService.name, ProductService.description,
+               ProductService.type, ProductService.group_id)
+        .order_by(ProductService.name, ProductService.id)
+    ):
+        products.append({
+            'id': product_id,
+            'name': name,
+            'description': description,
+            'type': product_type,
+            'group_id': group_id,
+        })
+        if group_id in groups:
+            groups[group_id]['product_ids'].append(product_id)
+    durations = []
+    for item in get_list_items(DURATION_LIST):
+        days = parse_duration(item.value)
+        durations.append({
+            'id': item.id,
+            'value': item.value,
+            'days': days if days is not None else parse_duration(item.description),
+        })
+    return {'groups': list(groups.values()), 'products': products, 'durations': durations}
+
+_lock = threading.Lock()
+_snapshot = None
+_version = None
+
+def _current_version():
+    """The shared versions the snapshot depends on."""
+    return get_cache_version('catalog'), get_cache_version('reference_data')
+
+def _cached_snapshot():
+    """(snapshot, JSON body, ETag), built if missing or stale."""
+    global _snapshot, _version
+    version = _current_version()
+    with _lock:
+        if _snapshot is not None and version == _version:
+            return _snapshot
+    data = build_catalog_snapshot()
+    body = json.dumps(data, separators=(',', ':')).encode('utf-8')
+    snapshot = (data, body, hashlib.sha1(body).hexdigest())
+    with _lock:
+        _snapshot = snapshot
+        _version = version
+    return snapshot
+
+def get_catalog_snapshot():
+    """
+    Get the catalog snapshot, building it if it is not cached.
+
+    Returns:
+        dict: See build_catalog_snapshot(); shared between requests, so do
+        not modify it
+    """
+    return _cached_snapshot()[0]
+
+def get_catalog_snapshot_json():
+    """
+    Get the serialized catalog snapshot, building it if it is not cached.
+
+    Returns:
+        tuple: (JSON body as bytes, ETag)
+    """
+    return _cached_snapshot()[1:]
+
+def get_catalog_group(group_id):
+    """
+    Get a product group of the catalog snapshot.
+
+    Args:
+        group_id: The id of the product group
+
+    Returns:
+        dict: The group with its elements, or None if it does not exist
+    """
+    for group in get_catalog_snapshot()['groups']:
+        if group['id'] == group_id:
+            return group
+    return None
+
+def invalidate_catalog_snapshot():
+    """
+    Drop the catalog snapshot in every worker.
+    Called automatically after commits that change the catalog; call it
+    directly after changing the catalog with raw SQL.
+    """
+    global _snapshot, _version
+    with _lock:
+        _snapshot = None
+        _version = None
+    bump_cache_version('catalog')
+
+_CATALOG_MODELS = (ProductGroup, ProductElement, ProductService)
+
+track_cache_invalidation('catalog_changed', invalidate_catalog_snapshot, models=_CATALOG_MODELS)
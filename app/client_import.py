@@ -0,0 +1,173 @@
+"""
+Client CSV import.
+
+Reads an uploaded CSV file as a stream, decoding it incrementally, so memory
+stays bounded whatever the file size. Names are deduplicated against the
+existing clients, loaded once into a set of normalized names, and against
+earlier rows of the same file. Valid rows are inserted in fixed-size
+batches with one multi-row INSERT each and committed batch by batch, with
+progress reported after every batch.
+"""
+import csv
+import io
+import unicodedata
+from sqlalchemy import insert, select
+from .models import db, Client
+from .reference_data import get_list
+
+# Rows per INSERT and commit
+IMPORT_BATCH_SIZE = 1000
+# Row errors kept for the report; further errors are only counted
+MAX_REPORTED_ERRORS = 200
+
+# CSV columns and the Client columns they fill
+IMPORT_COLUMNS = ('name', 'address', 'city', 'country', 'sales_person', 'project_manager', 'industry', 'active')
+_TEXT_COLUMNS = ('name', 'address', 'city', 'sales_person', 'project_manager', 'industry')
+
+_TRUE_VALUES = {'1', 'true', 'yes', 'y', 'da', 'active', 'x'}
+_FALSE_VALUES = {'0', 'false', 'no', 'n', 'ne', 'inactive'}
+
+def normalize_client_name(name):
+    """Normalize a client name for duplicate checks: case, spacing and Unicode forms are ignored."""
+    return ' '.join(unicodedata.normalize('NFKC', name or '').casefold().split())
+
+class ClientImportError(ValueError):
+    """Raised when an upload cannot be read as a client CSV file."""
+
+class ClientImportResult:
+    """
+    Counts and row errors of a client import.
+    """
+
+    def __init__(self):
+        self.rows = 0
+        self.added = 0
+        self.duplicates = 0
+        self.error_count = 0
+        # (line number, message) of the first MAX_REPORTED_ERRORS errors
+        self.errors = []
+
+    @property
+    def skipped(self):
+        """Rows not imported, as duplicates or because of errors."""
+        return self.duplicates + self.error_count
+
+    def add_error(self, line, message):
+        """Record a rejected row."""
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+def _parse_active(value):
+    """Parse the active column; empty means active. Returns None if invalid."""
+    text = (value or '').strip().lower()
+    if not text or text in _TRUE_VALUES:
+        return True
+    if text in _FALSE_VALUES:
+        return False
+    return None
+
+def _existing_names():
+    """Load the normalized names of all clients, streamed in chunks."""
+    names = set()
+    for name in db.session.scalars(select(Client.name).execution_options(yield_per=5000)):
+        names.add(normalize_client_name(name))
+    return names
+
+def _country_ids():
+    """Map normalized country names to their list item ids."""
+    countries = get_list('Countries')
+    if countries is None:
+        return {}
+    return {normalize_client_name(value): item_id for value, item_id in countries.value_ids.items()}
+
+def import_clients(stream, batch_size=IMPORT_BATCH_SIZE, progress=None):
+    """
+    Import clients from a CSV stream with a header row.
+    Every batch is committed; if the file turns out to be unreadable
+    midway, the rows before are imported and the error is reported.
+
+    Args:
+        stream: A binary file object with UTF-8 CSV data (a BOM is allowed)
+        batch_size: Rows per INSERT and commit
+        progress: Called with the ClientImportResult after every batch
+
+    Returns:
+        ClientImportResult: Counts and row errors
+
+    Raises:
+        ClientImportError: If the header is missing, has no name column or
+            is not UTF-8
+    """
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    reader = csv.DictReader(text)
+    result = ClientImportResult()
+    try:
+        fields = [field.strip().lower() for field in reader.fieldnames or ()]
+    except UnicodeDecodeError:
+        raise ClientImportError('The file is not UTF-8 encoded')
+    if 'name' not in fields:
+        raise ClientImportError('The file has no name column')
+    reader.fieldnames = fields
+
+    seen = _existing_names()
+    countries = _country_ids()
+    lengths = {column: getattr(Client, column).type.length for column in _TEXT_COLUMNS}
+    batch = []
+
+    def flush():
+        if batch:
+            # render_nulls keeps rows with and without optional values in one INSERT
+            db.session.execute(insert(Client).execution_options(render_nulls=True), batch)
+            db.session.commit()
+            result.added += len(batch)
+            batch.clear()
+        if progress is not None:
+            progress(result)
+
+    try:
+        for row in reader:
+            result.rows += 1
+            line = reader.line_num
+            values = {column: (row.get(column) or '').strip() for column in IMPORT_COLUMNS}
+            if not values['name']:
+                result.add_error(line, 'Name is required')
+                continue
+            too_long = [column for column in _TEXT_COLUMNS if len(values[column]) > lengths[column]]
+            if too_long:
+                result.add_error(line, f"{', '.join(too_long)} too long")
+                continue
+            active = _parse_active(values['active'])
+            if active is None:
+                result.add_error(line, f"Invalid active value {values['active']!r}")
+                continue
+            country_id = None
+            if values['country']:
+                country_id = countries.get(normalize_client_name(values['country']))
+                if country_id is None:
+                    result.add_error(line, f"Unknown country {values['country']!r}")
+                    continue
+
+            key = normalize_client_name(values['name'])
+            if key in seen:
+                result.duplicates += 1
+                continue
+            seen.add(key)
+
+            batch.append({
+                'name': values['name'],
+                'address': values['address'],
+                'city': values['city'],
+                'country_id': country_id,
+                'sales_person': values['sales_person'] or None,
+                'project_manager': values['project_manager'] or None,
+                'industry': values['industry'] or None,
+                'active': active,
+            })
+            if len(batch) >= batch_size:
+                flush()
+    except (UnicodeDecodeError, csv.Error) as e:
+        # Keep the rows read so far and report where reading stopped
+        result.add_error(reader.line_num, f'Could not read the rest of the file: {e}')
+    flush()
+    return result
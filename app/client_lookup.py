@@ -0,0 +1,238 @@
+"""
+Client lookup for typeahead fields.
+
+Client names are kept in an in-memory trigram index, so a keystroke in a
+client field is answered without scanning the clients table. The index holds
+the normalized names sorted alphabetically; a name's position in that order
+is its key in the trigram posting lists, so walking a posting list yields
+matches already sorted by name and a search can stop as soon as it has
+enough. Names that start with the query come first, found by bisecting the
+sorted names, followed by the names that contain it elsewhere.
+
+The sales and project manager options the client fields are shown with
+change far less often than clients are searched, so they are served
+separately as one JSON body with an ETag.
+
+Every gunicorn worker keeps its own index and options, so changes are
+signalled through version files in the instance folder. Commits that add,
+rename or delete clients replace the index version; commits that change
+users or roles replace the options version, as do reference list changes.
+"""
+import bisect
+import hashlib
+import heapq
+import json
+import threading
+from sqlalchemy import select
+from sqlalchemy.orm import selectinload
+from .models import db, Client, Role, User
+from .client_import import normalize_client_name
+from .reference_data import get_list_items
+from .utils import get_cache_version, bump_cache_version, track_cache_invalidation
+
+# Matches returned by a search
+DEFAULT_SEARCH_LIMIT = 7
+# Shortest query a search answers
+MIN_QUERY_LENGTH = 2
+# Role whose users are offered as project managers
+PROJECT_MANAGER_ROLE = 'Project Manager'
+
+# Marks the end of a name, so two-letter queries match names ending in them
+_END = '\x00'
+
+def _trigrams(key):
+    """The distinct trigrams of a normalized name, including the end marker."""
+    padded = key + _END
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class ClientNameIndex:
+    """
+    Trigram index over client names.
+    """
+
+    def __init__(self, rows):
+        """
+        Args:
+            rows: (id, name) pairs of all clients
+        """
+        entries = sorted((normalize_client_name(name), client_id) for client_id, name in rows)
+        self.keys = [key for key, _ in entries]
+        self.ids = [client_id for _, client_id in entries]
+        postings = {}
+        for position, key in enumerate(self.keys):
+            for gram in _trigrams(key):
+                postings.setdefault(gram, []).append(position)
+        self.postings = postings
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _prefix_positions(self, query):
+        """Positions of the names starting with the query, in name order."""
+        position = bisect.bisect_left(self.keys, query)
+        while position < len(self.keys) and self.keys[position].startswith(query):
+            yield position
+            position += 1
+
+    def _candidate_positions(self, query):
+        """Positions of names that may contain the query, in name order."""
+        if len(query) >= 3:
+            # Every match contains all trigrams of the query, so the rarest
+            # one has the fewest candidates to verify
+            grams = _trigrams(query)
+            grams.discard(query[-2:] + _END)
+            lists = [self.postings.get(gram) for gram in grams]
+            if not all(lists):
+                return iter(())
+            return iter(min(lists, key=len))
+        # Two letters: the trigrams that start with them, merged by position
+        lists = [positions for gram, positions in self.postings.items() if gram.startswith(query)]
+        return _dedupe(heapq.merge(*lists))
+
+    def search(self, query, limit=DEFAULT_SEARCH_LIMIT):
+        """
+        Find clients whose name contains the query.
+
+        Args:
+            query: The search text; case and spacing are ignored
+            limit: Maximum number of matches
+
+        Returns:
+            list: Client ids, names starting with the query first, each
+            part in name order
+        """
+        query = normalize_client_name(query)
+        if len(query) < MIN_QUERY_LENGTH:
+            return []
+        found = []
+        for position in self._prefix_positions(query):
+            if len(found) >= limit:
+                return [self.ids[position] for position in found]
+            found.append(position)
+        prefixed = set(found)
+        for position in self._candidate_positions(query):
+            if len(found) >= limit:
+                break
+            if position not in prefixed and query in self.keys[position]:
+                found.append(position)
+        return [self.ids[position] for position in found]
+
+def _dedupe(positions):
+    """Drop repeated values from a sorted iterable."""
+    previous = None
+    for position in positions:
+        if position != previous:
+            yield position
+            previous = position
+
+_lock = threading.Lock()
+_index = None
+_index_version = None
+_options = None
+_options_version = None
+
+def get_client_index():
+    """
+    Get the client name index, building it if it is missing or stale.
+
+    Returns:
+        ClientNameIndex: The index of all clients
+    """
+    global _index, _index_version
+    version = get_cache_version('client_index')
+    with _lock:
+        if _index is not None and version == _index_version:
+            return _index
+    rows = db.session.execute(select(Client.id, Client.name).execution_options(yield_per=5000))
+    index = ClientNameIndex(rows)
+    with _lock:
+        _index = index
+        _index_version = version
+    return index
+
+def search_client_ids(query, limit=DEFAULT_SEARCH_LIMIT):
+    """
+    Find clients by name for a typeahead field.
+
+    Args:
+        query: The search text
+        limit: Maximum number of matches
+
+    Returns:
+        list: Matching client ids, best matches first
+    """
+    return get_client_index().search(query, limit)
+
+def invalidate_client_index():
+    """
+    Drop the client name index in every worker.
+    Called automatically after commits that add, rename or delete clients;
+    call it directly after changing clients with raw SQL.
+    """
+    global _index, _index_version
+    with _lock:
+        _index = None
+        _index_version = None
+    bump_cache_version('client_index')
+
+def _build_client_options():
+    """The sales and project manager options of client fields."""
+    role = db.session.scalar(
+        select(Role).where(Role.name == PROJECT_MANAGER_ROLE).options(selectinload(Role.users))
+    )
+    managers = sorted(role.users, key=lambda user: (user.first_name or '', user.last_name or '', user.id)) if role else []
+    return {
+        'sales_items': [{'id': item.id, 'value': item.value} for item in get_list_items('Sales')],
+        'project_managers': [{'id': user.id, 'name': f"{user.first_name} {user.last_name}"} for user in managers],
+    }
+
+def _cached_client_options():
+    """(options, JSON body, ETag) of the client field options, built if not cached."""
+    global _options, _options_version
+    version = get_cache_version('client_options'), get_cache_version('reference_data')
+    with _lock:
+        if _options is not None and version == _options_version:
+            return _options
+    data = _build_client_options()
+    body = json.dumps(data, separators=(',', ':')).encode('utf-8')
+    options = (data, body, hashlib.sha1(body).hexdigest())
+    with _lock:
+        _options = options
+        _options_version = version
+    return options
+
+def get_client_options():
+    """
+    Get the sales and project manager options of client fields.
+
+    Returns:
+        dict: 'sales_items' with id and value, 'project_managers' with id
+        and name, by name; shared between requests, so do not modify it
+    """
+    return _cached_client_options()[0]
+
+def get_client_options_json():
+    """
+    Get the serialized sales and project manager options, building them if
+    they are not cached.
+
+    Returns:
+        tuple: (JSON body as bytes, ETag)
+    """
+    return _cached_client_options()[1:]
+
+def invalidate_client_options():
+    """
+    Drop the cached client field options in every worker.
+    Called automatically after commits that change users or roles.
+    """
+    global _options, _options_version
+    with _lock:
+        _options = None
+        _options_version = None
+    bump_cache_version('client_options')
+
+# Renames and bulk statements such as CSV imports change the index; user and
+# role changes only the options
+track_cache_invalidation('client_index_stale', invalidate_client_index, models={Client: ('name',)})
+track_cache_invalidation('client_options_stale', invalidate_client_options, models=(User, Role), tables=())
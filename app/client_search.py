@@ -0,0 +1,119 @@
+"""
+Client list search.
+
+Compiles the client list filters (name prefix, country, status and the
+project manager scope) into one query that the composite client indexes
+answer in (name, id) order, so the list is paginated by keyset and any page
+costs the same as the first one. Project managers only see clients of the
+projects they manage; that scope is a join on the (manager_id, client_id)
+project index rather than an IN subquery.
+
+Totals are cached per filter combination until a commit adds or deletes a
+client, changes a filtered column or moves a project to another client or
+manager. The cache is invalidated through a shared version, so every
+gunicorn worker drops its counts on the next request.
+"""
+import threading
+from sqlalchemy import func
+from .models import Client, Project
+from .utils import get_cache_version, bump_cache_version, track_cache_invalidation
+
+# Maximum number of cached counts per worker
+MAX_CACHED_COUNTS = 256
+
+def client_sort_keys():
+    """Sort keys of the client list: name ignoring case, then id."""
+    return (func.lower(Client.name), Client.id)
+
+def _name_prefix_filter(search):
+    """Match names starting with the search text, ignoring case."""
+    prefix = search.strip().lower()
+    name = func.lower(Client.name)
+    # The range lets the (lower(name), id) indexes narrow the scan; the
+    # LIKE keeps the match exact whatever the collation
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return (name >= prefix) & (name < upper) & name.startswith(prefix, autoescape=True)
+
+def query_clients(search='', country_id=None, status='', manager_id=None):
+    """
+    Build the client list query.
+
+    Args:
+        search: Text the client name must start with
+        country_id: Country to filter by
+        status: 'active' or 'inactive' to filter by status
+        manager_id: Only include clients with projects managed by this user
+
+    Returns:
+        Query: Clients matching all filters
+    """
+    query = Client.query
+    if search and search.strip():
+        query = query.filter(_name_prefix_filter(search))
+    if country_id:
+        query = query.filter(Client.country_id == country_id)
+    if status == 'active':
+        query = query.filter(Client.active == True)
+    elif status == 'inactive':
+        query = query.filter(Client.active == False)
+    if manager_id:
+        query = query.join(Project, Project.client_id == Client.id) \
+            .filter(Project.manager_id == manager_id).distinct()
+    return query
+
+def _count(key):
+    """Count over the primary key only, without loading or ordering rows."""
+    query = query_clients(*key).order_by(None)
+    if key[3]:
+        return query.with_entities(func.count(Client.id.distinct())).scalar() or 0
+    return query.with_entities(func.count(Client.id)).scalar() or 0
+
+_lock = threading.Lock()
+_counts = {}
+_version = None
+
+def count_clients(search='', country_id=None, status='', manager_id=None):
+    """
+    Count the clients matching the filters of query_clients().
+    Counts are cached until a commit changes the clients or moves projects.
+
+    Returns:
+        int: The number of matching clients
+    """
+    global _version
+    key = ((search or '').strip().lower(), country_id or None, status or '', manager_id or None)
+    with _lock:
+        version = get_cache_version('client_counts')
+        if version != _version:
+            _counts.clear()
+            _version = version
+        count = _counts.get(key)
+    if count is not None:
+        return count
+
+    count = _count(key)
+    with _lock:
+        if _version == version:
+            if len(_counts) >= MAX_CACHED_COUNTS:
+                _counts.clear()
+            _counts[key] = count
+    return count
+
+def invalidate_client_counts():
+    """
+    Drop the cached client counts in every worker.
+    Called automatically after commits that change clients or move projects.
+    """
+    global _version
+    with _lock:
+        _counts.clear()
+        _version = None
+    bump_cache_version('client_counts')
+
+# Columns that decide which clients match a filter
+_COUNT_ATTRS = {
+    Client: ('name', 'country_id', 'active'),
+    Project: ('client_id', 'manager_id'),
+}
+
+track_cache_invalidation('client_counts_changed', invalidate_client_counts, models=_COUNT_ATTRS)
@@ -0,0 +1,157 @@
+"""
+Consultant assignments to project phases.
+
+Validation and serialization shared by the assignment API. Assignment
+dates default to the project's dates, and planned days are spread over the
+working days between them by the utilization engine (see utilization.py).
+"""
+from datetime import date
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload
+from .models import db, Consultant, ConsultantAssignment, ProjectGroup, ProjectPhase
+
+class AssignmentValidationError(ValueError):
+    """Raised when assignment data is invalid."""
+
+    def __init__(self, errors):
+        super().__init__('; '.join(errors))
+        self.errors = errors
+
+def _parse_date(value):
+    """Parse an ISO date string, or return None."""
+    if not isinstance(value, str) or not value:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        return None
+
+def validate_assignment(data, project, assignment=None):
+    """
+    Validate assignment data for a project.
+
+    Args:
+        data: Dict with 'consultant_id', 'phase_id', 'planned_days',
+            'start_date', 'end_date' (ISO dates) and optionally 'notes'. When
+            updating, missing keys keep the assignment's current values.
+        project: The project the phase must belong to
+        assignment: The assignment being updated, or None when creating
+
+    Returns:
+        dict: Column values for the assignment
+
+    Raises:
+        AssignmentValidationError: If the data is invalid
+    """
+    if not isinstance(data, dict):
+        raise AssignmentValidationError(['Expected an object'])
+
+    def current(attr):
+        return getattr(assignment, attr) if assignment is not None else None
+
+    errors = []
+    values = {}
+
+    for key in ('consultant_id', 'phase_id'):
+        value = data.get(key, current(key))
+        if isinstance(value, str) and value.strip().isdigit():
+            value = int(value)
+        if not isinstance(value, int) or isinstance(value, bool):
+            errors.append(f'Invalid {key}')
+        values[key] = value
+
+    planned_days = data.get('planned_days', current('planned_days'))
+    try:
+        planned_days = float(planned_days)
+    except (TypeError, ValueError):
+        planned_days = None
+    if planned_days is None or planned_days < 0:
+        errors.append('planned_days must be a non-negative number')
+    values['planned_days'] = planned_days
+
+    for key, default in (('start_date', project.start_date), ('end_date', project.end_date)):
+        if key in data:
+            value = _parse_date(data[key])
+            if value is None:
+                errors.append(f'Invalid {key}, expected YYYY-MM-DD')
+        else:
+            value = current(key) or default
+            if value is None:
+                errors.append(f'{key} is required when the project has no {key.replace("_", " ")}')
+        values[key] = value
+
+    if values['start_date'] and values['end_date'] and values['end_date'] < values['start_date']:
+        errors.append('end_date must not be before start_date')
+
+    notes = data.get('notes', current('notes'))
+    if notes is not None and not isinstance(notes, str):
+        errors.append('notes must be a string')
+    values['notes'] = notes
+
+    if errors:
+        raise AssignmentValidationError(errors)
+
+    # Check that the consultant exists and the phase belongs to the project
+    if db.session.get(Consultant, values['consultant_id']) is None:
+        errors.append(f"Consultant {values['consultant_id']} not found")
+    phase_project_id = db.session.scalar(
+        select(ProjectGroup.project_id)
+        .join(ProjectPhase, ProjectPhase.group_id == ProjectGroup.id)
+        .where(ProjectPhase.id == values['phase_id'])
+    )
+    if phase_project_id != project.id:
+        errors.append(f"Phase {values['phase_id']} not found in this project")
+
+    if errors:
+        raise AssignmentValidationError(errors)
+    return values
+
+def get_project_assignments(project_id):
+    """
+    Get a project's assignments with their consultants and phases loaded.
+
+    Args:
+        project_id: The id of the project
+
+    Returns:
+        list: ConsultantAssignment objects ordered by phase and start date
+    """
+    return ConsultantAssignment.query.join(ConsultantAssignment.phase).join(ProjectPhase.group).filter(
+        ProjectGroup.project_id == project_id
+    ).options(
+        joinedload(ConsultantAssignment.consultant).joinedload(Consultant.user),
+        joinedload(ConsultantAssignment.phase)
+    ).order_by(ProjectGroup.order, ProjectPhase.order, ConsultantAssignment.start_date, ConsultantAssignment.id).all()
+
+def is_assigned_to_project(user_id, project_id):
+    """Check whether a user has a consultant assignment in a project."""
+    return db.session.scalar(
+        select(ConsultantAssignment.id)
+        .join(Consultant, Consultant.id == ConsultantAssignment.consultant_id)
+        .join(ProjectPhase, ProjectPhase.id == ConsultantAssignment.phase_id)
+        .join(ProjectGroup, ProjectGroup.id == ProjectPhase.group_id)
+        .where(Consultant.user_id == user_id, ProjectGroup.project_id == project_id)
+        .limit(1)
+    ) is not None
+
+def serialize_assignment(assignment):
+    """
+    Serialize an assignment for JSON responses.
+
+    Args:
+        assignment: The ConsultantAssignment
+
+    Returns:
+        dict: The assignment's fields with consultant and phase names
+    """
+    return {
+        'id': assignment.id,
+        'consultant_id': assignment.consultant_id,
+        'consultant_name': assignment.consultant.full_name if assignment.consultant else '',
+        'phase_id': assignment.phase_id,
+        'phase_name': assignment.phase.name if assignment.phase else '',
+        'planned_days': assignment.planned_days,
+        'start_date': assignment.start_date.isoformat(),
+        'end_date': assignment.end_date.isoformat(),
+        'notes': assignment.notes or ''
+    }
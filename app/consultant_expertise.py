@@ -0,0 +1,349 @@
+"""
+Batch updates of consultant expertise ratings.
+
+A rating set for one or many consultants is validated in one pass (three
+queries, whatever its size) and applied in a single transaction: one DELETE
+per expertise type for cleared ratings and one multi-row upsert per type for
+the rest. Upserts use INSERT ... ON CONFLICT on SQLite and PostgreSQL, with
+the partial unique indexes on consultant_expertise as conflict targets, so
+concurrent saves cannot create duplicate rows; other databases update
+existing rows and insert the rest within the same transaction.
+
+The consultant x catalog rating matrix is built from one query and kept as
+serialized JSON until a commit changes consultants, expertise or the
+catalog. Invalidation bumps a shared version so every gunicorn worker
+rebuilds the matrix on its next request.
+"""
+import hashlib
+import json
+import threading
+from datetime import datetime
+from sqlalchemy import delete, func, literal, null, select, tuple_, union_all
+from .models import db, Consultant, ConsultantExpertise, ProductGroup, ProductElement
+from .utils import get_cache_version, bump_cache_version, note_bulk_changes, track_cache_invalidation
+
+# Expertise type -> (column of the rated item, model of the rated item)
+EXPERTISE_TYPES = {
+    'product_group': ('product_group_id', ProductGroup),
+    'product_element': ('product_element_id', ProductElement),
+}
+
+# Ratings accepted in one rating set
+MAX_BATCH_RATINGS = 5000
+# Rows per upsert or delete statement, keeping each statement well below the
+# bind parameter limit of SQLite (999 on older versions)
+STATEMENT_CHUNK_SIZE = 100
+
+class ExpertiseValidationError(ValueError):
+    """Raised when a rating set contains invalid entries."""
+
+    def __init__(self, errors):
+        super().__init__('; '.join(errors))
+        self.errors = errors
+
+def _parse_int(value):
+    """Parse a non-negative integer given as a number or a string, or return None."""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value)
+    return None
+
+def validate_expertise_ratings(entries):
+    """
+    Validate a rating set.
+
+    Args:
+        entries: Dicts with 'consultant_id', 'expertise_type' ('product_group'
+            or 'product_element'), 'item_id', 'rating' (0 clears the rating,
+            1-5 sets it) and optionally 'notes'
+
+    Returns:
+        list: Normalized entries; when an item is rated more than once the
+        last rating wins
+
+    Raises:
+        ExpertiseValidationError: If any entry is invalid
+    """
+    if len(entries) > MAX_BATCH_RATINGS:
+        raise ExpertiseValidationError([f'At most {MAX_BATCH_RATINGS} ratings can be saved at once'])
+
+    errors = []
+    ratings = {}
+    for index, entry in enumerate(entries):
+        if not isinstance(entry, dict):
+            errors.append(f'Entry {index}: expected an object')
+            continue
+
+        entry_errors = []
+        consultant_id = _parse_int(entry.get('consultant_id'))
+        expertise_type = entry.get('expertise_type')
+        item_id = _parse_int(entry.get('item_id'))
+        rating = _parse_int(entry.get('rating', 0))
+        notes = entry.get('notes')
+
+        if consultant_id is None:
+            entry_errors.append(f'Entry {index}: invalid consultant_id')
+        if expertise_type not in EXPERTISE_TYPES:
+            entry_errors.append(f'Entry {index}: invalid expertise_type {expertise_type!r}')
+        if item_id is None:
+            entry_errors.append(f'Entry {index}: invalid item_id')
+        if rating is None or not 0 <= rating <= 5:
+            entry_errors.append(f'Entry {index}: rating must be between 0 and 5')
+        if notes is not None and not isinstance(notes, str):
+            entry_errors.append(f'Entry {index}: notes must be a string')
+
+        if entry_errors:
+            errors.extend(entry_errors)
+        else:
+            ratings[(consultant_id, expertise_type, item_id)] = {
+                'consultant_id': consultant_id,
+                'expertise_type': expertise_type,
+                'item_id': item_id,
+                'rating': rating,
+                'notes': notes,
+            }
+
+    if errors:
+        raise ExpertiseValidationError(errors)
+
+    entries = list(ratings.values())
+
+    # Check that every referenced consultant and item exists
+    consultant_ids = {entry['consultant_id'] for entry in entries}
+    if consultant_ids:
+        found = set(db.session.scalars(select(Consultant.id).where(Consultant.id.in_(consultant_ids))))
+        errors.extend(f'Consultant {cid} not found' for cid in sorted(consultant_ids - found))
+    for expertise_type, (_, model) in EXPERTISE_TYPES.items():
+        item_ids = {entry['item_id'] for entry in entries if entry['expertise_type'] == expertise_type}
+        if item_ids:
+            found = set(db.session.scalars(select(model.id).where(model.id.in_(item_ids))))
+            label = 'Product group' if expertise_type == 'product_group' else 'Product element'
+            errors.extend(f'{label} {item_id} not found' for item_id in sorted(item_ids - found))
+
+    if errors:
+        raise ExpertiseValidationError(errors)
+    return entries
+
+def _upsert(rows, item_column):
+    """Insert or update expertise rows rated on the given item column."""
+    table = ConsultantExpertise.__table__
+    dialect = db.session.get_bind().dialect.name
+
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        stmt = dialect_insert(table).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.consultant_id, table.c[item_column]],
+            index_where=table.c[item_column].isnot(None),
+            set_={
+                'rating': stmt.excluded.rating,
+                # Entries without notes keep the notes already stored
+                'notes': func.coalesce(stmt.excluded.notes, table.c.notes),
+                'updated_at': stmt.excluded.updated_at,
+            }
+        )
+        db.session.execute(stmt)
+    else:
+        # No native upsert: update existing rows and insert the rest within
+        # the caller's transaction
+        keys = [(row['consultant_id'], row[item_column]) for row in rows]
+        existing = {
+            (consultant_id, item_id): row_id
+            for consultant_id, item_id, row_id in db.session.execute(
+                select(table.c.consultant_id, table.c[item_column], table.c.id)
+                .where(tuple_(table.c.consultant_id, table.c[item_column]).in_(keys))
+            )
+        }
+        for row in rows:
+            row_id = existing.get((row['consultant_id'], row[item_column]))
+            if row_id is None:
+                db.session.execute(table.insert().values(row))
+            else:
+                values = {'rating': row['rating'], 'updated_at': row['updated_at']}
+                if row['notes'] is not None:
+                    values['notes'] = row['notes']
+                db.session.execute(table.update().where(table.c.id == row_id).values(values))
+
+def apply_expertise_ratings(entries):
+    """
+    Apply a validated rating set. The caller commits.
+
+    Args:
+        entries: Entries returned by validate_expertise_ratings()
+
+    Returns:
+        dict: Number of ratings 'updated' (set or changed) and 'removed'
+    """
+    now = datetime.utcnow()
+    updated = removed = 0
+    # Bulk statements bypass the unit of work, so record whose expertise
+    # changed for caches that refresh per-consultant state after commit
+    note_bulk_changes(db.session, ConsultantExpertise.__tablename__,
+                      (entry['consultant_id'] for entry in entries))
+    for expertise_type, (item_column, _) in EXPERTISE_TYPES.items():
+        typed = [entry for entry in entries if entry['expertise_type'] == expertise_type]
+        column = getattr(ConsultantExpertise, item_column)
+
+        cleared = [(entry['consultant_id'], entry['item_id']) for entry in typed if entry['rating'] == 0]
+        for start in range(0, len(cleared), STATEMENT_CHUNK_SIZE):
+            chunk = cleared[start:start + STATEMENT_CHUNK_SIZE]
+            result = db.session.execute(
+                delete(ConsultantExpertise)
+                .where(tuple_(ConsultantExpertise.consultant_id, column).in_(chunk))
+                .execution_options(synchronize_session=False)
+            )
+            removed += result.rowcount
+
+        rows = [
+            {
+                'consultant_id': entry['consultant_id'],
+                'product_group_id': entry['item_id'] if expertise_type == 'product_group' else None,
+                'product_element_id': entry['item_id'] if expertise_type == 'product_element' else None,
+                'rating': entry['rating'],
+                'notes': entry['notes'],
+                'created_at': now,
+                'updated_at': now,
+            }
+            for entry in typed if entry['rating'] > 0
+        ]
+        for start in range(0, len(rows), STATEMENT_CHUNK_SIZE):
+            _upsert(rows[start:start + STATEMENT_CHUNK_SIZE], item_column)
+        updated += len(rows)
+
+    return {'updated': updated, 'removed': removed}
+
+_matrix_lock = threading.Lock()
+# Serialized matrix payloads keyed by format, and the version they were built under
+_matrix_cache = {}
+_matrix_version = None
+
+def invalidate_expertise_matrix():
+    """
+    Drop the cached expertise matrix in every worker.
+    Called automatically after commits that change consultants, expertise or
+    the catalog.
+    """
+    _matrix_cache.clear()
+    bump_cache_version('expertise_matrix')
+
+def _load_matrix_rows():
+    """
+    Load both axes and all ratings in one statement.
+
+    Returns rows of (kind, consultant_id, item_id, group_id, rating): one row
+    per consultant, one per product group, one per product element and one
+    per rating.
+    """
+    statement = union_all(
+        select(literal('consultant'), Consultant.id, null(), null(), null()),
+        select(literal('product_group'), null(), ProductGroup.id, null(), null()),
+        select(literal('product_element'), null(), ProductElement.id, ProductElement.group_id, null()),
+        select(literal('product_group_rating'), ConsultantExpertise.consultant_id,
+               ConsultantExpertise.product_group_id, null(), ConsultantExpertise.rating)
+        .where(ConsultantExpertise.product_group_id.isnot(None)),
+        select(literal('product_element_rating'), ConsultantExpertise.consultant_id,
+               ConsultantExpertise.product_element_id, null(), ConsultantExpertise.rating)
+        .where(ConsultantExpertise.product_element_id.isnot(None)),
+    )
+    return db.session.execute(statement).all()
+
+def build_expertise_matrix(dense=False):
+    """
+    Build the consultant x catalog rating matrix in columnar form.
+
+    Args:
+        dense: Return ratings as a row-major list with 0 for unrated items
+            instead of sparse (row, column, value) arrays
+
+    Returns:
+        dict: 'consultant_ids' (rows), 'item_types', 'item_ids' and
+        'item_group_ids' (columns; groups first, then elements, each ordered
+        by id; a group column's group id is its own id), and 'ratings'
+    """
+    consultant_ids = []
+    groups = []
+    elements = []
+    ratings = []
+    for kind, consultant_id, item_id, group_id, rating in _load_matrix_rows():
+        if kind == 'consultant':
+            consultant_ids.append(consultant_id)
+        elif kind == 'product_group':
+            groups.append((item_id, item_id))
+        elif kind == 'product_element':
+            elements.append((item_id, group_id))
+        else:
+            ratings.append((kind[:-len('_rating')], consultant_id, item_id, rating))
+
+    consultant_ids.sort()
+    groups.sort()
+    elements.sort()
+    row_index = {consultant_id: i for i, consultant_id in enumerate(consultant_ids)}
+    column_index = {('product_group', item_id): i for i, (item_id, _) in enumerate(groups)}
+    column_index.update({('product_element', item_id): len(groups) + i for i, (item_id, _) in enumerate(elements)})
+
+    cells = sorted(
+        (row_index[consultant_id], column_index[(item_type, item_id)], rating)
+        for item_type, consultant_id, item_id, rating in ratings
+        if consultant_id in row_index and (item_type, item_id) in column_index
+    )
+    matrix = {
+        'consultant_ids': consultant_ids,
+        'item_types': ['product_group'] * len(groups) + ['product_element'] * len(elements),
+        'item_ids': [item_id for item_id, _ in groups] + [item_id for item_id, _ in elements],
+        'item_group_ids': [group_id for _, group_id in groups] + [group_id for _, group_id in elements],
+    }
+    if dense:
+        column_count = len(matrix['item_ids'])
+        values = [0] * (len(consultant_ids) * column_count)
+        for row, column, rating in cells:
+            values[row * column_count + column] = rating
+        matrix['ratings'] = {'format': 'dense', 'shape': [len(consultant_ids), column_count], 'values': values}
+    else:
+        matrix['ratings'] = {
+            'format': 'sparse',
+            'rows': [row for row, _, _ in cells],
+            'columns': [column for _, column, _ in cells],
+            'values': [rating for _, _, rating in cells],
+        }
+    return matrix
+
+def get_expertise_matrix_json(dense=False):
+    """
+    Get the serialized expertise matrix, building it if it is not cached.
+
+    Args:
+        dense: Whether to use the dense rating layout
+
+    Returns:
+        tuple: (JSON body as bytes, ETag)
+    """
+    global _matrix_version
+    version = get_cache_version('expertise_matrix')
+    key = 'dense' if dense else 'sparse'
+    with _matrix_lock:
+        if version != _matrix_version:
+            _matrix_cache.clear()
+            _matrix_version = version
+        cached = _matrix_cache.get(key)
+        if cached is None:
+            body = json.dumps(build_expertise_matrix(dense=dense), separators=(',', ':')).encode('utf-8')
+            cached = (body, hashlib.sha1(body).hexdigest())
+            _matrix_cache[key] = cached
+    return cached
+
+# Rows that change the matrix, and the columns whose modification does (None
+# for any column); an element moves to another column group with its group_id
+_MATRIX_ATTRS = {
+    Consultant: None,
+    ConsultantExpertise: None,
+    ProductGroup: None,
+    ProductElement: ('group_id',),
+}
+
+track_cache_invalidation('expertise_matrix_stale', invalidate_expertise_matrix, models=_MATRIX_ATTRS)
@@ -0,0 +1,144 @@
+"""
+Consultant search.
+
+Compiles the consultant list filters (free text, status, expertise item and
+minimum rating) into a single SQL statement. Expertise matches are expressed
+as EXISTS subqueries on consultant_expertise, so the database does the
+matching instead of one query per matching catalog item.
+"""
+from sqlalchemy import exists, false, func, or_, select
+from .models import db, Consultant, User, ConsultantExpertise, ProductGroup, ProductElement
+
+def consultant_sort_keys():
+    """Sort keys of the consultant list: last name, first name, then id."""
+    return (
+        func.coalesce(User.last_name, ''),
+        func.coalesce(User.first_name, ''),
+        Consultant.id
+    )
+
+def parse_expertise_filter(expertise_filter):
+    """
+    Parse an expertise filter value of the form 'group_<id>' or 'element_<id>'.
+
+    Args:
+        expertise_filter: The filter value from the request
+
+    Returns:
+        tuple: ('group' or 'element', item id), or None if the value is invalid
+    """
+    kind, _, item_id = (expertise_filter or '').partition('_')
+    if kind not in ('group', 'element') or not item_id.isdigit():
+        return None
+    return kind, int(item_id)
+
+def _expertise_exists(*criteria, min_rating=None):
+    """Build an EXISTS predicate over the current consultant's expertise entries."""
+    predicate = exists().where(ConsultantExpertise.consultant_id == Consultant.id, *criteria)
+    if min_rating:
+        predicate = predicate.where(ConsultantExpertise.rating >= min_rating)
+    return predicate
+
+def search_consultants(search='', status='', expertise='', min_rating=None):
+    """
+    Build the consultant search query.
+
+    Args:
+        search: Text matched against the user's name and email and against the
+            names of product groups and elements the consultant has expertise in
+        status: Consultant status to filter by
+        expertise: Expertise item filter ('group_<id>' or 'element_<id>')
+        min_rating: Minimum rating (1-5) required for expertise matches
+
+    Returns:
+        Query: Consultants joined with their user, matching all filters
+    """
+    query = Consultant.query.join(User)
+
+    if search:
+        pattern = f'%{search}%'
+        user_match = or_(
+            User.first_name.ilike(pattern),
+            User.last_name.ilike(pattern),
+            User.email.ilike(pattern)
+        )
+        expertise_match = _expertise_exists(
+            or_(
+                ConsultantExpertise.product_group_id.in_(
+                    select(ProductGroup.id).where(ProductGroup.name.ilike(pattern))
+                ),
+                ConsultantExpertise.product_element_id.in_(
+                    select(ProductElement.id).where(ProductElement.label.ilike(pattern))
+                )
+            ),
+            min_rating=min_rating
+        )
+        query = query.filter(or_(user_match, expertise_match))
+
+    if status:
+        query = query.filter(Consultant.status == status)
+
+    if expertise:
+        parsed = parse_expertise_filter(expertise)
+        if parsed is None:
+            # Unknown filter values match no consultants
+            query = query.filter(false())
+        else:
+            kind, item_id = parsed
+            column = ConsultantExpertise.product_group_id if kind == 'group' else ConsultantExpertise.product_element_id
+            query = query.filter(_expertise_exists(column == item_id, min_rating=min_rating))
+    elif min_rating and not search:
+        query = query.filter(_expertise_exists(min_rating=min_rating))
+
+    return query
+
+def get_expertise_option(expertise_filter):
+    """
+    Get the filter option for an expertise filter value.
+
+    Args:
+        expertise_filter: The filter value ('group_<id>' or 'element_<id>')
+
+    Returns:
+        dict: The option with 'value', 'label' and 'type', or None if the
+        value is invalid or the item does not exist
+    """
+    parsed = parse_expertise_filter(expertise_filter)
+    if parsed is None:
+        return None
+    kind, item_id = parsed
+    if kind == 'group':
+        label = db.session.scalar(select(ProductGroup.name).where(ProductGroup.id == item_id))
+    else:
+        label = db.session.scalar(select(ProductElement.label).where(ProductElement.id == item_id))
+    if label is None:
+        return None
+    return {'value': expertise_filter, 'label': label, 'type': kind}
+
+def search_expertise_options(term='', limit=20):
+    """
+    Find expertise filter options whose name matches a search term.
+
+    Args:
+        term: Text matched against product group names and element labels
+        limit: Maximum number of options of each type
+
+    Returns:
+        list: Options with 'value', 'label' and 'type', groups first
+    """
+    pattern = f'%{term}%'
+    groups = db.session.execute(
+        select(ProductGroup.id, ProductGroup.name)
+        .where(ProductGroup.name.ilike(pattern))
+        .order_by(ProductGroup.name, ProductGroup.id)
+        .limit(limit)
+    )
+    elements = db.session.execute(
+        select(ProductElement.id, ProductElement.label)
+        .where(ProductElement.label.ilike(pattern))
+        .order_by(ProductElement.label, ProductElement.id)
+        .limit(limit)
+    )
+    options = [{'value': f'group_{id}', 'label': name, 'type': 'group'} for id, name in groups]
+    options.extend({'value': f'element_{id}', 'label': label, 'type': 'element'} for id, label in elements)
+    return options
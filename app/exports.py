@@ -0,0 +1,384 @@
+"""
+Streaming exports.
+
+Exports write the rows of a list view as CSV, NDJSON or XLSX while they are
+read: the query runs with yield_per, so rows come from a server-side cursor
+in batches, and every writer is a generator that hands the response a chunk
+of encoded output every few hundred rows. Neither the result set nor the
+file is ever held in memory, whatever the number of rows.
+
+XLSX files are written without a spreadsheet library: the workbook parts
+are fixed, and the worksheet is written row by row into a ZIP stream with
+inline strings, so no shared string table has to be collected first.
+
+Each dataset below is built from the same filter functions as its list view,
+so an export contains exactly the rows the list shows, on all pages.
+"""
+import csv
+import io
+import json
+import re
+import zipfile
+from collections import namedtuple
+from datetime import date, datetime
+from decimal import Decimal
+from xml.sax.saxutils import escape
+from flask import current_app, stream_with_context
+from sqlalchemy import case, func, literal
+from sqlalchemy.orm import aliased
+from .models import db, Client, Consultant, ConsultantExpertise, ListItem, ProductElement, ProductGroup, Project, User
+from .client_search import client_sort_keys, query_clients
+from .consultant_search import consultant_sort_keys, search_consultants
+from .project_search import project_sort_keys, search_projects
+
+# Rows fetched from the database cursor at a time
+EXPORT_BATCH_SIZE = 1000
+# Rows written between two chunks of output
+ROWS_PER_CHUNK = 500
+
+ExportFormat = namedtuple('ExportFormat', ['mimetype', 'extension', 'writer'])
+
+class ExportFormatError(ValueError):
+    """Raised when an export is requested in an unknown format."""
+
+class ExportDataset(namedtuple('ExportDataset', ['filename', 'columns', 'statement'])):
+    """
+    Rows to export: the file name without extension, (key, header) per
+    column, and the select statement producing one row per line, starting
+    with the columns in order.
+    """
+    __slots__ = ()
+
+def _text(value):
+    """A cell value as text for CSV: ISO dates, empty for missing values."""
+    if value is None:
+        return ''
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+# Leading characters that make spreadsheet programs read text as a formula
+_FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+def _csv_text(value):
+    """A cell value for CSV, with text that would be read as a formula quoted."""
+    value = _text(value)
+    if isinstance(value, str) and value.startswith(_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+def _json_default(value):
+    """Serialize dates as ISO strings and decimals as numbers in NDJSON."""
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f'Cannot export {type(value).__name__} values')
+
+def csv_chunks(columns, rows):
+    """
+    Write rows as CSV with a header row.
+    Starts with a byte order mark, so spreadsheet programs detect UTF-8;
+    the client CSV import accepts it too.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')
+    writer.writerow([header for _, header in columns])
+    for count, row in enumerate(rows, 1):
+        writer.writerow([_csv_text(value) for value in row])
+        if count % ROWS_PER_CHUNK == 0:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+def ndjson_chunks(columns, rows):
+    """Write rows as newline-delimited JSON objects keyed by column."""
+    keys = [key for key, _ in columns]
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(keys, row)), default=_json_default, ensure_ascii=False))
+        if len(lines) >= ROWS_PER_CHUNK:
+            yield ('\n'.join(lines) + '\n').encode('utf-8')
+            lines.clear()
+    if lines:
+        yield ('\n'.join(lines) + '\n').encode('utf-8')
+
+# Characters XML 1.0 does not allow, even escaped
+_INVALID_XML = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+_XLSX_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    '</Types>'
+)
+_XLSX_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+_XLSX_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="{name}" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+_XLSX_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+    '<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>'
+    '</Relationships>'
+)
+# Style 1 is the bold header row
+_XLSX_STYLES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font><font><b/><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="2"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/></cellXfs>'
+    '</styleSheet>'
+)
+_XLSX_SHEET_START = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+)
+_XLSX_SHEET_END = '</sheetData></worksheet>'
+
+def _xlsx_cell(value, style=''):
+    """
+    One worksheet cell: numbers and booleans typed, everything else inline
+    text. Text is never written as a formula, so values starting with '='
+    show as typed and need no quoting.
+    """
+    if value is None:
+        return '<c/>'
+    if isinstance(value, bool):
+        return f'<c t="b"{style}><v>{int(value)}</v></c>'
+    if isinstance(value, (int, float, Decimal)):
+        return f'<c{style}><v>{value}</v></c>'
+    text = escape(_INVALID_XML.sub('', str(_text(value))))
+    return f'<c t="inlineStr"{style}><is><t xml:space="preserve">{text}</t></is></c>'
+
+class _ChunkSink:
+    """Write-only file object collecting the bytes the ZIP writer produces."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        """Return and forget the bytes written so far."""
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+def xlsx_chunks(columns, rows, sheet_name='Export'):
+    """
+    Write rows as a single-sheet XLSX workbook with a bold header row.
+    The ZIP file is streamed: entries carry their sizes in data descriptors,
+    so nothing is seeked back to.
+    """
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as workbook:
+        workbook.writestr('[Content_Types].xml', _XLSX_CONTENT_TYPES)
+        workbook.writestr('_rels/.rels', _XLSX_ROOT_RELS)
+        workbook.writestr('xl/workbook.xml', _XLSX_WORKBOOK.format(name=escape(sheet_name[:31])))
+        workbook.writestr('xl/_rels/workbook.xml.rels', _XLSX_WORKBOOK_RELS)
+        workbook.writestr('xl/styles.xml', _XLSX_STYLES)
+        # The size is unknown until the end, so allow more than 4 GB
+        with workbook.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            header = ''.join(_xlsx_cell(name, ' s="1"') for _, name in columns)
+            sheet.write(f'{_XLSX_SHEET_START}<row>{header}</row>'.encode('utf-8'))
+            for count, row in enumerate(rows, 1):
+                sheet.write(f'<row>{"".join(_xlsx_cell(value) for value in row)}</row>'.encode('utf-8'))
+                if count % ROWS_PER_CHUNK == 0:
+                    yield sink.take()
+            sheet.write(_XLSX_SHEET_END.encode('utf-8'))
+    yield sink.take()
+
+EXPORT_FORMATS = {
+    'csv': ExportFormat('text/csv', 'csv', csv_chunks),
+    'ndjson': ExportFormat('application/x-ndjson', 'ndjson', ndjson_chunks),
+    'xlsx': ExportFormat('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx', xlsx_chunks),
+}
+
+def stream_rows(statement, width, batch_size=EXPORT_BATCH_SIZE):
+    """
+    Iterate over the first width columns of the rows of a statement, fetched
+    from a server-side cursor in batches.
+    """
+    result = db.session.execute(statement.execution_options(yield_per=batch_size))
+    try:
+        for row in result:
+            yield tuple(row[:width])
+    finally:
+        result.close()
+
+def export_response(dataset, export_format):
+    """
+    Build a streaming download of a dataset.
+    Must be called in a request; the request context is kept for the
+    lifetime of the stream.
+
+    Args:
+        dataset: The ExportDataset to write
+        export_format: 'csv', 'ndjson' or 'xlsx'
+
+    Returns:
+        Response: The download, written while the rows are read
+
+    Raises:
+        ExportFormatError: If the format is unknown
+    """
+    spec = EXPORT_FORMATS.get(export_format)
+    if spec is None:
+        raise ExportFormatError(f"Unknown export format {export_format!r}, expected one of {', '.join(EXPORT_FORMATS)}")
+    chunks = spec.writer(dataset.columns, stream_rows(dataset.statement, len(dataset.columns)))
+    response = current_app.response_class(stream_with_context(chunks), mimetype=spec.mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename={dataset.filename}.{spec.extension}'
+    # Pass chunks on as they are written instead of buffering the file in a proxy
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+def client_export(search='', country_id=None, status='', manager_id=None):
+    """
+    Clients matching the client list filters, by name.
+
+    Returns:
+        ExportDataset: The clients to export
+    """
+    columns = (
+        ('id', 'ID'),
+        ('name', 'Name'),
+        ('address', 'Address'),
+        ('city', 'City'),
+        ('country', 'Country'),
+        ('sales_person', 'Sales Person'),
+        ('project_manager', 'Project Manager'),
+        ('industry', 'Industry'),
+        ('active', 'Active'),
+        ('created_at', 'Created'),
+    )
+    statement = query_clients(search=search, country_id=country_id, status=status, manager_id=manager_id) \
+        .outerjoin(ListItem, ListItem.id == Client.country_id) \
+        .with_entities(
+            Client.id, Client.name, Client.address, Client.city, ListItem.value,
+            Client.sales_person, Client.project_manager, Client.industry, Client.active, Client.created_at,
+            # Selected for the DISTINCT of the manager scope; not exported
+            *client_sort_keys()
+        ) \
+        .order_by(*client_sort_keys()).statement
+    return ExportDataset('clients', columns, statement)
+
+def project_export(search='', status='', client_id=None, manager_id=None):
+    """
+    Projects matching the project list filters, newest first.
+
+    Returns:
+        ExportDataset: The projects to export
+    """
+    columns = (
+        ('id', 'ID'),
+        ('name', 'Name'),
+        ('client', 'Client'),
+        ('manager', 'Manager'),
+        ('status', 'Status'),
+        ('start_date', 'Start Date'),
+        ('end_date', 'End Date'),
+        ('description', 'Description'),
+        ('created_at', 'Created'),
+    )
+    manager_name = func.trim(func.coalesce(User.first_name, '') + literal(' ') + func.coalesce(User.last_name, ''))
+    statement = search_projects(search=search, status=status, client_id=client_id, manager_id=manager_id) \
+        .outerjoin(Client, Client.id == Project.client_id) \
+        .outerjoin(User, User.id == Project.manager_id) \
+        .with_entities(
+            Project.id, Project.name, Client.name, manager_name, Project.status,
+            Project.start_date, Project.end_date, Project.description, Project.created_at
+        ) \
+        .order_by(*[key.desc() for key in project_sort_keys()]).statement
+    return ExportDataset('projects', columns, statement)
+
+def consultant_export(search='', status='', expertise='', min_rating=None):
+    """
+    Consultants matching the consultant list filters, by name.
+
+    Returns:
+        ExportDataset: The consultants to export
+    """
+    columns = (
+        ('id', 'ID'),
+        ('first_name', 'First Name'),
+        ('last_name', 'Last Name'),
+        ('email', 'Email'),
+        ('status', 'Status'),
+        ('availability_days_per_month', 'Availability (days/month)'),
+        ('start_date', 'Start Date'),
+        ('end_date', 'End Date'),
+        ('calendar_name', 'Calendar'),
+    )
+    statement = search_consultants(search=search, status=status, expertise=expertise, min_rating=min_rating) \
+        .with_entities(
+            Consultant.id, User.first_name, User.last_name, User.email, Consultant.status,
+            Consultant.availability_days_per_month, Consultant.start_date, Consultant.end_date,
+            Consultant.calendar_name
+        ) \
+        .order_by(*consultant_sort_keys()).statement
+    return ExportDataset('consultants', columns, statement)
+
+def expertise_export(search='', status='', expertise='', min_rating=None):
+    """
+    Expertise ratings of the consultants matching the consultant list
+    filters, one row per rating, by consultant and then catalog item.
+
+    Returns:
+        ExportDataset: The ratings to export
+    """
+    columns = (
+        ('consultant_id', 'Consultant ID'),
+        ('first_name', 'First Name'),
+        ('last_name', 'Last Name'),
+        ('item_type', 'Type'),
+        ('product_group', 'Product Group'),
+        ('product_element', 'Product Element'),
+        ('rating', 'Rating'),
+    )
+    # Element ratings name the group of the element
+    element_group = aliased(ProductGroup)
+    statement = search_consultants(search=search, status=status, expertise=expertise, min_rating=min_rating) \
+        .join(ConsultantExpertise, ConsultantExpertise.consultant_id == Consultant.id) \
+        .outerjoin(ProductElement, ProductElement.id == ConsultantExpertise.product_element_id) \
+        .outerjoin(element_group, element_group.id == ProductElement.group_id) \
+        .outerjoin(ProductGroup, ProductGroup.id == ConsultantExpertise.product_group_id) \
+        .with_entities(
+            Consultant.id, User.first_name, User.last_name,
+            case((ConsultantExpertise.product_element_id.isnot(None), 'element'), else_='group'),
+            func.coalesce(ProductGroup.name, element_group.name), ProductElement.label,
+            ConsultantExpertise.rating
+        ) \
+        .order_by(
+            *consultant_sort_keys(),
+            func.coalesce(ProductGroup.name, element_group.name),
+            ConsultantExpertise.product_element_id.isnot(None),
+            ProductElement.label,
+            ConsultantExpertise.id
+        ).statement
+    return ExportDataset('expertise', columns, statement)
@@ -0,0 +1,265 @@
+"""
+Non-blocking logging pipeline used by setup_logger().
+
+Loggers only put records on an in-memory queue. A QueueListener thread per
+logger, started lazily in each worker process, formats the records and
+writes them to the console and the log file, so request threads never wait
+on disk I/O or on traceback formatting.
+
+Log files rotate by size, or on a schedule when LOG_ROTATE_WHEN is set, and
+rotated files are gzipped. Worker processes share log files: a worker that
+finds the file rotated by another worker reopens it instead of rotating
+again, and rollovers are serialized with a lock file. The most recent
+rotated file is only compressed at the next rollover, because workers that
+have not noticed the rotation yet may still append to it.
+
+Settings (environment variables):
+    LOG_LEVEL         Level of loggers created without one (default INFO)
+    LOG_MAX_BYTES     Rotate when a file reaches this size (default 10 MB)
+    LOG_BACKUP_COUNT  Number of rotated files to keep (default 5)
+    LOG_ROTATE_WHEN   Rotate on a schedule instead of by size, e.g. 'midnight'
+
+Chatty messages can be sampled: pass extra={'sample': N} to log only every
+Nth occurrence of a message template, or give setup_logger() a sample_every
+default for all records below WARNING.
+"""
+import atexit
+import copy
+import gzip
+import itertools
+import logging
+import logging.handlers
+import os
+import queue
+import shutil
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows
+    fcntl = None
+
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_BACKUP_COUNT = 5
+
+def _compress(source, dest):
+    """Gzip a rotated log file and remove the original."""
+    with open(source, 'rb') as f_in, gzip.open(dest, 'wb') as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+@contextmanager
+def _rollover_lock(path):
+    """Serialize rollovers of a log file across worker processes."""
+    if fcntl is None:
+        yield
+        return
+    with open(f'{path}.lock', 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+class _SharedRotationMixin:
+    """Rotation that is safe when several processes write the same file."""
+
+    def _reopen_if_rotated(self):
+        """Reopen the log file if another process rotated it."""
+        if self.stream is None:
+            return False
+        try:
+            current = os.stat(self.baseFilename).st_ino
+        except FileNotFoundError:
+            current = None
+        if current == os.fstat(self.stream.fileno()).st_ino:
+            return False
+        self.stream.close()
+        self.stream = self._open()
+        if hasattr(self, 'computeRollover'):
+            # The other process rolled over this period already
+            self.rolloverAt = self.computeRollover(int(os.path.getmtime(self.baseFilename)))
+        return True
+
+    def emit(self, record):
+        try:
+            self._reopen_if_rotated()
+            if self.shouldRollover(record):
+                with _rollover_lock(self.baseFilename):
+                    if not self._reopen_if_rotated() and self.shouldRollover(record):
+                        self.doRollover()
+            logging.FileHandler.emit(self, record)
+        except Exception:
+            self.handleError(record)
+
+class GzipRotatingFileHandler(_SharedRotationMixin, logging.handlers.RotatingFileHandler):
+    """
+    Size-based rotating file handler that gzips rotated files.
+    Files are named name.1, name.2.gz, name.3.gz, ...
+    """
+
+    def __init__(self, filename, max_bytes=DEFAULT_MAX_BYTES, backup_count=DEFAULT_BACKUP_COUNT):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, delay=True)
+
+    def doRollover(self):
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+        if self.backupCount > 0:
+            base = self.baseFilename
+            for i in range(self.backupCount - 1, 1, -1):
+                if os.path.exists(f'{base}.{i}.gz'):
+                    os.replace(f'{base}.{i}.gz', f'{base}.{i + 1}.gz')
+            if os.path.exists(f'{base}.1'):
+                if self.backupCount > 1:
+                    _compress(f'{base}.1', f'{base}.2.gz')
+                else:
+                    os.remove(f'{base}.1')
+            os.replace(base, f'{base}.1')
+
+class GzipTimedRotatingFileHandler(_SharedRotationMixin, logging.handlers.TimedRotatingFileHandler):
+    """
+    Time-based rotating file handler that gzips rotated files.
+    Files are named name.<date>, with all but the most recent ending in .gz.
+    """
+
+    def __init__(self, filename, when='midnight', backup_count=DEFAULT_BACKUP_COUNT):
+        super().__init__(filename, when=when, backupCount=backup_count, delay=True)
+        self.rotator = self._rotate
+
+    def _rotate(self, source, dest):
+        """Compress the previously rotated file, then rotate the current one."""
+        directory, name = os.path.split(self.baseFilename)
+        for file_name in os.listdir(directory):
+            path = os.path.join(directory, file_name)
+            if file_name.startswith(f'{name}.') and not file_name.endswith(('.gz', '.lock')) and path != dest:
+                _compress(path, f'{path}.gz')
+        os.replace(source, dest)
+
+def create_file_handler(log_file):
+    """
+    Create a rotating file handler configured from the environment.
+
+    Args:
+        log_file (str): Path to the log file
+
+    Returns:
+        logging.Handler: The file handler
+    """
+    backup_count = int(os.environ.get('LOG_BACKUP_COUNT', DEFAULT_BACKUP_COUNT))
+    when = os.environ.get('LOG_ROTATE_WHEN')
+    if when:
+        return GzipTimedRotatingFileHandler(log_file, when=when, backup_count=backup_count)
+    max_bytes = int(os.environ.get('LOG_MAX_BYTES', DEFAULT_MAX_BYTES))
+    return GzipRotatingFileHandler(log_file, max_bytes=max_bytes, backup_count=backup_count)
+
+class SamplingFilter(logging.Filter):
+    """
+    Pass only every Nth occurrence of a message template.
+
+    N comes from the record's 'sample' attribute (extra={'sample': N}) or,
+    for records below WARNING, from the filter's default. Warnings and
+    errors are never sampled unless the call asks for it.
+    """
+
+    def __init__(self, sample_every=1):
+        super().__init__()
+        self.sample_every = sample_every
+        self._counters = {}
+
+    def filter(self, record):
+        every = getattr(record, 'sample', None)
+        if every is None:
+            every = self.sample_every if record.levelno < logging.WARNING else 1
+        if every <= 1:
+            return True
+        key = (record.name, record.msg)
+        counter = self._counters.get(key)
+        if counter is None:
+            counter = self._counters.setdefault(key, itertools.count())
+        # itertools.count is advanced atomically under the GIL
+        return next(counter) % every == 0
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler that leaves formatting to the listener thread.
+
+    Only the message itself is interpolated in the calling thread, so that
+    arguments such as ORM objects are rendered where they are valid; the
+    formatter, timestamps and tracebacks are handled by the listener.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+class _ProcessListener:
+    """A queue listener that is (re)started lazily in each process."""
+
+    def __init__(self, handlers):
+        self.queue = queue.SimpleQueue()
+        self.handlers = handlers
+        self._listener = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        """Start the listener thread if it is not running in this process."""
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            # After a fork the parent's listener thread does not exist here
+            self.queue = queue.SimpleQueue()
+            self._listener = logging.handlers.QueueListener(self.queue, *self.handlers, respect_handler_level=True)
+            self._listener.start()
+            self._pid = pid
+
+    def stop(self):
+        """Flush queued records and stop the listener thread."""
+        if self._listener is not None and self._pid == os.getpid():
+            self._listener.stop()
+            self._pid = None
+
+class ProcessQueueHandler(DeferredQueueHandler):
+    """Queue handler that starts its listener on first use in each process."""
+
+    def __init__(self, listener):
+        super().__init__(listener.queue)
+        self.listener = listener
+
+    def enqueue(self, record):
+        self.listener.ensure_started()
+        self.listener.queue.put_nowait(record)
+
+_listeners = []
+
+def attach_queue_handler(logger, handlers, sample_every=1):
+    """
+    Route a logger through a queue to the given handlers.
+
+    Args:
+        logger (logging.Logger): The logger to configure
+        handlers (list): Handlers run on the listener thread
+        sample_every (int): Default sampling rate for records below WARNING
+
+    Returns:
+        logging.Handler: The queue handler attached to the logger
+    """
+    listener = _ProcessListener(handlers)
+    _listeners.append(listener)
+    queue_handler = ProcessQueueHandler(listener)
+    queue_handler.addFilter(SamplingFilter(sample_every))
+    logger.addHandler(queue_handler)
+    return queue_handler
+
+@atexit.register
+def stop_listeners():
+    """Flush and stop all listener threads of this process."""
+    for listener in _listeners:
+        listener.stop()
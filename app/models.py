@@ -1,9 +1,16 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
+from sqlalchemy import event
 from datetime import datetime
+import logging
 
 db = SQLAlchemy()
 
+logger = logging.getLogger('consultants')
+
+# Availability of consultant records created for users granted the Consultant role
+DEFAULT_AVAILABILITY_DAYS = 20
+
 # User model for authentication and role-based access control
 class User(db.Model, UserMixin):
     """
@@ -95,6 +102,18 @@ class ConsultantExpertise(db.Model):
     Ensures only meaningful expertise (rating 1-5) is stored.
     """
     __tablename__ = 'consultant_expertise'
+    # One rating per consultant and item. Group and element entries leave the
+    # other column NULL, and NULLs never collide in a unique index, so each
+    # kind gets its own partial index. They are also the conflict targets of
+    # the expertise upserts.
+    __table_args__ = (
+        db.Index('uq_consultant_expertise_group', 'consultant_id', 'product_group_id', unique=True,
+                 sqlite_where=db.text('product_group_id IS NOT NULL'),
+                 postgresql_where=db.text('product_group_id IS NOT NULL')),
+        db.Index('uq_consultant_expertise_element', 'consultant_id', 'product_element_id', unique=True,
+                 sqlite_where=db.text('product_element_id IS NOT NULL'),
+                 postgresql_where=db.text('product_element_id IS NOT NULL')),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     consultant_id = db.Column(db.Integer, db.ForeignKey('consultants.id', ondelete='CASCADE'), nullable=False)
@@ -197,6 +216,13 @@ class Client(db.Model):
     def __repr__(self):
         return f'<Client {self.name}>'
 
+# Keyset pagination of the client list by name ignoring case, alone and
+# combined with the status or country filter; name prefix searches use the
+# same indexes
+db.Index('ix_clients_name_id', db.func.lower(Client.name), Client.id)
+db.Index('ix_clients_active_name_id', Client.active, db.func.lower(Client.name), Client.id)
+db.Index('ix_clients_country_name_id', Client.country_id, db.func.lower(Client.name), Client.id)
+
 # Project template model
 class ProjectTemplate(db.Model):
     """
@@ -249,6 +275,12 @@ class Project(db.Model):
     Stores project information and status.
     """
     __tablename__ = 'projects'
+    __table_args__ = (
+        # Keyset pagination of the project list
+        db.Index('ix_projects_created_at_id', 'created_at', 'id'),
+        # Clients of a project manager, without reading the projects table
+        db.Index('ix_projects_manager_client', 'manager_id', 'client_id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
@@ -262,11 +294,12 @@ class Project(db.Model):
     status_id = db.Column(db.Integer, db.ForeignKey('list_items.id'))
     industry_id = db.Column(db.Integer, db.ForeignKey('list_items.id'))
     profit_center_id = db.Column(db.Integer, db.ForeignKey('list_items.id'))
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    structure_version = db.Column(db.Integer, nullable=False, default=1, server_default='1')  # Incremented on every save of groups and phases
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Relationships
-    products = db.relationship('ProductService', secondary='project_products', lazy='subquery',
+    products = db.relationship('ProductService', secondary='project_products', lazy='select',
                               backref=db.backref('projects', lazy=True))
     groups = db.relationship('ProjectGroup', backref='project', lazy=True, cascade="all, delete-orphan", order_by="ProjectGroup.order")
     industry = db.relationship('ListItem', foreign_keys=[industry_id])
@@ -289,6 +322,7 @@ class ProjectGroup(db.Model):
     project_id = db.Column(db.Integer, db.ForeignKey('projects.id', ondelete='CASCADE'), nullable=False)
     product_group_id = db.Column(db.Integer, db.ForeignKey('product_groups.id'), nullable=False)
     order = db.Column(db.Integer, default=0)
+    parallel = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())  # Starts together with the previous group
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -324,6 +358,36 @@ class ProjectPhase(db.Model):
     def __repr__(self):
         return f'<ProjectPhase {self.name} for Group {self.group_id}>'
 
+# Consultant assignment model
+class ConsultantAssignment(db.Model):
+    """
+    Consultant Assignment model.
+    Links a consultant to a project phase with the planned effort and dates.
+    """
+    __tablename__ = 'consultant_assignments'
+    __table_args__ = (
+        db.Index('ix_consultant_assignments_consultant_dates', 'consultant_id', 'start_date', 'end_date'),
+        db.CheckConstraint('planned_days >= 0', name='ck_consultant_assignments_planned_days'),
+        db.CheckConstraint('end_date >= start_date', name='ck_consultant_assignments_dates'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    consultant_id = db.Column(db.Integer, db.ForeignKey('consultants.id', ondelete='CASCADE'), nullable=False)
+    phase_id = db.Column(db.Integer, db.ForeignKey('project_phases.id', ondelete='CASCADE'), nullable=False, index=True)
+    planned_days = db.Column(db.Float, nullable=False, default=0)  # Effort spread over the working days between the dates
+    start_date = db.Column(db.Date, nullable=False)
+    end_date = db.Column(db.Date, nullable=False)
+    notes = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    # Relationships
+    consultant = db.relationship('Consultant', backref=db.backref('assignments', lazy=True, cascade="all, delete-orphan"))
+    phase = db.relationship('ProjectPhase', backref=db.backref('assignments', lazy=True, cascade="all, delete-orphan"))
+    
+    def __repr__(self):
+        return f'<ConsultantAssignment consultant {self.consultant_id} to Phase {self.phase_id}>'
+
 # Product group model
 class ProductGroup(db.Model):
     """
@@ -413,6 +477,27 @@ class Role(db.Model):
     name = db.Column(db.String(20), unique=True, nullable=False)
     description = db.Column(db.String(100))
 
+@event.listens_for(User.roles, 'append')
+def create_consultant_on_role_grant(user, role, initiator):
+    """
+    Create the consultant record when a user is granted the Consultant role.
+    Keeps role assignments and consultant records consistent wherever the role
+    is granted (user management, consultant form, scripts).
+    """
+    if role.name != 'Consultant':
+        return
+    
+    # Don't flush the half-applied role change while checking for a record
+    with db.session.no_autoflush:
+        has_consultant = bool(user.consultants)
+    
+    if not has_consultant:
+        user.consultants.append(Consultant(
+            status='Active',
+            availability_days_per_month=DEFAULT_AVAILABILITY_DAYS
+        ))
+        logger.info("Created consultant record for user: %s", user.username)
+
 # TODO: Add Task model for project task management
 # TODO: Add Document model for file attachments
 # TODO: Add Calendar/Event models for consultant scheduling
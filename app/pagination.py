@@ -0,0 +1,112 @@
+"""
+Keyset pagination.
+
+Pages are addressed by the sort key of the last row shown instead of an
+OFFSET, so fetching any page costs the same as fetching the first one and
+rows inserted or deleted between requests do not shift the pages. The key
+of the last row is handed to the client as an opaque, URL-safe cursor.
+
+Sort keys must be non-null and must end with a unique column (usually the
+primary key) so the order is total; wrap nullable columns in coalesce().
+"""
+import base64
+import binascii
+import json
+from collections import namedtuple
+from datetime import date, datetime
+from sqlalchemy import and_, or_
+
+KeysetPage = namedtuple('KeysetPage', ['items', 'next_cursor', 'has_next'])
+
+def _json_default(value):
+    """Serialize dates in cursors as ISO strings."""
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f'Cannot encode {type(value).__name__} in a cursor')
+
+def encode_cursor(values):
+    """
+    Encode sort key values as an opaque cursor.
+
+    Args:
+        values: The sort key values of the last row of a page
+
+    Returns:
+        str: A URL-safe cursor
+    """
+    payload = json.dumps(list(values), default=_json_default, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+def _coerce(value, sort_key):
+    """Convert a decoded cursor value back to the sort key's Python type."""
+    try:
+        python_type = sort_key.type.python_type
+    except NotImplementedError:
+        return value
+    if python_type is datetime and isinstance(value, str):
+        return datetime.fromisoformat(value)
+    if python_type is date and isinstance(value, str):
+        return date.fromisoformat(value)
+    return value
+
+def decode_cursor(cursor, sort_keys):
+    """
+    Decode a cursor produced by encode_cursor().
+
+    Args:
+        cursor: The cursor from the request
+        sort_keys: The sort key expressions the cursor was built for
+
+    Returns:
+        list: The sort key values, or None if the cursor is missing or invalid
+    """
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        if not isinstance(values, list) or len(values) != len(sort_keys):
+            return None
+        return [_coerce(value, key) for value, key in zip(values, sort_keys)]
+    except (ValueError, TypeError, UnicodeError, binascii.Error):
+        return None
+
+def _after(sort_keys, values, descending):
+    """Build the predicate selecting rows that sort after the given key values."""
+    # (a, b, c) > (x, y, z) expanded as
+    # a > x OR (a = x AND b > y) OR (a = x AND b = y AND c > z)
+    clauses = []
+    for i, (key, value) in enumerate(zip(sort_keys, values)):
+        equal = [k == v for k, v in zip(sort_keys[:i], values[:i])]
+        clauses.append(and_(*equal, key < value if descending else key > value))
+    return or_(*clauses)
+
+def paginate_keyset(query, sort_keys, cursor=None, per_page=25, descending=False):
+    """
+    Fetch one page of a query ordered by the given sort keys.
+
+    Args:
+        query: The query to paginate, without ORDER BY or LIMIT
+        sort_keys: Non-null column expressions that totally order the rows
+        cursor: The cursor of the previous page, or None for the first page
+        per_page: The number of rows per page
+        descending: Whether to sort in descending order
+
+    Returns:
+        KeysetPage: The rows of the page, the cursor of the next page (None on
+        the last page) and whether there is a next page
+    """
+    sort_keys = list(sort_keys)
+    values = decode_cursor(cursor, sort_keys)
+    if values is not None:
+        query = query.filter(_after(sort_keys, values, descending))
+
+    order_by = [key.desc() if descending else key.asc() for key in sort_keys]
+    labels = [key.label(f'_keyset_{i}') for i, key in enumerate(sort_keys)]
+    rows = query.add_columns(*labels).order_by(*order_by).limit(per_page + 1).all()
+
+    has_next = len(rows) > per_page
+    rows = rows[:per_page]
+    items = [row[0] for row in rows]
+    next_cursor = encode_cursor(rows[-1][1:]) if has_next else None
+    return KeysetPage(items, next_cursor, has_next)
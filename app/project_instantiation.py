@@ -0,0 +1,211 @@
+"""
+Bulk project instantiation.
+
+Creates projects with their groups, phases and products from plain data in
+a fixed number of statements, whatever the number of projects or the size
+of their structure: one multi-row INSERT ... RETURNING for the projects, one
+for their groups, one INSERT for all phases and one for their products
+(those of their templates and any given explicitly). Nothing is committed,
+so the route, the API and scripts decide where the transaction ends.
+"""
+from datetime import date
+from sqlalchemy import insert, select
+from .models import (db, Client, ListItem, Project, ProjectGroup, ProjectPhase, ProjectTemplate, ProductService, User,
+                     project_products, template_products)
+from .project_structure import (StructureValidationError, _parse_id, parse_structure, check_structure_references,
+                                insert_returning_ids)
+
+# Project columns that can be set on creation
+PROJECT_FIELDS = (
+    'name', 'description', 'client_id', 'manager_id', 'template_id', 'start_date', 'end_date',
+    'status', 'status_id', 'industry_id', 'profit_center_id'
+)
+
+# Fields holding ids; form values arrive as strings
+_ID_FIELDS = ('client_id', 'manager_id', 'template_id', 'status_id', 'industry_id', 'profit_center_id')
+# The rows the id fields reference
+_ID_TARGETS = {
+    'client_id': Client,
+    'manager_id': User,
+    'template_id': ProjectTemplate,
+    'status_id': ListItem,
+    'industry_id': ListItem,
+    'profit_center_id': ListItem,
+}
+# Text fields with a maximum length
+_TEXT_FIELDS = ('name', 'status')
+
+def _prepare(spec, index):
+    """Validate one project spec and parse its structure."""
+    label = f'Project {index + 1}'
+    if not isinstance(spec, dict):
+        raise StructureValidationError([f'{label}: expected an object'])
+    values = spec.get('project') or {}
+    unknown = sorted(set(values) - set(PROJECT_FIELDS))
+    errors = [f'{label}: unknown field {key!r}' for key in unknown]
+    if not values.get('name'):
+        errors.append(f'{label}: name is required')
+    for key in _TEXT_FIELDS:
+        value = values.get(key)
+        length = getattr(Project, key).type.length
+        if value is not None and (not isinstance(value, str) or len(value) > length):
+            errors.append(f'{label}: {key} must be a string of at most {length} characters')
+    values = dict(values)
+    for key in _ID_FIELDS:
+        if key in values:
+            values[key] = _parse_id(values[key])
+            if values[key] is False:
+                errors.append(f'{label}: invalid {key}')
+    for key in ('start_date', 'end_date'):
+        if isinstance(values.get(key), str):
+            try:
+                values[key] = date.fromisoformat(values[key]) if values[key] else None
+            except ValueError:
+                errors.append(f'{label}: invalid {key}, expected YYYY-MM-DD')
+    start_date, end_date = values.get('start_date'), values.get('end_date')
+    if start_date and end_date and not errors and start_date > end_date:
+        errors.append(f'{label}: end_date must not be before start_date')
+    try:
+        groups = parse_structure(spec.get('groups') or [])
+    except StructureValidationError as e:
+        errors.extend(f'{label}: {error}' for error in e.errors)
+        groups = []
+    if errors:
+        raise StructureValidationError(errors)
+    for group in groups:
+        # A new project has no rows to keep
+        group['id'] = None
+        for phase in group['phases']:
+            phase['id'] = None
+    row = dict.fromkeys(PROJECT_FIELDS)
+    row.update(values)
+    # The template whose products are copied, if any
+    product_template_id = row['template_id'] if spec.get('template_products', True) else None
+    return row, groups, list(spec.get('product_ids') or ()), product_template_id
+
+def _check_project_references(rows):
+    """
+    Check that the ids of all project rows exist, with one query per
+    referenced table.
+
+    Raises:
+        StructureValidationError: Listing every missing reference by project
+    """
+    wanted = {}
+    for row in rows:
+        for key, model in _ID_TARGETS.items():
+            if row[key] is not None:
+                wanted.setdefault(model, set()).add(row[key])
+    found = {
+        model: set(db.session.scalars(select(model.id).where(model.id.in_(ids))))
+        for model, ids in wanted.items()
+    }
+    errors = [
+        f'Project {index + 1}: {key[:-3]} {row[key]} not found'
+        for index, row in enumerate(rows)
+        for key, model in _ID_TARGETS.items()
+        if row[key] is not None and row[key] not in found[model]
+    ]
+    if errors:
+        raise StructureValidationError(errors)
+
+def instantiate_projects(specs):
+    """
+    Create projects with their structure and products in bulk.
+    The caller commits.
+
+    Args:
+        specs: Dicts with 'project' (column values, see PROJECT_FIELDS),
+            optionally 'groups' (the structure, in the format accepted by
+            the project editor) and 'product_ids'. Products of the project's
+            template are copied as well unless 'template_products' is False.
+
+    Returns:
+        list: The ids of the new projects, in the order of the specs
+
+    Raises:
+        StructureValidationError: If a spec is invalid or references missing rows
+    """
+    prepared = [_prepare(spec, index) for index, spec in enumerate(specs)]
+    if not prepared:
+        return []
+
+    # Validate references of all projects at once
+    _check_project_references([row for row, _, _, _ in prepared])
+    check_structure_references([group for _, groups, _, _ in prepared for group in groups])
+    product_ids = {product_id for _, _, ids, _ in prepared for product_id in ids}
+    if product_ids:
+        found = set(db.session.scalars(select(ProductService.id).where(ProductService.id.in_(product_ids))))
+        missing = sorted(product_ids - found)
+        if missing:
+            raise StructureValidationError([f'Product {product_id} not found' for product_id in missing])
+
+    project_ids = insert_returning_ids(Project, [row for row, _, _, _ in prepared])
+
+    group_rows = []
+    group_phases = []
+    for project_id, (_, groups, _, _) in zip(project_ids, prepared):
+        for order, group in enumerate(groups):
+            group_rows.append({
+                'project_id': project_id,
+                'product_group_id': group['product_group_id'],
+                'order': order,
+                'parallel': bool(group['parallel']),
+            })
+            group_phases.append(group['phases'])
+    group_ids = insert_returning_ids(ProjectGroup, group_rows)
+
+    phase_rows = [
+        {
+            'group_id': group_id,
+            'name': phase['name'],
+            'description': phase['description'],
+            'duration_id': phase['duration_id'],
+            'online': phase['online'],
+            'status': phase['status'] or 'Not Started',
+            'order': order,
+        }
+        for group_id, phases in zip(group_ids, group_phases)
+        for order, phase in enumerate(phases)
+    ]
+    if phase_rows:
+        # render_nulls keeps rows with and without a duration in one batch
+        db.session.execute(insert(ProjectPhase).execution_options(render_nulls=True), phase_rows)
+
+    # Products of the templates, loaded once for all projects
+    template_ids = {template_id for _, _, _, template_id in prepared if template_id}
+    template_product_ids = {}
+    if template_ids:
+        for template_id, product_id in db.session.execute(
+            select(template_products.c.template_id, template_products.c.product_id)
+            .where(template_products.c.template_id.in_(template_ids))
+        ):
+            template_product_ids.setdefault(template_id, []).append(product_id)
+
+    product_rows = [
+        {'project_id': project_id, 'product_id': product_id}
+        for project_id, (_, _, ids, template_id) in zip(project_ids, prepared)
+        for product_id in dict.fromkeys(template_product_ids.get(template_id, []) + ids)
+    ]
+    if product_rows:
+        db.session.execute(insert(project_products), product_rows)
+
+    return project_ids
+
+def instantiate_project(values, groups=None, product_ids=None):
+    """
+    Create one project with its structure and products.
+    The caller commits.
+
+    Args:
+        values: Column values of the project, see PROJECT_FIELDS
+        groups: The structure, in the format accepted by the project editor
+        product_ids: Products to add besides those of the template
+
+    Returns:
+        int: The id of the new project
+
+    Raises:
+        StructureValidationError: If the data is invalid
+    """
+    return instantiate_projects([{'project': values, 'groups': groups, 'product_ids': product_ids}])[0]
@@ -0,0 +1,230 @@
+"""
+Bulk project rollout.
+
+Rolls one source out to many clients: either an existing project, whose
+groups, phases and products are cloned, or a project template, whose
+product groups become the project's groups with one phase per product
+element, as the project creation form does. Every target row names a client
+and optionally a manager, start date, end date and name.
+
+Target rows are validated together and invalid rows are reported instead of
+failing the rollout; the valid rows are created through the bulk
+instantiation path in one transaction, so the number of statements does not
+depend on the number of clients.
+"""
+from collections import namedtuple
+from datetime import date
+from sqlalchemy import select
+from .models import db, Client, ProductElement, ProductGroup, ProductService, Project, ProjectTemplate, User
+from .project_instantiation import instantiate_projects
+from .project_tree import load_project_tree
+from .reference_data import get_list
+
+# Maximum number of projects created by one rollout
+MAX_ROLLOUT_TARGETS = 500
+# Status of rolled out projects
+DEFAULT_ROLLOUT_STATUS = 'Preparation'
+
+class RolloutResult(namedtuple('RolloutResult', ['created', 'failed'])):
+    """
+    Outcome of a rollout: created lists (row index, project id) and failed
+    (row index, error messages), both in row order.
+    """
+    __slots__ = ()
+
+class RolloutSourceError(ValueError):
+    """Raised when the rollout source is missing or cannot be cloned."""
+
+def _project_source(project_id):
+    """(name, manager id, date span, base spec) of a project to clone."""
+    project, tree = load_project_tree(project_id, with_products=True)
+    if project is None:
+        raise RolloutSourceError(f'Project {project_id} not found')
+    groups = [
+        {
+            'product_group_id': group.product_group_id,
+            'parallel': group.parallel,
+            'phases': [
+                {
+                    'name': phase.name,
+                    'description': phase.description,
+                    'duration_id': phase.duration_id,
+                    'online': phase.online,
+                }
+                for phase in group.phases
+            ]
+        }
+        for group in tree.groups
+    ]
+    span = project.end_date - project.start_date if project.start_date and project.end_date else None
+    base = {
+        'project': {
+            'description': project.description,
+            'template_id': project.template_id,
+            'industry_id': project.industry_id,
+            'profit_center_id': project.profit_center_id,
+        },
+        'groups': groups,
+        'product_ids': [product.id for product in project.products],
+        # The products of the source are copied as they are now
+        'template_products': False,
+    }
+    return project.name, project.manager_id, span, base
+
+def _template_source(template_id):
+    """(name, manager id, date span, base spec) of a template to roll out."""
+    template = db.session.get(ProjectTemplate, template_id)
+    if template is None:
+        raise RolloutSourceError(f'Template {template_id} not found')
+    product_group_ids = list(dict.fromkeys(db.session.scalars(
+        select(ProductService.group_id)
+        .where(ProductService.id.in_([product.id for product in template.products]))
+        .order_by(ProductService.id)
+    )))
+    group_durations = dict(db.session.execute(
+        select(ProductGroup.id, ProductGroup.duration_id).where(ProductGroup.id.in_(product_group_ids))
+    ).all())
+    elements = {}
+    for group_id, label, activity in db.session.execute(
+        select(ProductElement.group_id, ProductElement.label, ProductElement.activity)
+        .where(ProductElement.group_id.in_(product_group_ids))
+        .order_by(ProductElement.group_id, ProductElement.id)
+    ):
+        elements.setdefault(group_id, []).append({
+            'name': label,
+            'description': activity,
+            'duration_id': group_durations.get(group_id),
+        })
+    base = {
+        'project': {'description': template.description, 'template_id': template.id},
+        'groups': [
+            {'product_group_id': group_id, 'phases': elements.get(group_id, [])}
+            for group_id in product_group_ids
+        ],
+    }
+    return template.name, template.manager_id, None, base
+
+def _parse_date(value):
+    """Parse an optional date or YYYY-MM-DD string, or return False if invalid."""
+    if value is None or value == '' or isinstance(value, date):
+        return value or None
+    try:
+        return date.fromisoformat(value)
+    except (TypeError, ValueError):
+        return False
+
+def _parse_id(value):
+    """Parse an optional id, or return False if it is not an integer."""
+    if value is None or value == '':
+        return None
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    return False
+
+def rollout_projects(targets, project_id=None, template_id=None):
+    """
+    Create one project per target from a source project or template.
+    The caller commits.
+
+    Args:
+        targets: Dicts with 'client_id' and optionally 'manager_id'
+            (defaults to the source's manager), 'start_date', 'end_date'
+            (defaults to the start date plus the source project's span)
+            and 'name' (defaults to "<source name> - <client name>")
+        project_id: The project to clone
+        template_id: The template to roll out, if no project is given
+
+    Returns:
+        RolloutResult: The created projects and the rejected rows
+
+    Raises:
+        RolloutSourceError: If the source is missing or invalid
+        StructureValidationError: If the source structure references
+            missing product groups, durations or products
+    """
+    if project_id:
+        source_name, source_manager_id, span, base = _project_source(project_id)
+    elif template_id:
+        source_name, source_manager_id, span, base = _template_source(template_id)
+    else:
+        raise RolloutSourceError('A source project or template is required')
+    if not isinstance(targets, list) or not targets:
+        raise RolloutSourceError('Expected a non-empty list of targets')
+    if len(targets) > MAX_ROLLOUT_TARGETS:
+        raise RolloutSourceError(f'At most {MAX_ROLLOUT_TARGETS} targets can be rolled out at once')
+
+    # Clients and managers of all rows, loaded once; ids that are not
+    # integers are rejected with their row below
+    row_ids = {}
+    for index, row in enumerate(targets):
+        if isinstance(row, dict):
+            manager_id = _parse_id(row.get('manager_id'))
+            row_ids[index] = (_parse_id(row.get('client_id')),
+                              source_manager_id if manager_id is None else manager_id)
+    client_ids = {client_id for client_id, _ in row_ids.values() if client_id}
+    manager_ids = {manager_id for _, manager_id in row_ids.values() if manager_id}
+    client_names = dict(db.session.execute(select(Client.id, Client.name).where(Client.id.in_(client_ids))).all())
+    known_managers = set(db.session.scalars(select(User.id).where(User.id.in_(manager_ids))))
+
+    statuses = get_list('ProjectStatusList')
+    status_id = statuses.id_for(DEFAULT_ROLLOUT_STATUS) if statuses else None
+
+    specs = []
+    indexes = []
+    failed = []
+    for index, row in enumerate(targets):
+        if not isinstance(row, dict):
+            failed.append((index, ['Expected an object']))
+            continue
+        errors = []
+        client_id, manager_id = row_ids[index]
+        start_date = _parse_date(row.get('start_date'))
+        end_date = _parse_date(row.get('end_date'))
+        if client_id is False:
+            errors.append('client_id must be an integer')
+        elif client_id not in client_names:
+            errors.append(f'Client {client_id} not found')
+        if manager_id is False:
+            errors.append('manager_id must be an integer')
+        elif manager_id is not None and manager_id not in known_managers:
+            errors.append(f'Manager {manager_id} not found')
+        if start_date is False:
+            errors.append('Invalid start_date, expected YYYY-MM-DD')
+        if end_date is False:
+            errors.append('Invalid end_date, expected YYYY-MM-DD')
+        if not errors and end_date is None and start_date and span is not None:
+            end_date = start_date + span
+        if not errors and start_date and end_date and start_date > end_date:
+            errors.append('end_date must not be before start_date')
+        name = row.get('name') or f'{source_name} - {client_names.get(client_id, "")}'
+        if not isinstance(name, str) or len(name) > Project.name.type.length:
+            errors.append(f'Name must be a string of at most {Project.name.type.length} characters')
+        if errors:
+            failed.append((index, errors))
+            continue
+        specs.append(dict(base, project=dict(
+            base['project'],
+            name=name,
+            client_id=client_id,
+            manager_id=manager_id,
+            start_date=start_date,
+            end_date=end_date,
+            status=DEFAULT_ROLLOUT_STATUS,
+            status_id=status_id,
+        )))
+        indexes.append(index)
+
+    project_ids = instantiate_projects(specs) if specs else []
+    return RolloutResult(created=list(zip(indexes, project_ids)), failed=failed)
+
+def describe_rollout(result):
+    """
+    Serialize a rollout result for JSON responses.
+
+    Returns:
+        dict: 'created' with row and project_id, 'failed' with row and errors
+    """
+    return {
+        'created': [{'row': index, 'project_id': project_id} for index, project_id in result.created],
+        'failed': [{'row': index, 'errors': errors} for index, errors in result.failed],
+    }
@@ -0,0 +1,343 @@
+"""
+Project schedules.
+
+Phase durations are PhaseDuration list items whose meaning lives in their
+value ("0,5", "1", "2 dana", "1 week", "1/3"). They are parsed once into
+working days and a phase without a duration takes the one of its product
+group.
+
+Groups are laid out one after another from the project's start date, their
+phases one after another inside each group. A group flagged as parallel
+starts together with the previous group, and the next sequential group waits
+for the longest group of such a block, so the critical path of a project is
+the longest group of every block. Fractional durations share working days
+(Monday to Friday): two half-day phases take one day.
+
+Schedules are cached per project until a commit changes a project's dates or
+structure or a product group's duration, or the duration list is reloaded;
+both are tracked by shared versions that all workers check.
+schedule_projects() lays out the whole portfolio in one pass of three
+queries.
+"""
+import math
+import re
+import threading
+from collections import namedtuple
+from datetime import timedelta
+from functools import lru_cache
+from sqlalchemy import select
+from .models import db, ProductGroup, Project, ProjectGroup, ProjectPhase
+from .reference_data import get_list_item
+from .utils import get_cache_version, bump_cache_version, track_cache_invalidation
+
+# Projects left out of portfolio schedules
+CLOSED_PROJECT_STATUSES = ('Paid', 'Inactive')
+# Maximum number of cached schedules per worker
+MAX_CACHED_SCHEDULES = 512
+
+# Working days per duration unit, in English and Croatian
+_UNIT_DAYS = {
+    'h': 1 / 8, 'hour': 1 / 8, 'hours': 1 / 8, 'sat': 1 / 8, 'sata': 1 / 8, 'sati': 1 / 8,
+    'd': 1, 'day': 1, 'days': 1, 'dan': 1, 'dana': 1,
+    'w': 5, 'week': 5, 'weeks': 5, 'tjedan': 5, 'tjedna': 5, 'tjedana': 5,
+    'month': 20, 'months': 20, 'mjesec': 20, 'mjeseca': 20, 'mjeseci': 20,
+}
+_DURATION_RE = re.compile(r'^(\d+\s*/\s*\d+|\d+(?:[.,]\d+)?)?\s*([^\d\s/.,]*)$')
+
+@lru_cache(maxsize=256)
+def parse_duration(value):
+    """
+    Parse a duration value into working days.
+
+    Args:
+        value: A PhaseDuration value such as "0,5", "2 dana" or "1 week";
+            a bare number counts days
+
+    Returns:
+        float: The number of working days, or None if the value is not understood
+    """
+    text = (value or '').strip().lower()
+    if text in ('pola dana', 'half day', 'half a day'):
+        return 0.5
+    match = _DURATION_RE.match(text)
+    if not match or not text:
+        return None
+    number, unit = match.groups()
+    if number is None:
+        amount = 1.0
+    elif '/' in number:
+        numerator, denominator = (int(part) for part in number.split('/'))
+        if not denominator:
+            return None
+        amount = numerator / denominator
+    else:
+        amount = float(number.replace(',', '.'))
+    factor = _UNIT_DAYS.get(unit) if unit else 1
+    return amount * factor if factor is not None else None
+
+def duration_days(duration_id):
+    """Get the working days of a duration list item, or None if unknown."""
+    item = get_list_item(duration_id) if duration_id else None
+    if item is None:
+        return None
+    days = parse_duration(item.value)
+    return days if days is not None else parse_duration(item.description)
+
+def _next_working_day(day):
+    """The day itself if it is a working day, else the following Monday."""
+    return day + timedelta(days=7 - day.weekday()) if day.weekday() >= 5 else day
+
+def _add_working_days(day, count):
+    """The date count working days after day, which must be a working day."""
+    weeks, rest = divmod(count, 5)
+    day += timedelta(weeks=weeks)
+    for _ in range(rest):
+        day = _next_working_day(day + timedelta(days=1))
+    return day
+
+ScheduledPhase = namedtuple('ScheduledPhase', [
+    'id', 'name', 'duration_days', 'start_offset', 'end_offset', 'start_date', 'end_date', 'critical'
+])
+
+ScheduledGroup = namedtuple('ScheduledGroup', [
+    'id', 'name', 'parallel', 'start_offset', 'end_offset', 'start_date', 'end_date', 'critical', 'phases'
+])
+
+class ProjectSchedule(namedtuple('ProjectSchedule', [
+    'project_id', 'name', 'start_date', 'end_date', 'deadline', 'working_days', 'unknown_durations', 'groups'
+])):
+    """The laid out groups and phases of a project; dates are None without a start date."""
+    __slots__ = ()
+
+    @property
+    def late(self):
+        """Whether the schedule ends after the project's end date."""
+        return bool(self.end_date and self.deadline and self.end_date > self.deadline)
+
+    def phase(self, phase_id):
+        """Get the scheduled phase with the given id, or None."""
+        return next((phase for group in self.groups for phase in group.phases if phase.id == phase_id), None)
+
+    def to_dict(self):
+        """Convert the schedule to plain dicts and lists for JSON responses."""
+        def day(value):
+            return value.isoformat() if value else None
+
+        return {
+            'project_id': self.project_id,
+            'name': self.name,
+            'start_date': day(self.start_date),
+            'end_date': day(self.end_date),
+            'deadline': day(self.deadline),
+            'late': self.late,
+            'working_days': self.working_days,
+            'unknown_durations': self.unknown_durations,
+            'groups': [
+                dict(
+                    group._asdict(),
+                    start_date=day(group.start_date),
+                    end_date=day(group.end_date),
+                    phases=[
+                        dict(phase._asdict(), start_date=day(phase.start_date), end_date=day(phase.end_date))
+                        for phase in group.phases
+                    ]
+                )
+                for group in self.groups
+            ]
+        }
+
+def _dates(start, start_offset, end_offset):
+    """Map working day offsets from a start date to (first day, last day)."""
+    if start is None:
+        return None, None
+    # Round away float noise such as 3 * 0.3 before taking whole days
+    first = math.floor(round(start_offset, 6))
+    last = max(first, math.ceil(round(end_offset, 6)) - 1)
+    return _add_working_days(start, first), _add_working_days(start, last)
+
+def build_schedule(project, groups):
+    """
+    Lay out the groups and phases of a project.
+
+    Args:
+        project: (id, name, start_date, end_date) of the project
+        groups: (id, name, parallel, duration_id, phases) tuples in order,
+            with duration_id the product group's duration and phases
+            (id, name, duration_id) tuples in order
+
+    Returns:
+        ProjectSchedule: The schedule
+    """
+    project_id, name, start_date, deadline = project
+    start = _next_working_day(start_date) if start_date else None
+
+    # Offsets and lengths of every group, and the blocks of parallel groups
+    laid_out = []
+    blocks = []
+    block_start = block_end = 0.0
+    unknown = 0
+    for index, (group_id, group_name, parallel, group_duration_id, phases) in enumerate(groups):
+        if not (parallel and index):
+            block_start = block_end
+            blocks.append([])
+        offset = block_start
+        phase_offsets = []
+        for phase_id, phase_name, duration_id in phases:
+            days = duration_days(duration_id or group_duration_id)
+            if days is None:
+                unknown += 1
+            phase_offsets.append((phase_id, phase_name, days, offset, offset + (days or 0)))
+            offset += days or 0
+        blocks[-1].append(len(laid_out))
+        laid_out.append((group_id, group_name, bool(parallel and index), block_start, offset, phase_offsets))
+        block_end = max(block_end, offset)
+
+    # The longest groups of every block form the critical path
+    critical = set()
+    for block in blocks:
+        longest = max(laid_out[index][4] for index in block)
+        critical.update(index for index in block if round(laid_out[index][4] - longest, 6) == 0)
+
+    scheduled = []
+    for index, (group_id, group_name, parallel, group_start, group_end, phase_offsets) in enumerate(laid_out):
+        phases = tuple(
+            ScheduledPhase(phase_id, phase_name, days, phase_start, phase_end,
+                           *_dates(start, phase_start, phase_end), index in critical)
+            for phase_id, phase_name, days, phase_start, phase_end in phase_offsets
+        )
+        scheduled.append(ScheduledGroup(group_id, group_name, parallel, group_start, group_end,
+                                        *_dates(start, group_start, group_end), index in critical, phases))
+
+    _, end_date = _dates(start, 0, block_end)
+    return ProjectSchedule(
+        project_id=project_id,
+        name=name,
+        start_date=start,
+        end_date=end_date,
+        deadline=deadline,
+        working_days=round(block_end, 6),
+        unknown_durations=unknown,
+        groups=tuple(scheduled)
+    )
+
+def _load_schedules(project_filter):
+    """Build the schedules of the projects matching a filter in three queries."""
+    projects = db.session.execute(
+        select(Project.id, Project.name, Project.start_date, Project.end_date)
+        .where(project_filter)
+        .order_by(Project.start_date, Project.id)
+    ).all()
+    if not projects:
+        return []
+    project_ids = select(Project.id).where(project_filter)
+
+    groups = {}
+    groups_by_project = {}
+    for group_id, project_id, parallel, name, duration_id in db.session.execute(
+        select(ProjectGroup.id, ProjectGroup.project_id, ProjectGroup.parallel, ProductGroup.name, ProductGroup.duration_id)
+        .outerjoin(ProductGroup, ProductGroup.id == ProjectGroup.product_group_id)
+        .where(ProjectGroup.project_id.in_(project_ids))
+        .order_by(ProjectGroup.project_id, ProjectGroup.order, ProjectGroup.id)
+    ):
+        groups[group_id] = (group_id, name or 'Unknown', parallel, duration_id, [])
+        groups_by_project.setdefault(project_id, []).append(groups[group_id])
+
+    for phase_id, group_id, name, duration_id in db.session.execute(
+        select(ProjectPhase.id, ProjectPhase.group_id, ProjectPhase.name, ProjectPhase.duration_id)
+        .join(ProjectGroup, ProjectGroup.id == ProjectPhase.group_id)
+        .where(ProjectGroup.project_id.in_(project_ids))
+        .order_by(ProjectPhase.group_id, ProjectPhase.order, ProjectPhase.id)
+    ):
+        groups[group_id][4].append((phase_id, name, duration_id))
+
+    return [build_schedule(project, groups_by_project.get(project.id, ())) for project in projects]
+
+_lock = threading.Lock()
+_schedules = {}
+_version = None
+
+def _current_version():
+    """The shared versions the cached schedules depend on."""
+    return get_cache_version('project_schedules'), get_cache_version('reference_data')
+
+def _store(version, schedules):
+    """Cache schedules built for the given version."""
+    with _lock:
+        if _version != version:
+            return
+        for schedule in schedules:
+            if len(_schedules) >= MAX_CACHED_SCHEDULES:
+                _schedules.clear()
+            _schedules[schedule.project_id] = schedule
+
+def get_project_schedule(project_id):
+    """
+    Get the schedule of a project, computing it if it is not cached.
+
+    Args:
+        project_id: The id of the project
+
+    Returns:
+        ProjectSchedule: The schedule, or None if the project does not exist
+    """
+    global _version
+    with _lock:
+        version = _current_version()
+        if version != _version:
+            _schedules.clear()
+            _version = version
+        schedule = _schedules.get(project_id)
+    if schedule is not None:
+        return schedule
+
+    schedules = _load_schedules(Project.id == project_id)
+    _store(version, schedules)
+    return schedules[0] if schedules else None
+
+def schedule_projects(statuses=None):
+    """
+    Schedule every active project in one pass, for portfolio timelines.
+
+    Args:
+        statuses: Only include projects with these statuses; by default all
+            projects with a start date that are not closed
+
+    Returns:
+        list: ProjectSchedule per project, by start date
+    """
+    global _version
+    with _lock:
+        version = _current_version()
+        if version != _version:
+            _schedules.clear()
+            _version = version
+
+    project_filter = Project.start_date.isnot(None)
+    if statuses:
+        project_filter &= Project.status.in_(statuses)
+    else:
+        project_filter &= Project.status.is_(None) | Project.status.notin_(CLOSED_PROJECT_STATUSES)
+    schedules = _load_schedules(project_filter)
+    _store(version, schedules)
+    return schedules
+
+def invalidate_project_schedules():
+    """
+    Drop the cached schedules in every worker.
+    Called automatically after commits that change project dates or structure.
+    """
+    global _version
+    with _lock:
+        _schedules.clear()
+        _version = None
+    bump_cache_version('project_schedules')
+
+# Columns that move phases in a schedule
+_SCHEDULE_ATTRS = {
+    Project: ('name', 'start_date', 'end_date'),
+    ProjectGroup: ('project_id', 'order', 'parallel', 'product_group_id'),
+    ProjectPhase: ('group_id', 'name', 'order', 'duration_id'),
+    ProductGroup: ('name', 'duration_id'),
+}
+
+track_cache_invalidation('project_schedules_changed', invalidate_project_schedules, models=_SCHEDULE_ATTRS)
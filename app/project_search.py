@@ -0,0 +1,139 @@
+"""
+Project search.
+
+Compiles the project list filters (search text, status, client and manager)
+into a single query and counts its matches without rescanning the projects
+table on every page view: counts are cached per filter combination until a
+commit adds or deletes a project or changes one of the filtered columns.
+Text searches go through the full-text index (see search_index) and their
+counts are not cached, since phase and client changes affect them too. The cache
+is invalidated through a shared version, so every gunicorn worker drops its
+counts on the next request.
+"""
+import threading
+from sqlalchemy import func, select
+from .models import db, Client, Project, ListItem
+from .utils import get_cache_version, bump_cache_version, track_cache_invalidation
+from .search_index import project_search_filter, search_index_available
+from .client_lookup import MIN_QUERY_LENGTH, search_client_ids
+
+# Maximum number of cached counts per worker
+MAX_CACHED_COUNTS = 256
+
+def project_sort_keys():
+    """Sort keys of the project list: creation time, then id (newest first)."""
+    return (Project.created_at, Project.id)
+
+def search_projects(search='', status='', client_id=None, manager_id=None):
+    """
+    Build the project search query.
+
+    Args:
+        search: Words matched as prefixes against project names and
+            descriptions, phases and client names
+        status: Project status to filter by
+        client_id: Client to filter by
+        manager_id: Project manager to filter by
+
+    Returns:
+        Query: Projects matching all filters
+    """
+    query = Project.query
+    search_filter = project_search_filter(search)
+    if search_filter is not None:
+        query = query.filter(search_filter)
+    if status:
+        query = query.filter(Project.status == status)
+    if client_id:
+        query = query.filter(Project.client_id == client_id)
+    if manager_id:
+        query = query.filter(Project.manager_id == manager_id)
+    return query
+
+def _count(key):
+    """Count over the primary key only, without loading or ordering rows."""
+    return search_projects(*key).with_entities(func.count(Project.id)).order_by(None).scalar() or 0
+
+_lock = threading.Lock()
+_counts = {}
+_version = None
+
+def count_projects(search='', status='', client_id=None, manager_id=None):
+    """
+    Count the projects matching the filters of search_projects().
+    Counts are cached until a commit changes the projects table, except for
+    text searches answered by the full-text index.
+
+    Returns:
+        int: The number of matching projects
+    """
+    global _version
+    key = (search or '', status or '', client_id or None, manager_id or None)
+    if key[0].strip() and search_index_available():
+        # These also match phases and clients, which do not invalidate counts
+        return _count(key)
+    with _lock:
+        version = get_cache_version('project_counts')
+        if version != _version:
+            _counts.clear()
+            _version = version
+        count = _counts.get(key)
+    if count is not None:
+        return count
+
+    count = _count(key)
+    with _lock:
+        if _version == version:
+            if len(_counts) >= MAX_CACHED_COUNTS:
+                _counts.clear()
+            _counts[key] = count
+    return count
+
+def invalidate_project_counts():
+    """
+    Drop the cached project counts in every worker.
+    Called automatically after commits that change the projects table.
+    """
+    global _version
+    with _lock:
+        _counts.clear()
+        _version = None
+    bump_cache_version('project_counts')
+
+def search_client_options(term='', limit=10):
+    """
+    Find client filter options whose name matches a search term.
+
+    Args:
+        term: Text matched against client names
+        limit: Maximum number of options
+
+    Returns:
+        list: Options with 'id', 'name', 'city' and 'country'; names starting
+        with the term first, by name
+    """
+    query = (
+        select(Client.id, Client.name, Client.city, ListItem.value)
+        .outerjoin(ListItem, ListItem.id == Client.country_id)
+    )
+    if len(term.strip()) < MIN_QUERY_LENGTH:
+        rows = db.session.execute(
+            query.where(Client.name.ilike(f'%{term}%')).order_by(Client.name, Client.id).limit(limit)
+        )
+    else:
+        # Matched in the client name index, then loaded by primary key
+        client_ids = search_client_ids(term, limit)
+        order = {client_id: position for position, client_id in enumerate(client_ids)}
+        rows = sorted(
+            db.session.execute(query.where(Client.id.in_(client_ids))),
+            key=lambda row: order[row[0]]
+        ) if client_ids else []
+    return [
+        {'id': client_id, 'name': name, 'city': city or '', 'country': country or ''}
+        for client_id, name, city, country in rows
+    ]
+
+# Project columns the list can be filtered by
+_FILTER_ATTRS = ('name', 'status', 'client_id', 'manager_id')
+
+track_cache_invalidation('project_counts_changed', invalidate_project_counts, models={Project: _FILTER_ATTRS})
@@ -0,0 +1,314 @@
+"""
+Structural updates of projects.
+
+The project editor submits the whole group and phase structure with the ids
+of existing rows. The structure is compared with the stored one and only the
+difference is written, in one transaction: new rows are inserted with one
+multi-row INSERT per table, changed rows (including moved and reordered
+ones) are updated with one executemany UPDATE per table, and removed rows
+are deleted with one DELETE per table. Group and phase ids therefore stay
+stable across saves, and so do the consultant assignments that reference
+phases.
+
+Each project carries a structure_version that is incremented on every
+structural save. A save names the version it was based on and is rejected
+if another save happened in between.
+"""
+from sqlalchemy import delete, insert, select, update
+from .models import db, ConsultantAssignment, ListItem, ProductGroup, Project, ProjectGroup, ProjectPhase
+
+PHASE_STATUSES = ('Not Started', 'In Progress', 'Completed')
+
+class StructureValidationError(ValueError):
+    """Raised when a submitted structure contains invalid entries."""
+
+    def __init__(self, errors):
+        super().__init__('; '.join(errors))
+        self.errors = errors
+
+class StructureConflictError(Exception):
+    """Raised when the structure was changed since the editor loaded it."""
+
+    def __init__(self, current_version):
+        super().__init__(f'The project structure was changed by someone else (version {current_version})')
+        self.current_version = current_version
+
+def _parse_id(value):
+    """Parse an optional positive integer id, or return False if invalid."""
+    if value is None or value == '':
+        return None
+    if isinstance(value, bool):
+        return False
+    if isinstance(value, int):
+        return value if value > 0 else False
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value)
+    return False
+
+def parse_structure(group_data):
+    """
+    Validate the shape of a submitted structure.
+
+    Args:
+        group_data: Groups in order, each {"id" (omitted for new groups),
+            "product_group_id", "parallel", "phases": [{"id" (omitted for
+            new phases), "name", "description", "duration_id", "online",
+            "status"}]}; other keys are ignored
+
+    Returns:
+        list: Normalized groups; a group parallel flag or phase status of
+        None keeps the stored one
+
+    Raises:
+        StructureValidationError: If any entry is invalid
+    """
+    if not isinstance(group_data, list):
+        raise StructureValidationError(['Expected a list of groups'])
+
+    errors = []
+    groups = []
+    seen_groups = set()
+    seen_phases = set()
+    for group_index, group in enumerate(group_data):
+        label = f'Group {group_index + 1}'
+        if not isinstance(group, dict):
+            errors.append(f'{label}: expected an object')
+            continue
+        group_id = _parse_id(group.get('id'))
+        product_group_id = _parse_id(group.get('product_group_id'))
+        phases = group.get('phases', [])
+        if group_id is False:
+            errors.append(f'{label}: invalid id')
+        elif group_id is not None:
+            if group_id in seen_groups:
+                errors.append(f'{label}: group {group_id} appears more than once')
+            seen_groups.add(group_id)
+        if not product_group_id:
+            errors.append(f'{label}: invalid product_group_id')
+        if not isinstance(phases, list):
+            errors.append(f'{label}: phases must be a list')
+            phases = []
+
+        parsed_phases = []
+        for phase_index, phase in enumerate(phases):
+            phase_label = f'{label}, phase {phase_index + 1}'
+            if not isinstance(phase, dict):
+                errors.append(f'{phase_label}: expected an object')
+                continue
+            phase_id = _parse_id(phase.get('id'))
+            name = phase.get('name')
+            description = phase.get('description') or ''
+            duration_id = _parse_id(phase.get('duration_id'))
+            status = phase.get('status')
+            if phase_id is False:
+                errors.append(f'{phase_label}: invalid id')
+            elif phase_id is not None:
+                if phase_id in seen_phases:
+                    errors.append(f'{phase_label}: phase {phase_id} appears more than once')
+                seen_phases.add(phase_id)
+            if not isinstance(name, str) or not name.strip():
+                errors.append(f'{phase_label}: name is required')
+            if not isinstance(description, str):
+                errors.append(f'{phase_label}: description must be a string')
+            if duration_id is False:
+                errors.append(f'{phase_label}: invalid duration_id')
+            if status is not None and status not in PHASE_STATUSES:
+                errors.append(f'{phase_label}: invalid status {status!r}')
+            parsed_phases.append({
+                'id': phase_id,
+                'name': name.strip() if isinstance(name, str) else name,
+                'description': description,
+                'duration_id': duration_id,
+                'online': bool(phase.get('online', False)),
+                'status': status,
+            })
+
+        parallel = group.get('parallel')
+        groups.append({
+            'id': group_id,
+            'product_group_id': product_group_id,
+            'parallel': None if parallel is None else bool(parallel),
+            'phases': parsed_phases,
+        })
+
+    if errors:
+        raise StructureValidationError(errors)
+    return groups
+
+def check_structure_references(groups, existing_groups=(), existing_phases=()):
+    """
+    Check that the ids of a parsed structure belong to the project and that
+    the product groups and durations it references exist.
+
+    Raises:
+        StructureValidationError: If a reference is invalid
+    """
+    errors = []
+    for group in groups:
+        if group['id'] is not None and group['id'] not in existing_groups:
+            errors.append(f"Group {group['id']} does not belong to this project")
+        for phase in group['phases']:
+            if phase['id'] is not None and phase['id'] not in existing_phases:
+                errors.append(f"Phase {phase['id']} does not belong to this project")
+
+    product_group_ids = {group['product_group_id'] for group in groups}
+    if product_group_ids:
+        found = set(db.session.scalars(select(ProductGroup.id).where(ProductGroup.id.in_(product_group_ids))))
+        errors.extend(f'Product group {item_id} not found' for item_id in sorted(product_group_ids - found))
+    duration_ids = {phase['duration_id'] for group in groups for phase in group['phases']} - {None}
+    if duration_ids:
+        found = set(db.session.scalars(select(ListItem.id).where(ListItem.id.in_(duration_ids))))
+        errors.extend(f'Duration {item_id} not found' for item_id in sorted(duration_ids - found))
+
+    if errors:
+        raise StructureValidationError(errors)
+
+def insert_returning_ids(model, rows):
+    """
+    Insert rows with one multi-row INSERT and return their ids in order.
+    SQLite cannot guarantee the order of a batch and inserts row by row.
+    """
+    if not rows:
+        return []
+    if db.session.get_bind().dialect.insert_executemany_returning_sort_by_parameter_order:
+        result = db.session.execute(insert(model).returning(model.id, sort_by_parameter_order=True), rows)
+        return list(result.scalars())
+    # Backends without multi-row RETURNING insert through the unit of work
+    objects = [model(**row) for row in rows]
+    db.session.add_all(objects)
+    db.session.flush()
+    return [obj.id for obj in objects]
+
+def apply_project_structure(project_id, group_data, expected_version):
+    """
+    Apply a submitted structure to a project as a minimal set of changes.
+    The caller commits.
+
+    Args:
+        project_id: The id of the project
+        group_data: The structure, see parse_structure()
+        expected_version: The structure_version the editor loaded
+
+    Returns:
+        dict: Counts of added, updated and removed groups and phases, and
+        the new structure_version
+
+    Raises:
+        StructureValidationError: If the structure is invalid
+        StructureConflictError: If the structure changed since expected_version
+    """
+    groups = parse_structure(group_data)
+
+    # Claim the next version first; the row stays locked until commit, so
+    # concurrent saves of the same project are serialized. The statement goes
+    # through the connection because no project filter column changes.
+    result = db.session.connection().execute(
+        update(Project.__table__)
+        .where(Project.__table__.c.id == project_id, Project.__table__.c.structure_version == expected_version)
+        .values(structure_version=Project.__table__.c.structure_version + 1)
+    )
+    if result.rowcount != 1:
+        raise StructureConflictError(
+            db.session.scalar(select(Project.structure_version).where(Project.id == project_id))
+        )
+
+    existing_groups = {
+        row.id: row for row in db.session.execute(
+            select(ProjectGroup.id, ProjectGroup.product_group_id, ProjectGroup.order, ProjectGroup.parallel)
+            .where(ProjectGroup.project_id == project_id)
+        )
+    }
+    existing_phases = {
+        row.id: row for row in db.session.execute(
+            select(
+                ProjectPhase.id, ProjectPhase.group_id, ProjectPhase.name, ProjectPhase.description,
+                ProjectPhase.duration_id, ProjectPhase.online, ProjectPhase.status, ProjectPhase.order
+            ).join(ProjectGroup, ProjectGroup.id == ProjectPhase.group_id)
+            .where(ProjectGroup.project_id == project_id)
+        )
+    }
+    check_structure_references(groups, existing_groups, existing_phases)
+
+    changes = dict.fromkeys((
+        'groups_added', 'groups_updated', 'groups_removed',
+        'phases_added', 'phases_updated', 'phases_removed'
+    ), 0)
+
+    # New groups first, so that phases can be moved into them
+    new_groups = [(order, group) for order, group in enumerate(groups) if group['id'] is None]
+    new_ids = insert_returning_ids(ProjectGroup, [
+        {
+            'project_id': project_id,
+            'product_group_id': group['product_group_id'],
+            'order': order,
+            'parallel': bool(group['parallel']),
+        }
+        for order, group in new_groups
+    ])
+    for (_, group), group_id in zip(new_groups, new_ids):
+        group['id'] = group_id
+    changes['groups_added'] = len(new_groups)
+
+    group_updates = []
+    for order, group in enumerate(groups):
+        stored = existing_groups.get(group['id'])
+        if stored is None:
+            continue
+        parallel = bool(stored.parallel) if group['parallel'] is None else group['parallel']
+        if (stored.product_group_id, stored.order, bool(stored.parallel)) != (group['product_group_id'], order, parallel):
+            group_updates.append({
+                'id': group['id'],
+                'product_group_id': group['product_group_id'],
+                'order': order,
+                'parallel': parallel,
+            })
+
+    phase_inserts = []
+    phase_updates = []
+    kept_phases = set()
+    for group in groups:
+        for order, phase in enumerate(group['phases']):
+            stored = existing_phases.get(phase['id'])
+            values = {
+                'group_id': group['id'],
+                'name': phase['name'],
+                'description': phase['description'],
+                'duration_id': phase['duration_id'],
+                'online': phase['online'],
+                'status': phase['status'] or (stored.status if stored is not None else 'Not Started'),
+                'order': order,
+            }
+            if stored is None:
+                phase_inserts.append(values)
+                continue
+            kept_phases.add(phase['id'])
+            stored_values = dict(stored._asdict(), description=stored.description or '', online=bool(stored.online))
+            if any(stored_values[key] != value for key, value in values.items()):
+                phase_updates.append(dict(values, id=phase['id']))
+
+    removed_phases = [phase_id for phase_id in existing_phases if phase_id not in kept_phases]
+    removed_groups = [group_id for group_id in existing_groups if group_id not in {group['id'] for group in groups}]
+
+    if removed_phases:
+        # Assignments reference phases; remove them with their phases
+        db.session.execute(delete(ConsultantAssignment).where(ConsultantAssignment.phase_id.in_(removed_phases)))
+        db.session.execute(delete(ProjectPhase).where(ProjectPhase.id.in_(removed_phases)))
+    if phase_updates:
+        db.session.execute(update(ProjectPhase), phase_updates)
+    if phase_inserts:
+        db.session.execute(insert(ProjectPhase).execution_options(render_nulls=True), phase_inserts)
+    if group_updates:
+        db.session.execute(update(ProjectGroup), group_updates)
+    if removed_groups:
+        # Their phases were removed or moved above
+        db.session.execute(delete(ProjectGroup).where(ProjectGroup.id.in_(removed_groups)))
+
+    changes.update(
+        groups_updated=len(group_updates),
+        groups_removed=len(removed_groups),
+        phases_added=len(phase_inserts),
+        phases_updated=len(phase_updates),
+        phases_removed=len(removed_phases),
+        structure_version=expected_version + 1,
+    )
+    return changes
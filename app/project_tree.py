@@ -0,0 +1,114 @@
+"""
+Project tree loading.
+
+A project's structure (groups, their phases, the product group of each
+group and the duration of each phase) is loaded with selectinload chains in
+a fixed number of statements, whatever the size of the tree, and returned
+as immutable named tuples that the project pages and the JSON API share.
+"""
+from collections import namedtuple
+from sqlalchemy.orm import joinedload, selectinload
+from .models import Project, ProjectGroup, ProjectPhase
+
+PhaseNode = namedtuple('PhaseNode', [
+    'id', 'name', 'description', 'order', 'status', 'online', 'duration_id', 'duration'
+])
+
+GroupNode = namedtuple('GroupNode', [
+    'id', 'order', 'product_group_id', 'name', 'parallel', 'phases'
+])
+
+class ProjectTree(namedtuple('ProjectTree', ['id', 'name', 'structure_version', 'groups'])):
+    """The groups and phases of a project, in order."""
+    __slots__ = ()
+
+    @property
+    def phases(self):
+        """All phases of the project, group by group."""
+        return tuple(phase for group in self.groups for phase in group.phases)
+
+    @property
+    def phase_count(self):
+        """The number of phases in the project."""
+        return sum(len(group.phases) for group in self.groups)
+
+    def to_dict(self):
+        """Convert the tree to plain dicts and lists for JSON responses."""
+        return {
+            'id': self.id,
+            'name': self.name,
+            'structure_version': self.structure_version,
+            'groups': [
+                dict(group._asdict(), phases=[phase._asdict() for phase in group.phases])
+                for group in self.groups
+            ]
+        }
+
+def build_project_tree(project):
+    """
+    Build the tree of a project whose groups and phases are already loaded.
+
+    Args:
+        project: The Project
+
+    Returns:
+        ProjectTree: The project's groups and phases
+    """
+    return ProjectTree(
+        id=project.id,
+        name=project.name,
+        structure_version=project.structure_version,
+        groups=tuple(
+            GroupNode(
+                id=group.id,
+                order=group.order,
+                product_group_id=group.product_group_id,
+                name=group.product_group.name if group.product_group else 'Unknown',
+                parallel=bool(group.parallel),
+                phases=tuple(
+                    PhaseNode(
+                        id=phase.id,
+                        name=phase.name,
+                        description=phase.description,
+                        order=phase.order,
+                        status=phase.status,
+                        online=bool(phase.online),
+                        duration_id=phase.duration_id,
+                        duration=phase.duration.value if phase.duration else None
+                    )
+                    for phase in group.phases
+                )
+            )
+            for group in project.groups
+        )
+    )
+
+def load_project_tree(project_id, with_products=False):
+    """
+    Load a project with its whole structure.
+
+    The project and its client, manager, status and template are loaded in
+    one statement, the groups with their product groups in a second and the
+    phases with their durations in a third; products add a fourth.
+
+    Args:
+        project_id: The id of the project
+        with_products: Whether to load the project's products as well
+
+    Returns:
+        tuple: (Project, ProjectTree), or (None, None) if the project does not exist
+    """
+    options = [
+        joinedload(Project.client),
+        joinedload(Project.manager),
+        joinedload(Project.status_item),
+        joinedload(Project.template),
+        selectinload(Project.groups).joinedload(ProjectGroup.product_group),
+        selectinload(Project.groups).selectinload(ProjectGroup.phases).joinedload(ProjectPhase.duration),
+    ]
+    if with_products:
+        options.append(selectinload(Project.products))
+    project = Project.query.options(*options).filter(Project.id == project_id).one_or_none()
+    if project is None:
+        return None, None
+    return project, build_project_tree(project)
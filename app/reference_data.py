@@ -0,0 +1,160 @@
+"""
+Reference data registry for dropdown lists (List/ListItem).
+
+All lists and their ordered items are loaded in two queries and kept in
+memory as immutable records. The registry is served by list name or id and
+offers value -> id maps for reverse lookups.
+
+Routes that change lists call invalidate_reference_data(), which drops the
+registry and bumps a shared version so every gunicorn worker reloads it on
+its next access.
+"""
+import threading
+from collections import namedtuple
+from types import MappingProxyType
+from .models import db, List, ListItem
+from .utils import get_cache_version, bump_cache_version
+
+ListItemRecord = namedtuple('ListItemRecord', ['id', 'list_id', 'value', 'description', 'order'])
+
+class ReferenceList:
+    """
+    Immutable snapshot of a List and its items ordered by ListItem.order.
+    """
+    __slots__ = ('id', 'name', 'description', 'items', 'value_ids')
+
+    def __init__(self, id, name, description, items):
+        self.id = id
+        self.name = name
+        self.description = description
+        self.items = tuple(items)
+        # First item wins when values are duplicated, matching a linear search
+        value_ids = {}
+        for item in self.items:
+            value_ids.setdefault(item.value, item.id)
+        self.value_ids = MappingProxyType(value_ids)
+
+    def id_for(self, value):
+        """Get the id of the item with the given value, or None."""
+        return self.value_ids.get(value)
+
+    def __repr__(self):
+        return f'<ReferenceList {self.name}>'
+
+_lock = threading.Lock()
+_registry = None
+_version = None
+
+class _Registry:
+    """Lookup tables built from one load of the lists tables."""
+
+    def __init__(self, lists, items):
+        items_by_list = {}
+        for item in items:
+            items_by_list.setdefault(item.list_id, []).append(item)
+
+        self.lists_by_id = {}
+        self.lists_by_name = {}
+        for list_id, name, description in lists:
+            ref = ReferenceList(list_id, name, description, items_by_list.get(list_id, []))
+            self.lists_by_id[list_id] = ref
+            self.lists_by_name[name] = ref
+        self.items_by_id = {item.id: item for item in items}
+
+def _load_registry():
+    """Load all lists and their ordered items."""
+    lists = db.session.query(List.id, List.name, List.description).all()
+    items = [
+        ListItemRecord(*row) for row in db.session.query(
+            ListItem.id, ListItem.list_id, ListItem.value, ListItem.description, ListItem.order
+        ).order_by(ListItem.list_id, ListItem.order, ListItem.id)
+    ]
+    return _Registry(lists, items)
+
+def _get_registry():
+    """Get the registry, reloading it if it was invalidated in any worker."""
+    global _registry, _version
+    version = get_cache_version('reference_data')
+    registry = _registry
+    if registry is None or version != _version:
+        with _lock:
+            if _registry is None or version != _version:
+                _registry = _load_registry()
+                _version = version
+            registry = _registry
+    return registry
+
+def invalidate_reference_data():
+    """
+    Drop the registry in every worker.
+    Call this after committing changes to lists or list items.
+    """
+    global _registry
+    _registry = None
+    bump_cache_version('reference_data')
+
+def get_list(name):
+    """
+    Get a list by name.
+
+    Args:
+        name: The name of the list
+
+    Returns:
+        ReferenceList: The list, or None if it does not exist
+    """
+    return _get_registry().lists_by_name.get(name)
+
+def get_list_by_id(list_id):
+    """
+    Get a list by id.
+
+    Args:
+        list_id: The id of the list
+
+    Returns:
+        ReferenceList: The list, or None if it does not exist
+    """
+    return _get_registry().lists_by_id.get(list_id)
+
+def get_list_items(name):
+    """
+    Get the ordered items of a list by name.
+
+    Args:
+        name: The name of the list
+
+    Returns:
+        tuple: The list items, empty if the list does not exist
+    """
+    ref = get_list(name)
+    return ref.items if ref else ()
+
+def get_list_items_by_id(list_id):
+    """
+    Get the ordered items of a list by id.
+
+    Args:
+        list_id: The id of the list
+
+    Returns:
+        tuple: The list items, empty if the list does not exist
+    """
+    ref = get_list_by_id(list_id)
+    return ref.items if ref else ()
+
+def get_list_item(item_id):
+    """
+    Get a list item by id.
+
+    Args:
+        item_id: The id of the item, as an int or a numeric string
+
+    Returns:
+        ListItemRecord: The item, or None if it does not exist
+    """
+    try:
+        item_id = int(item_id)
+    except (TypeError, ValueError):
+        return None
+    return _get_registry().items_by_id.get(item_id)
@@ -2,44 +2,25 @@ from flask import Blueprint, render_template, redirect, url_for, flash, request,
 from flask_login import login_required, current_user
 from ..models import db, User, Role, Project, Client, Consultant, List, ListItem
 from werkzeug.security import generate_password_hash
+from sqlalchemy import case, delete, insert, update
 from functools import wraps
-import json
-import os
-from ..utils import user_has_role, user_has_any_role, get_user_roles, setup_logger
-import logging
+from ..settings_store import load_settings, save_settings
+from ..reference_data import invalidate_reference_data
+from ..project_search import count_projects
+from ..utils import user_has_role, user_has_any_role, get_user_roles, get_user_role_names, get_role_id, invalidate_role_cache, setup_logger
 import traceback
 
 admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
 
 # Initialize logger
-logger = setup_logger('admin', level=logging.DEBUG)
+logger = setup_logger('admin')
 
-# Helper function to load settings
-def load_settings():
-    """Load settings from JSON file"""
-    settings_file = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'static', 'settings.json')
-    try:
-        if os.path.exists(settings_file):
-            with open(settings_file, 'r') as f:
-                return json.load(f)
-        return {}
-    except Exception as e:
-        logger.error(f"Error loading settings: {e}")
-        return {}
-
-# Helper function to save settings
-def save_settings(settings):
-    """Save settings to JSON file"""
-    settings_file = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'static', 'settings.json')
-    try:
-        os.makedirs(os.path.dirname(settings_file), exist_ok=True)
-        with open(settings_file, 'w') as f:
-            json.dump(settings, f, indent=4)
-        logger.info("Settings saved successfully")
-        return True
-    except Exception as e:
-        logger.error(f"Error saving settings: {e}")
-        return False
+def get_roles_by_name(role_names):
+    """Load the Role objects for a list of role names in a single query."""
+    role_ids = [role_id for role_id in (get_role_id(name) for name in role_names) if role_id]
+    if not role_ids:
+        return []
+    return Role.query.filter(Role.id.in_(role_ids)).all()
 
 # Custom decorator for admin-only routes
 def admin_required(f):
@@ -73,26 +54,27 @@ def dashboard():
         
         # Get user roles using the utility function
         user_roles = get_user_roles(current_user)
-        logger.info(f"User {current_user.username} has roles: {user_roles}")
+        logger.debug("User %s has roles: %s", current_user.username, user_roles, extra={'sample': 50})
         
         # Check if user is admin or manager
         is_admin_or_manager = user_has_any_role(current_user, ['Admin', 'Manager']) or current_user.username == 'admin'
         is_project_manager = user_has_role(current_user, 'Project Manager')
         
-        logger.info(f"User {current_user.username} is_admin_or_manager: {is_admin_or_manager}, is_project_manager: {is_project_manager}")
+        logger.debug("User %s is_admin_or_manager: %s, is_project_manager: %s",
+                     current_user.username, is_admin_or_manager, is_project_manager, extra={'sample': 50})
         
         # Get counts based on user role
         if is_admin_or_manager:
             try:
                 # Admins and Managers see all projects, clients, and users
-                project_count = Project.query.count()
+                project_count = count_projects()
                 client_count = Client.query.count()
                 user_count = User.query.count()
                 
                 # Count users with Consultant role instead of entries in consultants table
-                consultant_role = Role.query.filter_by(name='Consultant').first()
-                if consultant_role:
-                    consultant_count = User.query.join(User.roles).filter(Role.id == consultant_role.id).count()
+                consultant_role_id = get_role_id('Consultant')
+                if consultant_role_id:
+                    consultant_count = User.query.join(User.roles).filter(Role.id == consultant_role_id).count()
                 else:
                     consultant_count = 0
             except Exception as e:
@@ -101,7 +83,7 @@ def dashboard():
         elif is_project_manager:
             try:
                 # Project Managers see their assigned projects
-                project_count = Project.query.filter_by(manager_id=current_user.id).count()
+                project_count = count_projects(manager_id=current_user.id)
                 # Get clients with projects managed by this user
                 client_ids = db.session.query(Project.client_id).filter_by(manager_id=current_user.id).distinct()
                 client_count = Client.query.filter(Client.id.in_(client_ids)).count()
@@ -279,16 +261,11 @@ def manage_user(user_id=None):
                     user.password_hash = generate_password_hash(password)
                 
                 # Check if user is losing or gaining Consultant role
-                consultant_role = Role.query.filter_by(name='Consultant').first()
-                had_consultant_role = consultant_role in user.roles
+                had_consultant_role = 'Consultant' in get_user_role_names(user)
                 will_have_consultant_role = 'Consultant' in role_names
                 
                 # Update roles
-                user.roles = []
-                for role_name in role_names:
-                    role = Role.query.filter_by(name=role_name).first()
-                    if role:
-                        user.roles.append(role)
+                user.roles = get_roles_by_name(role_names)
                 
                 # If user lost Consultant role, remove their consultant entry
                 if had_consultant_role and not will_have_consultant_role:
@@ -297,18 +274,9 @@ def manage_user(user_id=None):
                         db.session.delete(consultant)
                         logger.info(f"Deleted consultant record for user: {username}")
                 
-                # If user gained Consultant role, create a consultant entry
-                if not had_consultant_role and will_have_consultant_role:
-                    consultant = Consultant.query.filter_by(user_id=user.id).first()
-                    if not consultant:
-                        consultant = Consultant(
-                            user_id=user.id,
-                            status='Active',
-                            availability_days_per_month=20  # Default value
-                        )
-                        db.session.add(consultant)
-                        logger.info(f"Created consultant record for existing user: {username}")
-                        
+                # A gained Consultant role creates the consultant entry via the
+                # User.roles append event in routes/consultants.py
+                
                 logger.info(f"Updating existing user: {user.id} - {user.username}")
             else:
                 # Create new user
@@ -330,30 +298,16 @@ def manage_user(user_id=None):
                 )
                 
                 # Add roles to the user
-                for role_name in role_names:
-                    role = Role.query.filter_by(name=role_name).first()
-                    if role:
-                        user.roles.append(role)
+                user.roles = get_roles_by_name(role_names)
                 
+                # The consultant record for a Consultant role is created by the
+                # User.roles append event in routes/consultants.py
                 db.session.add(user)
-                db.session.flush()  # Flush to get the user ID
-                
-                # Check if user has Consultant role and create consultant record if needed
-                if 'Consultant' in role_names:
-                    # Create a consultant record if it doesn't exist
-                    consultant = Consultant.query.filter_by(user_id=user.id).first()
-                    if not consultant:
-                        consultant = Consultant(
-                            user_id=user.id,
-                            status='Active',
-                            availability_days_per_month=20  # Default value
-                        )
-                        db.session.add(consultant)
-                        logger.info(f"Created consultant record for new user: {username}")
                 
                 logger.info(f"Creating new user: {username}")
             
             db.session.commit()
+            invalidate_role_cache()
             
             message = f'User {"updated" if user_id else "created"} successfully.'
             logger.info(message)
@@ -544,11 +498,85 @@ def api_create_list():
         new_list = List(name=name, description=description)
         db.session.add(new_list)
         db.session.commit()
+        invalidate_reference_data()
         
         return jsonify({"success": True, "list_id": new_list.id})
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 500
 
+def apply_list_item_changes(list_id, items):
+    """
+    Apply submitted list items to a list as a diff against the stored items.
+    
+    Items with the ID of an existing item of the list are updated in place,
+    items without one are inserted and stored items missing from the
+    submission are deleted. Every kind of change is one batched statement and
+    nothing is committed here.
+    
+    Args:
+        list_id: The ID of the list
+        items: Submitted items as dicts with id, value, description and order
+        
+    Returns:
+        dict: Number of inserted, updated and deleted items
+    """
+    existing = {
+        row.id: row for row in db.session.query(
+            ListItem.id, ListItem.value, ListItem.description, ListItem.order
+        ).filter(ListItem.list_id == list_id)
+    }
+    
+    inserts = []
+    content_updates = []
+    order_updates = {}
+    kept_ids = set()
+    for item in items:
+        value = item['value']
+        # Missing and empty descriptions are the same, stored or submitted
+        description = item.get('description') or ''
+        order = item.get('order', 0)
+        
+        try:
+            item_id = int(item.get('id'))
+        except (TypeError, ValueError):
+            item_id = None
+        
+        current = existing.get(item_id)
+        if current is None or item_id in kept_ids:
+            inserts.append({'list_id': list_id, 'value': value, 'description': description, 'order': order})
+            continue
+        
+        kept_ids.add(item_id)
+        if (current.value, current.description or '') != (value, description):
+            content_updates.append({'id': item_id, 'value': value, 'description': description})
+        if current.order != order:
+            order_updates[item_id] = order
+    
+    deleted_ids = [item_id for item_id in existing if item_id not in kept_ids]
+    
+    if deleted_ids:
+        db.session.execute(
+            delete(ListItem).where(ListItem.id.in_(deleted_ids)),
+            execution_options={'synchronize_session': False}
+        )
+    if content_updates:
+        # ORM bulk UPDATE by primary key (one executemany)
+        db.session.execute(update(ListItem), content_updates)
+    if order_updates:
+        # Reorder in a single statement
+        db.session.execute(
+            update(ListItem)
+            .where(ListItem.id.in_(list(order_updates)))
+            .values(order=case(order_updates, value=ListItem.id)),
+            execution_options={'synchronize_session': False}
+        )
+    if inserts:
+        # Multi-row INSERT
+        db.session.execute(insert(ListItem), inserts)
+    
+    updated_ids = {row['id'] for row in content_updates} | set(order_updates)
+    return {'inserted': len(inserts), 'updated': len(updated_ids), 'deleted': len(deleted_ids)}
+
 @admin_bp.route('/lists/api/<int:list_id>/items', methods=['GET', 'POST'])
 @login_required
 @admin_required
@@ -574,22 +602,13 @@ def api_list_items(list_id):
             data = request.get_json()
             items = data.get('items', [])
             
-            # Delete existing items
-            ListItem.query.filter_by(list_id=list_id).delete()
-            
-            # Add new items
-            for item in items:
-                new_item = ListItem(
-                    list_id=list_id,
-                    value=item['value'],
-                    description=item.get('description', ''),
-                    order=item.get('order', 0)
-                )
-                db.session.add(new_item)
+            # Apply only the differences so item IDs referenced elsewhere stay stable
+            changes = apply_list_item_changes(list_id, items)
             
             db.session.commit()
+            invalidate_reference_data()
             
-            return jsonify({"success": True})
+            return jsonify({"success": True, **changes})
         except Exception as e:
             db.session.rollback()
             return jsonify({"success": False, "message": str(e)}), 500
@@ -608,6 +627,7 @@ def api_delete_list(list_id):
         # Delete list (cascade will delete items)
         db.session.delete(list_obj)
         db.session.commit()
+        invalidate_reference_data()
         
         return jsonify({"success": True})
     except Exception as e:
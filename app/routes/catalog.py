@@ -1,9 +1,12 @@
 from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, current_app as app
 from flask_login import login_required, current_user
-from ..models import db, ProductService, ProductGroup, ProductElement, Role, List
+from ..models import db, ProductService, ProductGroup, ProductElement, Role
 from functools import wraps
 from ..utils import user_has_role as utils_user_has_role
+from ..reference_data import get_list_items
 from contextlib import contextmanager
+from sqlalchemy.orm import selectinload
+from ..catalog_snapshot import get_catalog_snapshot_json
 
 catalog_bp = Blueprint('catalog', __name__, url_prefix='/catalog')
 
@@ -200,21 +203,34 @@ def search_products():
     # Otherwise, render template
     return render_template('catalog/search.html', products=products, query=query)
 
+@catalog_bp.route('/api/snapshot', methods=['GET'])
+@login_required
+def catalog_snapshot():
+    """
+    Get the whole catalog (product groups with their elements, products and
+    phase durations) as one JSON document. Supports conditional requests,
+    so the project builder revalidates its copy instead of downloading it.
+    """
+    body, etag = get_catalog_snapshot_json()
+    response = app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
+
 # Product Group Routes
 
 @catalog_bp.route('/groups')
 @login_required
 def list_groups():
     """Display a list of all product groups."""
-    groups = ProductGroup.query.all()
-    
-    # Load elements for each group
-    for group in groups:
-        group.elements = ProductElement.query.filter_by(group_id=group.id).all()
+    # Load the elements and products of all groups in one query each
+    groups = ProductGroup.query.options(
+        selectinload(ProductGroup.elements),
+        selectinload(ProductGroup.products)
+    ).all()
     
     # Get phase durations list for reference
-    phase_durations_list = List.query.filter_by(name='Phase Durations').first()
-    phase_durations = {duration.id: duration.value for duration in phase_durations_list.items} if phase_durations_list else {}
+    phase_durations = {duration.id: duration.value for duration in get_list_items('Phase Durations')}
     
     return render_template('catalog/groups/list.html', groups=groups, phase_durations=phase_durations)
 
@@ -232,8 +248,7 @@ def manage_group(group_id=None):
     group = ProductGroup.query.get_or_404(group_id) if group_id else None
     
     # Get phase durations list for dropdown
-    phase_durations_list = List.query.filter_by(name='PhaseDuration').first()
-    phase_durations = phase_durations_list.items if phase_durations_list else []
+    phase_durations = get_list_items('PhaseDuration')
     
     # If editing, load the products and elements in this group
     products = []
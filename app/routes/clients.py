@@ -1,14 +1,22 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify
+from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, current_app
 from flask_login import login_required, current_user
-from ..models import db, Client, List, ListItem, Project, Role
+from ..models import db, Client, Role
 from functools import wraps
-import csv
-import io
 import json
+import click
 from ..utils import user_has_role as utils_user_has_role
+from ..reference_data import get_list_items, get_list_items_by_id
+from ..client_import import ClientImportError, import_clients, IMPORT_BATCH_SIZE, MAX_REPORTED_ERRORS
+from ..client_lookup import get_client_options, get_client_options_json, search_client_ids
+from ..client_search import client_sort_keys, count_clients, query_clients
+from ..pagination import paginate_keyset
+from ..exports import ExportFormatError, client_export, export_response
 
 clients_bp = Blueprint('clients', __name__, url_prefix='/clients')
 
+# Clients per page of the client list
+CLIENTS_PER_PAGE = 20
+
 # Helper function to check if user has a specific role
 def user_has_role(user, role_name):
     """Check if a user has a specific role."""
@@ -28,102 +36,92 @@ def manager_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def client_scope():
+    """
+    Get the clients the current user may see.
+
+    Returns:
+        None for all clients (Admins and Managers), the user's id for
+        clients of projects they manage (Project Managers), or False for none
+    """
+    if user_has_role(current_user, 'Admin') or user_has_role(current_user, 'Manager'):
+        return None
+    if user_has_role(current_user, 'Project Manager'):
+        return current_user.id
+    return False
+
 @clients_bp.route('/')
 @login_required
 def list_clients():
-    """Display a list of all clients."""
+    """Display one page of clients with filtering options, by name."""
     # Get search and filter parameters
     search = request.args.get('search', '')
-    country_id = request.args.get('country', '')
+    country_id = request.args.get('country', type=int)
     status = request.args.get('status', '')
-    page = request.args.get('page', 1, type=int)
-    per_page = 20  # Show 20 clients per page
-    
-    # Base query
-    query = Client.query.options(db.joinedload(Client.country))
-    
-    # Apply filters
-    if search:
-        query = query.filter(Client.name.ilike(f'%{search}%'))
-    
-    if country_id:
-        query = query.filter(Client.country_id == country_id)
-        
-    if status:
-        if status == 'active':
-            query = query.filter(Client.active == True)
-        elif status == 'inactive':
-            query = query.filter(Client.active == False)
+    cursor = request.args.get('cursor')
     
     # Apply role-based filtering
-    if user_has_role(current_user, 'Admin') or user_has_role(current_user, 'Manager'):
-        # Admins and Managers see all clients
-        filtered_query = query
-    elif user_has_role(current_user, 'Project Manager'):
-        # Project Managers see clients with projects they manage
-        client_ids = db.session.query(Project.client_id).filter_by(manager_id=current_user.id).distinct()
-        filtered_query = query.filter(Client.id.in_(client_ids))
-    else:
-        # Other users don't see any clients
-        filtered_query = query.filter(Client.id == None)  # Empty result
-    
-    # Order by name and ensure fresh data
-    filtered_query = filtered_query.order_by(Client.name).execution_options(synchronize_session="fetch")
-    
-    # Paginate the results
-    pagination = filtered_query.paginate(page=page, per_page=per_page, error_out=False)
-    clients = pagination.items
-    
-    # Debug log to verify client active status
-    for client in clients:
-        print(f"Client {client.id} - {client.name} - Active: {client.active}")
-    
-    # Get countries list for dropdown
-    countries_list = List.query.filter_by(name='Countries').first()
-    countries = countries_list.items if countries_list else []
-    
-    # Get sales persons list
-    sales_list = List.query.filter_by(name='Sales').first()
-    sales_persons = sales_list.items if sales_list else []
-    
-    # Get project managers (users with Project Manager role)
-    pm_role = Role.query.filter_by(name='Project Manager').first()
-    project_managers = pm_role.users if pm_role else []
+    clients = []
+    next_cursor = None
+    total = 0
+    manager_id = client_scope()
+    if manager_id is not False:
+        query = query_clients(search=search, country_id=country_id, status=status, manager_id=manager_id)
+        page = paginate_keyset(query.options(db.joinedload(Client.country)), client_sort_keys(),
+                               cursor=cursor, per_page=CLIENTS_PER_PAGE)
+        clients = page.items
+        next_cursor = page.next_cursor
+        # Cached per filter combination until clients change
+        total = count_clients(search=search, country_id=country_id, status=status, manager_id=manager_id)
+    
+    # Reference lists and project managers are cached between requests
+    options = get_client_options()
     
     return render_template(
         'clients/list.html', 
         clients=clients,
-        countries=countries,
-        sales_persons=sales_persons,
-        project_managers=project_managers,
-        pagination=pagination
+        countries=get_list_items('Countries'),
+        sales_persons=get_list_items('Sales'),
+        project_managers=options['project_managers'],
+        next_cursor=next_cursor,
+        total=total
     )
 
+@clients_bp.route('/export', methods=['GET'])
+@login_required
+def export_clients():
+    """
+    Download the clients matching the list filters as CSV, NDJSON or XLSX
+    (format parameter). Rows are streamed as they are read.
+    """
+    manager_id = client_scope()
+    if manager_id is False:
+        flash('You do not have permission to export clients.', 'danger')
+        return redirect(url_for('clients.list_clients'))
+    dataset = client_export(
+        search=request.args.get('search', ''),
+        country_id=request.args.get('country', type=int),
+        status=request.args.get('status', ''),
+        manager_id=manager_id
+    )
+    try:
+        return export_response(dataset, request.args.get('format', 'csv'))
+    except ExportFormatError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+
 @clients_bp.route('/create', methods=['GET', 'POST'])
 @login_required
 @manager_required
 def create_client():
     """Create a new client."""
     # Get countries list for dropdown
-    countries_list = List.query.filter_by(name='Countries').first()
-    if countries_list:
-        countries = countries_list.items
-    else:
-        countries = []
+    countries = get_list_items('Countries')
     
     # Get sales persons list
-    sales_list = List.query.filter_by(name='Sales').first()
-    if sales_list:
-        sales_persons = sales_list.items
-    else:
-        sales_persons = []
+    sales_persons = get_list_items('Sales')
     
     # Get industries list for dropdown
-    industries_list = List.query.filter_by(id=5).first()
-    if industries_list:
-        industries = industries_list.items
-    else:
-        industries = []
+    industries = get_list_items_by_id(5)
     
     # Get project managers (users with Project Manager role)
     pm_role = Role.query.filter_by(name='Project Manager').first()
@@ -177,25 +175,13 @@ def edit_client(client_id):
     client = Client.query.get_or_404(client_id)
     
     # Get countries list for dropdown
-    countries_list = List.query.filter_by(name='Countries').first()
-    if countries_list:
-        countries = countries_list.items
-    else:
-        countries = []
+    countries = get_list_items('Countries')
     
     # Get sales persons list
-    sales_list = List.query.filter_by(name='Sales').first()
-    if sales_list:
-        sales_persons = sales_list.items
-    else:
-        sales_persons = []
+    sales_persons = get_list_items('Sales')
     
     # Get industries list for dropdown
-    industries_list = List.query.filter_by(id=5).first()
-    if industries_list:
-        industries = industries_list.items
-    else:
-        industries = []
+    industries = get_list_items_by_id(5)
     
     # Get project managers (users with Project Manager role)
     pm_role = Role.query.filter_by(name='Project Manager').first()
@@ -324,6 +310,24 @@ def view_client(client_id):
     client = Client.query.get_or_404(client_id)
     return render_template('clients/view.html', client=client)
 
+@clients_bp.cli.command('import-csv')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--batch-size', default=IMPORT_BATCH_SIZE, show_default=True, help='Rows per INSERT and commit.')
+def import_csv_command(path, batch_size):
+    """Import clients from a CSV file."""
+    def report(result):
+        click.echo(f'{result.rows} rows read, {result.added} clients added, {result.skipped} skipped')
+    
+    with open(path, 'rb') as stream:
+        try:
+            result = import_clients(stream, batch_size=batch_size, progress=report)
+        except ClientImportError as e:
+            raise click.ClickException(str(e))
+    for line, message in result.errors:
+        click.echo(f'Line {line}: {message}', err=True)
+    if result.error_count > len(result.errors):
+        click.echo(f'... and {result.error_count - len(result.errors)} more errors', err=True)
+
 @clients_bp.route('/import-csv', methods=['GET', 'POST'])
 @login_required
 @manager_required
@@ -353,106 +357,48 @@ def import_csv():
             return redirect(url_for('clients.import_csv'))
         
         try:
-            # Read CSV file
-            stream = io.StringIO(file.stream.read().decode("UTF8"), newline=None)
-            csv_reader = csv.DictReader(stream)
-            
-            # Get countries for lookup
-            countries = {country.value: country.id for country in 
-                        ListItem.query.join(ListItem.list).filter(ListItem.list.has(name='Countries')).all()}
-            
-            # Process CSV rows
-            clients_added = 0
-            clients_skipped = 0
-            
-            for row in csv_reader:
-                # Check if required fields are present
-                if 'name' not in row or not row['name']:
-                    clients_skipped += 1
-                    continue
-                
-                # Check if client already exists
-                if Client.query.filter_by(name=row['name']).first():
-                    clients_skipped += 1
-                    continue
-                
-                # Create new client
-                new_client = Client(
-                    name=row['name'],
-                    address=row.get('address', ''),
-                    city=row.get('city', '')
-                )
-                
-                # Set country if provided and exists in database
-                if 'country' in row and row['country'] in countries:
-                    new_client.country_id = countries[row['country']]
-                
-                # Add client to database
-                db.session.add(new_client)
-                clients_added += 1
-            
-            db.session.commit()
-            
-            flash(f'Import complete: {clients_added} clients added, {clients_skipped} skipped.', 'success')
-            return redirect(url_for('clients.list_clients'))
-        except Exception as e:
-            flash(f'Error importing clients: {str(e)}', 'danger')
+            result = import_clients(file.stream)
+        except ClientImportError as e:
+            flash(f'Error importing clients: {e}', 'danger')
             return redirect(url_for('clients.import_csv'))
+        
+        flash(f'Import complete: {result.added} clients added, {result.skipped} skipped.',
+              'warning' if result.error_count else 'success')
+        return render_template('clients/import_csv.html', result=result, max_reported_errors=MAX_REPORTED_ERRORS)
     
     return render_template('clients/import_csv.html')
 
+def _client_data(client):
+    """Serialize a client for the client fields of the project forms."""
+    return {
+        'id': client.id,
+        'name': client.name,
+        'address': client.address or '',
+        'city': client.city or '',
+        'country_id': client.country_id,
+        'country': client.country.value if client.country else '',
+        'sales_person': client.sales_person or '',
+        'project_manager': client.project_manager or '',
+        'industry': client.industry or '',
+        'active': client.active
+    }
+
 @clients_bp.route('/search', methods=['GET'])
 @login_required
 def search_clients():
     """
-    Search for clients by name.
-    Returns JSON with matching clients.
+    Search for clients by name, for typeahead fields.
+    Returns JSON with the matching clients only; the sales and project
+    manager options are served by /clients/api/options.
     """
-    query = request.args.get('query', '')
-    if len(query) < 2:
-        return jsonify([])
-    
-    # Search for clients matching the query
-    clients = Client.query.filter(Client.name.ilike(f'%{query}%')).limit(7).all()
-    
-    # Get sales list
-    sales_list = List.query.filter_by(name='Sales').first()
-    sales_items = []
-    if sales_list:
-        sales_items = ListItem.query.filter_by(list_id=sales_list.id).all()
-        sales_items = [{'id': item.id, 'value': item.value} for item in sales_items]
-    
-    # Get project managers (users with Project Manager role)
-    pm_role = Role.query.filter_by(name='Project Manager').first()
-    project_managers = []
-    if pm_role:
-        project_managers = [{'id': user.id, 'name': f"{user.first_name} {user.last_name}"} for user in pm_role.users]
-    
-    # Format the results
-    results = []
-    for client in clients:
-        client_data = {
-            'id': client.id,
-            'name': client.name,
-            'address': client.address or '',
-            'city': client.city or '',
-            'country_id': client.country_id,
-            'country': client.country.value if client.country else '',
-            'sales_person': client.sales_person or '',
-            'project_manager': client.project_manager or '',
-            'industry': client.industry or '',
-            'active': client.active
-        }
-        results.append(client_data)
-    
-    # Return client data along with sales and project manager options
-    response = {
-        'clients': results,
-        'sales_items': sales_items,
-        'project_managers': project_managers
-    }
-    
-    return jsonify(response)
+    client_ids = search_client_ids(request.args.get('query', ''))
+    if not client_ids:
+        return jsonify({'clients': []})
+    
+    # Load the matches by primary key and keep the index's order
+    clients = {client.id: client for client in Client.query.filter(Client.id.in_(client_ids))}
+    results = [_client_data(clients[client_id]) for client_id in client_ids if client_id in clients]
+    return jsonify({'clients': results})
 
 @clients_bp.route('/get/<int:client_id>', methods=['GET'])
 @login_required
@@ -462,42 +408,21 @@ def get_client(client_id):
     Returns JSON with client details.
     """
     client = Client.query.get_or_404(client_id)
-    
-    # Get sales list
-    sales_list = List.query.filter_by(name='Sales').first()
-    sales_items = []
-    if sales_list:
-        sales_items = ListItem.query.filter_by(list_id=sales_list.id).all()
-        sales_items = [{'id': item.id, 'value': item.value} for item in sales_items]
-    
-    # Get project managers (users with Project Manager role)
-    pm_role = Role.query.filter_by(name='Project Manager').first()
-    project_managers = []
-    if pm_role:
-        project_managers = [{'id': user.id, 'name': f"{user.first_name} {user.last_name}"} for user in pm_role.users]
-    
-    # Format the client data
-    client_data = {
-        'id': client.id,
-        'name': client.name,
-        'address': client.address or '',
-        'city': client.city or '',
-        'country_id': client.country_id,
-        'country': client.country.value if client.country else '',
-        'sales_person': client.sales_person or '',
-        'project_manager': client.project_manager or '',
-        'industry': client.industry or '',
-        'active': client.active
-    }
-    
-    # Return client data along with sales and project manager options
-    response = {
-        'client': client_data,
-        'sales_items': sales_items,
-        'project_managers': project_managers
-    }
-    
-    return jsonify(response)
+    return jsonify({'client': _client_data(client)})
+
+@clients_bp.route('/api/options', methods=['GET'])
+@login_required
+def client_options():
+    """
+    Get the sales and project manager options of client fields.
+    Supports conditional requests, so pages revalidate instead of
+    downloading the options again.
+    """
+    body, etag = get_client_options_json()
+    response = current_app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
 
 # TODO: Add routes for client projects
 # TODO: Add routes for client contacts
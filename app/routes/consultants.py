@@ -1,23 +1,37 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify
+from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, current_app
 from flask_login import login_required, current_user
-from ..models import db, Consultant, User, ConsultantExpertise, Role, user_roles, List, ListItem, ProductGroup, ProductElement
+from ..models import db, Consultant, User, ConsultantExpertise, Role, user_roles, List, ListItem, ProductGroup, ProductElement, DEFAULT_AVAILABILITY_DAYS
 from functools import wraps
-import json
-import os
 import logging
-import traceback
-from ..utils import user_has_role as utils_user_has_role, get_user_roles, setup_logger
+from ..utils import user_has_role as utils_user_has_role, get_user_roles, get_role_id, invalidate_role_cache, setup_logger
+from ..reference_data import get_list_items, invalidate_reference_data
+from ..consultant_expertise import validate_expertise_ratings, apply_expertise_ratings, ExpertiseValidationError, get_expertise_matrix_json
+from ..staffing import get_staffing_index, parse_criteria, describe_recommendations
+from ..utilization import get_utilization_matrix, describe_utilization, DEFAULT_MONTHS, MAX_MONTHS
+from ..consultant_search import search_consultants, search_expertise_options, get_expertise_option, consultant_sort_keys
+from ..pagination import paginate_keyset
+from ..exports import ExportFormatError, consultant_export, expertise_export, export_response
 from datetime import datetime, date
 from contextlib import contextmanager
+from sqlalchemy import exists, insert, literal, select
+from sqlalchemy.orm import contains_eager, joinedload, selectinload
 from sqlalchemy.orm.attributes import flag_modified
+import click
 
 consultants_bp = Blueprint('consultants', __name__, url_prefix='/consultants')
 
 # Initialize logger
-logger = setup_logger('consultants', level=logging.DEBUG)
+logger = setup_logger('consultants')
 # Also log to admin log for important events
 admin_logger = logging.getLogger('admin')
 
+# Status options used when the 'Consultant Status' list doesn't exist
+DEFAULT_CONSULTANT_STATUSES = ['Active', 'Inactive', 'On Leave']
+
+# Page size of the consultant list
+CONSULTANTS_PER_PAGE = 25
+MAX_CONSULTANTS_PER_PAGE = 100
+
 # Helper function to check if user has a specific role
 def user_has_role(user, role_name):
     """Check if a user has a specific role."""
@@ -37,211 +51,187 @@ def manager_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
-# Helper function to load settings
-def load_settings():
-    """Load settings from JSON file"""
-    settings_file = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'static', 'settings.json')
-    try:
-        if os.path.exists(settings_file):
-            with open(settings_file, 'r') as f:
-                return json.load(f)
-        return {}
-    except Exception as e:
-        print(f"Error loading settings: {e}")
-        return {}
-
 def ensure_consultant_entries():
     """
     Ensure that every user with the Consultant role has a corresponding entry in the consultants table.
-    This helps maintain consistency between the role assignments and the consultant records.
+    Missing entries are created with a single INSERT ... SELECT; the caller commits.
+    
+    Returns:
+        int: Number of consultant entries created
     """
-    # Get the Consultant role
-    consultant_role = Role.query.filter_by(name='Consultant').first()
-    if not consultant_role:
-        return
-    
-    # Get all users with the Consultant role
-    consultant_users = db.session.query(User).join(user_roles).filter(user_roles.c.role_id == consultant_role.id).all()
-    
-    # For each user with the Consultant role, check if they have a consultant entry
-    for user in consultant_users:
-        # Check if the user already has a consultant entry
-        existing_consultant = Consultant.query.filter_by(user_id=user.id).first()
-        if not existing_consultant:
-            # Create a new consultant entry for the user
-            new_consultant = Consultant(
-                user_id=user.id,
-                status='Active',
-                availability_days_per_month=0
-            )
-            db.session.add(new_consultant)
-    
-    # Commit the changes
-    try:
-        db.session.commit()
-    except Exception as e:
-        db.session.rollback()
-        print(f"Error ensuring consultant entries: {e}")
+    consultant_role_id = get_role_id('Consultant')
+    if not consultant_role_id:
+        return 0
+    
+    now = datetime.utcnow()
+    missing_users = select(
+        user_roles.c.user_id,
+        literal('Active'),
+        literal(DEFAULT_AVAILABILITY_DAYS),
+        literal(now),
+        literal(now)
+    ).where(
+        user_roles.c.role_id == consultant_role_id,
+        ~exists().where(Consultant.user_id == user_roles.c.user_id)
+    )
+    result = db.session.execute(
+        insert(Consultant).from_select(
+            ['user_id', 'status', 'availability_days_per_month', 'created_at', 'updated_at'],
+            missing_users
+        )
+    )
+    return result.rowcount
 
 def ensure_consultant_status_list():
     """
     Ensure that the 'Consultant Status' list exists in the database.
-    This helps maintain consistency in the application.
+    The caller commits.
+    
+    Returns:
+        bool: True if the list was created
     """
-    # Check if the list already exists
-    status_list = List.query.filter_by(name='Consultant Status').first()
-    if not status_list:
-        try:
-            # Create the list
-            status_list = List(name='Consultant Status', description='Status options for consultants')
-            db.session.add(status_list)
-            db.session.flush()  # This assigns the ID without committing the transaction
-            
-            # Add default status options
-            statuses = ['Active', 'Inactive', 'On Leave']
-            for i, status in enumerate(statuses):
-                item = ListItem(value=status, display_order=i+1, list_id=status_list.id)
-                db.session.add(item)
-            
-            # Commit all changes
-            db.session.commit()
-        except Exception as e:
-            db.session.rollback()
-            print(f"Error creating Consultant Status list: {e}")
-            # Provide fallback behavior
-            return None
+    if List.query.filter_by(name='Consultant Status').first():
+        return False
+    
+    # Create the list
+    status_list = List(name='Consultant Status', description='Status options for consultants')
+    db.session.add(status_list)
+    db.session.flush()  # This assigns the ID without committing the transaction
+    
+    # Add default status options
+    for i, status in enumerate(DEFAULT_CONSULTANT_STATUSES):
+        db.session.add(ListItem(value=status, order=i+1, list_id=status_list.id))
+    return True
+
+def get_consultant_statuses():
+    """
+    Get consultant status options for dropdowns without writing to the database.
+    Falls back to the default statuses if the 'Consultant Status' list doesn't exist.
+    """
+    statuses = get_list_items('Consultant Status')
+    if statuses:
+        return statuses
+    return [{'value': status} for status in DEFAULT_CONSULTANT_STATUSES]
+
+@consultants_bp.cli.command('backfill')
+def backfill_consultants_command():
+    """Create missing consultant records and the Consultant Status list."""
+    try:
+        created_list = ensure_consultant_status_list()
+        created_entries = ensure_consultant_entries()
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.error("Error backfilling consultants: %s", e)
+        raise click.ClickException(str(e))
     
-    return status_list
+    if created_list:
+        invalidate_reference_data()
+        click.echo("Created the Consultant Status list.")
+    click.echo(f"Created {created_entries} missing consultant entries.")
 
 @consultants_bp.route('/')
 @login_required
 def list_consultants():
     """
-    Display a list of all consultants.
+    Display one page of consultants, sorted by name.
     """
-    # Ensure consultant entries for users with Consultant role
-    ensure_consultant_entries()
-    
-    # Ensure the Consultant Status list exists
-    status_list = ensure_consultant_status_list()
-    
     # Get search parameters
     search = request.args.get('search', '')
     status_filter = request.args.get('status', '')
     expertise_filter = request.args.get('expertise', '')
-    
-    # Base query
-    query = Consultant.query.join(User)
-    
-    # Apply filters
-    if search:
-        # Search in user data
-        user_match = db.or_(
-            User.first_name.ilike(f'%{search}%'),
-            User.last_name.ilike(f'%{search}%'),
-            User.email.ilike(f'%{search}%')
-        )
-        
-        # Get consultants with matching expertise
-        expertise_consultants = []
-        if search:
-            # Search in product groups
-            product_groups = ProductGroup.query.filter(
-                ProductGroup.name.ilike(f'%{search}%')
-            ).all()
-            
-            # Search in product elements
-            product_elements = ProductElement.query.filter(
-                ProductElement.label.ilike(f'%{search}%')
-            ).all()
-            
-            # Get consultant IDs with matching expertise
-            if product_groups:
-                for group in product_groups:
-                    expertise_entries = ConsultantExpertise.query.filter_by(product_group_id=group.id).all()
-                    for entry in expertise_entries:
-                        if entry.consultant_id not in expertise_consultants:
-                            expertise_consultants.append(entry.consultant_id)
-            
-            if product_elements:
-                for element in product_elements:
-                    expertise_entries = ConsultantExpertise.query.filter_by(product_element_id=element.id).all()
-                    for entry in expertise_entries:
-                        if entry.consultant_id not in expertise_consultants:
-                            expertise_consultants.append(entry.consultant_id)
-        
-        # Combine user match and expertise match
-        if expertise_consultants:
-            query = query.filter(
-                db.or_(
-                    user_match,
-                    Consultant.id.in_(expertise_consultants)
-                )
-            )
-        else:
-            query = query.filter(user_match)
-    
-    # Apply status filter
-    if status_filter:
-        query = query.filter(Consultant.status == status_filter)
-    
-    # Apply expertise filter
-    if expertise_filter:
-        expertise_consultants = []
-        
-        # Check if it's a product group or element filter
-        if expertise_filter.startswith('group_'):
-            # Filter by product group
-            group_id = expertise_filter.split('_')[1]
-            expertise_entries = ConsultantExpertise.query.filter_by(product_group_id=group_id).all()
-            for entry in expertise_entries:
-                if entry.consultant_id not in expertise_consultants:
-                    expertise_consultants.append(entry.consultant_id)
-        elif expertise_filter.startswith('element_'):
-            # Filter by product element
-            element_id = expertise_filter.split('_')[1]
-            expertise_entries = ConsultantExpertise.query.filter_by(product_element_id=element_id).all()
-            for entry in expertise_entries:
-                if entry.consultant_id not in expertise_consultants:
-                    expertise_consultants.append(entry.consultant_id)
-        
-        # Apply the expertise filter
-        if expertise_consultants:
-            query = query.filter(Consultant.id.in_(expertise_consultants))
-        else:
-            # If no consultants match the expertise filter, return an empty list
-            query = query.filter(Consultant.id == -1)  # This will return no results
-    
-    # Get all consultants
-    consultants = query.all()
-    
-    # Get all product groups for expertise selection
-    product_groups = ProductGroup.query.all()
-    
-    # Get product elements for filtering
-    product_elements = ProductElement.query.all()
+    min_rating = request.args.get('min_rating', type=int)
+    
+    cursor = request.args.get('cursor')
+    per_page = min(max(request.args.get('per_page', CONSULTANTS_PER_PAGE, type=int), 1), MAX_CONSULTANTS_PER_PAGE)
+    
+    # Build a single query for all filters
+    query = search_consultants(
+        search=search,
+        status=status_filter,
+        expertise=expertise_filter,
+        min_rating=min_rating
+    ).options(
+        contains_eager(Consultant.user),
+        selectinload(Consultant.expertise_entries).joinedload(ConsultantExpertise.product_group),
+        selectinload(Consultant.expertise_entries).joinedload(ConsultantExpertise.product_element)
+    )
+    
+    # Get one page of consultants sorted by name
+    page = paginate_keyset(query, consultant_sort_keys(), cursor=cursor, per_page=per_page)
+    
+    # Only the selected expertise filter is rendered; other options come from
+    # the typeahead endpoint
+    selected_expertise = get_expertise_option(expertise_filter) if expertise_filter else None
     
     # Get all statuses for filter dropdown
-    if status_list:
-        statuses = status_list.items
-    else:
-        # Fallback to default statuses if the list doesn't exist
-        statuses = [
-            {'value': 'Active'},
-            {'value': 'Inactive'},
-            {'value': 'On Leave'}
-        ]
+    statuses = get_consultant_statuses()
     
     # Get user roles for permission checks
     user_roles = get_user_roles(current_user)
     
     return render_template('consultants/list.html', 
-                          consultants=consultants, 
+                          consultants=page.items, 
+                          next_cursor=page.next_cursor,
                           statuses=statuses,
-                          product_groups=product_groups,
-                          product_elements=product_elements,
+                          selected_expertise=selected_expertise,
                           user_roles=user_roles)
 
+def _export_filters():
+    """The consultant list filters of the request, as export arguments."""
+    return {
+        'search': request.args.get('search', ''),
+        'status': request.args.get('status', ''),
+        'expertise': request.args.get('expertise', ''),
+        'min_rating': request.args.get('min_rating', type=int),
+    }
+
+@consultants_bp.route('/export', methods=['GET'])
+@login_required
+def export_consultants():
+    """
+    Download the consultants matching the list filters as CSV, NDJSON or
+    XLSX (format parameter). Rows are streamed as they are read.
+    """
+    try:
+        return export_response(consultant_export(**_export_filters()), request.args.get('format', 'csv'))
+    except ExportFormatError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+
+@consultants_bp.route('/expertise/export', methods=['GET'])
+@login_required
+def export_expertise():
+    """
+    Download the expertise ratings of the consultants matching the list
+    filters, one row per rating, as CSV, NDJSON or XLSX (format parameter).
+    """
+    try:
+        return export_response(expertise_export(**_export_filters()), request.args.get('format', 'csv'))
+    except ExportFormatError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+
+@consultants_bp.route('/api/expertise-options', methods=['GET'])
+@login_required
+def expertise_options():
+    """
+    Get expertise filter options matching a search term in JSON format.
+    """
+    term = request.args.get('q', '').strip()
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 50)
+    return jsonify({'success': True, 'options': search_expertise_options(term, limit=limit)})
+
+@consultants_bp.route('/expertise/editor', methods=['GET'])
+@login_required
+def expertise_editor():
+    """
+    Render the expertise rating editor for the product catalog.
+    The consultant list loads it once, when the first consultant is expanded.
+    """
+    product_groups = ProductGroup.query.options(
+        selectinload(ProductGroup.elements)
+    ).order_by(ProductGroup.name, ProductGroup.id).all()
+    return render_template('consultants/expertise_editor.html', product_groups=product_groups)
+
 @consultants_bp.route('/consultant/<int:consultant_id>', methods=['GET', 'POST'])
 @consultants_bp.route('/consultant/new', methods=['GET', 'POST'])
 @login_required
@@ -268,16 +258,7 @@ def manage_consultant(consultant_id=None):
     product_groups = ProductGroup.query.all()
     
     # Get consultant statuses
-    status_list = ensure_consultant_status_list()
-    if status_list:
-        statuses = status_list.items
-    else:
-        # Fallback to default statuses if the list doesn't exist
-        statuses = [
-            {'value': 'Active'},
-            {'value': 'Inactive'},
-            {'value': 'On Leave'}
-        ]
+    statuses = get_consultant_statuses()
     
     if request.method == 'POST':
         try:
@@ -345,6 +326,7 @@ def manage_consultant(consultant_id=None):
             # Note: Expertise is now handled through the API, not through this form
             
             db.session.commit()
+            invalidate_role_cache()
             
             flash(f'Consultant {"updated" if consultant_id else "created"} successfully.', 'success')
             return redirect(url_for('consultants.view_consultant', consultant_id=consultant.id))
@@ -399,7 +381,7 @@ def view_consultant(consultant_id):
                               user_last_name=last_name,
                               user_email=email)
     except Exception as e:
-        app.logger.error(f"Error viewing consultant {consultant_id}: {str(e)}")
+        current_app.logger.error("Error viewing consultant %s: %s", consultant_id, e)
         flash(f"Error loading consultant details: {str(e)}", 'danger')
         return redirect(url_for('consultants.list_consultants'))
 
@@ -433,6 +415,7 @@ def delete_consultant(consultant_id):
             user.roles.remove(consultant_role)
     
     db.session.commit()
+    invalidate_role_cache()
     
     flash('Consultant deleted successfully.', 'success')
     return redirect(url_for('consultants.list_consultants'))
@@ -452,7 +435,7 @@ def db_transaction():
         db.session.commit()
     except Exception as e:
         db.session.rollback()
-        app.logger.error(f"Database transaction error: {str(e)}")
+        current_app.logger.error("Database transaction error: %s", e)
         raise 
 
 @consultants_bp.route('/expertise/update', methods=['POST'])
@@ -473,8 +456,8 @@ def update_consultant_expertise():
         notes = data.get('notes', '')
         
         # Log the request data
-        logger.info(f"Updating expertise for consultant {consultant_id}: {data}")
-        admin_logger.info(f"Consultant expertise update for ID {consultant_id}, {expertise_type} {item_id}")
+        logger.debug("Updating expertise for consultant %s", consultant_id, extra={'sample': 20})
+        admin_logger.info("Consultant expertise update for ID %s, %s %s", consultant_id, expertise_type, item_id)
         
         if not all([consultant_id, expertise_type, item_id]):
             error_msg = f'Missing required parameters: consultant_id={consultant_id}, expertise_type={expertise_type}, item_id={item_id}'
@@ -501,60 +484,32 @@ def update_consultant_expertise():
                         group_name = safe_get_attr(element.group, 'name', "Unknown Group")
                         item_name = f"{item_name} ({group_name})"
             
-            # Handle different expertise types
-            if expertise_type == 'product_group' or expertise_type == 'product_element':
-                # Find existing expertise entry if any
-                if expertise_type == 'product_group':
-                    existing_expertise = ConsultantExpertise.query.filter_by(
-                        consultant_id=consultant_id,
-                        product_group_id=item_id,
-                        product_element_id=None
-                    ).first()
-                else:  # product_element
-                    existing_expertise = ConsultantExpertise.query.filter_by(
-                        consultant_id=consultant_id,
-                        product_element_id=item_id,
-                        product_group_id=None
-                    ).first()
-                
-                if int(rating) == 0:
-                    # Remove expertise if rating is 0
-                    if existing_expertise:
-                        logger.info(f"Removing expertise for {item_name} (ID: {item_id})")
-                        admin_logger.info(f"Removing expertise for {item_name} (ID: {item_id})")
-                        db.session.delete(existing_expertise)
-                elif 1 <= int(rating) <= 5:
-                    # Update or create expertise with valid rating (1-5)
-                    if existing_expertise:
-                        # Update existing entry
-                        existing_expertise.rating = int(rating)
-                        existing_expertise.notes = notes
-                        existing_expertise.updated_at = datetime.utcnow()
-                        logger.info(f"Updating expertise for {item_name} (ID: {item_id}) to rating {rating}")
-                        admin_logger.info(f"Updating expertise for {item_name} (ID: {item_id}) to rating {rating}")
-                    else:
-                        # Create new entry
-                        new_expertise = ConsultantExpertise(
-                            consultant_id=consultant_id,
-                            rating=int(rating),
-                            notes=notes
-                        )
-                        
-                        # Set the appropriate field based on expertise type
-                        if expertise_type == 'product_group':
-                            new_expertise.product_group_id = item_id
-                        else:  # product_element
-                            new_expertise.product_element_id = item_id
-                        
-                        db.session.add(new_expertise)
-                        logger.info(f"Creating new expertise for {item_name} (ID: {item_id}) with rating {rating}")
-                        admin_logger.info(f"Creating new expertise for {item_name} (ID: {item_id}) with rating {rating}")
-                else:
-                    # Invalid rating
-                    error_msg = f"Invalid rating value: {rating}. Must be between 1 and 5."
-                    logger.error(error_msg)
-                    admin_logger.error(error_msg)
-                    return jsonify({'success': False, 'message': error_msg}), 400
+            # Validate and apply the rating as an upsert, so concurrent saves
+            # of the same item cannot create duplicate rows
+            try:
+                entries = validate_expertise_ratings([{
+                    'consultant_id': consultant_id,
+                    'expertise_type': expertise_type,
+                    'item_id': item_id,
+                    'rating': rating,
+                    'notes': notes
+                }])
+            except ExpertiseValidationError as validation_error:
+                error_msg = str(validation_error)
+                logger.error(error_msg)
+                admin_logger.error(error_msg)
+                return jsonify({'success': False, 'message': error_msg}), 400
+            
+            rating = entries[0]['rating']
+            changes = apply_expertise_ratings(entries)
+            if rating == 0:
+                if changes['removed']:
+                    logger.debug("Removing expertise for %s (ID: %s)", item_name, item_id, extra={'sample': 20})
+                    admin_logger.info("Removing expertise for %s (ID: %s)", item_name, item_id)
+            else:
+                logger.debug("Setting expertise for %s (ID: %s) to rating %s", item_name, item_id, rating,
+                             extra={'sample': 20})
+                admin_logger.info("Setting expertise for %s (ID: %s) to rating %s", item_name, item_id, rating)
             
             # Save changes
             db.session.commit()
@@ -564,31 +519,69 @@ def update_consultant_expertise():
                 success_msg = f"Expertise removed for {item_name}"
             else:
                 success_msg = f"Expertise set to {rating} stars for {item_name}"
-                
-            logger.info(success_msg)
-            admin_logger.info(success_msg)
+            
             return jsonify({'success': True, 'message': success_msg})
         
         except Exception as inner_e:
             db.session.rollback()
-            error_msg = f"Error processing expertise update: {str(inner_e)}"
-            stack_trace = traceback.format_exc()
-            logger.error(f"{error_msg}\n{stack_trace}")
-            admin_logger.error(f"{error_msg}\n{stack_trace}")
+            logger.exception("Error processing expertise update: %s", inner_e)
+            admin_logger.exception("Error processing expertise update: %s", inner_e)
             return jsonify({'success': False, 'message': 'Error updating expertise', 'error_details': str(inner_e)}), 500
     
     except Exception as e:
         db.session.rollback()
-        error_msg = f"Error updating expertise for consultant: {str(e)}"
-        stack_trace = traceback.format_exc()
-        logger.error(f"{error_msg}\n{stack_trace}")
-        admin_logger.error(f"{error_msg}\n{stack_trace}")
+        logger.exception("Error updating expertise for consultant: %s", e)
+        admin_logger.exception("Error updating expertise for consultant: %s", e)
         return jsonify({
             'success': False, 
             'message': 'Error updating expertise. Please try again.',
             'error_details': str(e)
         }), 500
 
+@consultants_bp.route('/expertise/batch', methods=['POST'])
+@login_required
+@manager_required
+def update_consultant_expertise_batch():
+    """
+    Update many expertise ratings via AJAX in one transaction.
+    Expects {"consultant_id": <default id>, "ratings": [{"consultant_id",
+    "expertise_type", "item_id", "rating", "notes"}, ...]}; entries without a
+    consultant_id use the default. A rating of 0 clears the item.
+    """
+    data = request.get_json(silent=True) or {}
+    ratings = data.get('ratings')
+    if not isinstance(ratings, list):
+        return jsonify({'success': False, 'message': 'Missing required parameter: ratings'}), 400
+    
+    default_consultant_id = data.get('consultant_id')
+    if default_consultant_id is not None:
+        ratings = [
+            dict(entry, consultant_id=entry.get('consultant_id', default_consultant_id)) if isinstance(entry, dict) else entry
+            for entry in ratings
+        ]
+    
+    try:
+        entries = validate_expertise_ratings(ratings)
+    except ExpertiseValidationError as e:
+        logger.error("Invalid expertise batch: %s", e)
+        return jsonify({'success': False, 'message': 'Invalid expertise ratings', 'errors': e.errors}), 400
+    
+    try:
+        changes = apply_expertise_ratings(entries)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.exception("Error applying expertise batch: %s", e)
+        admin_logger.exception("Error applying expertise batch: %s", e)
+        return jsonify({'success': False, 'message': 'Error updating expertise. Please try again.'}), 500
+    
+    consultant_count = len({entry['consultant_id'] for entry in entries})
+    success_msg = (f"Expertise updated for {consultant_count} consultant(s): "
+                   f"{changes['updated']} set, {changes['removed']} removed")
+    logger.info(success_msg)
+    admin_logger.info(success_msg)
+    return jsonify({'success': True, 'message': success_msg, **changes})
+
 @consultants_bp.route('/expertise/list/<int:consultant_id>', methods=['GET'])
 @login_required
 def list_consultant_expertise(consultant_id):
@@ -601,7 +594,10 @@ def list_consultant_expertise(consultant_id):
         expertise_list = []
         
         # Get all expertise entries for the consultant
-        expertise_entries = ConsultantExpertise.query.filter_by(consultant_id=consultant_id).all()
+        expertise_entries = ConsultantExpertise.query.filter_by(consultant_id=consultant_id).options(
+            joinedload(ConsultantExpertise.product_group),
+            joinedload(ConsultantExpertise.product_element).joinedload(ProductElement.group)
+        ).all()
         
         for entry in expertise_entries:
             if entry.product_group_id:
@@ -629,11 +625,100 @@ def list_consultant_expertise(consultant_id):
         })
     
     except Exception as e:
-        error_msg = f"Error listing expertise for consultant: {str(e)}"
-        stack_trace = traceback.format_exc()
-        logger.error(f"{error_msg}\n{stack_trace}")
+        logger.exception("Error listing expertise for consultant: %s", e)
         return jsonify({'success': False, 'message': str(e)}), 500
 
+@consultants_bp.route('/expertise/matrix', methods=['GET'])
+@login_required
+def expertise_matrix():
+    """
+    Get every consultant's ratings against the whole catalog in columnar
+    JSON form. Pass format=dense for a row-major rating array instead of
+    sparse (row, column, value) arrays. Supports conditional requests.
+    """
+    dense = request.args.get('format') == 'dense'
+    body, etag = get_expertise_matrix_json(dense=dense)
+    response = current_app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
+
+@consultants_bp.route('/api/recommendations', methods=['GET'])
+@login_required
+def staffing_recommendations():
+    """
+    Recommend consultants for product groups and elements in JSON format.
+    Query parameters: groups and elements ('id' or 'id:weight', comma
+    separated), min_rating, status (repeatable, 'any' for all statuses),
+    limit and require_all.
+    """
+    criteria = parse_criteria(request.args.get('groups', ''), request.args.get('elements', ''))
+    if criteria is None:
+        return jsonify({'success': False, 'message': 'Invalid groups or elements'}), 400
+    if not criteria:
+        return jsonify({'success': True, 'recommendations': []})
+    
+    statuses = request.args.getlist('status') or ['Active']
+    recommendations = get_staffing_index().recommend(
+        criteria,
+        min_rating=min(max(request.args.get('min_rating', 1, type=int), 1), 5),
+        statuses=None if 'any' in statuses else frozenset(statuses),
+        limit=min(max(request.args.get('limit', 10, type=int), 1), 100),
+        require_all=request.args.get('require_all') in ('1', 'true')
+    )
+    return jsonify({'success': True, 'recommendations': describe_recommendations(recommendations)})
+
+def utilization_window():
+    """
+    Get the utilization window from the request: start (YYYY-MM, default
+    the current month) and months (default 12).
+    
+    Returns:
+        tuple: (first day of the window, number of months), or None if the
+        start month is invalid
+    """
+    start = request.args.get('start', '')
+    try:
+        start = datetime.strptime(start, '%Y-%m').date() if start else date.today().replace(day=1)
+    except ValueError:
+        return None
+    months = min(max(request.args.get('months', DEFAULT_MONTHS, type=int), 1), MAX_MONTHS)
+    return start, months
+
+@consultants_bp.route('/utilization', methods=['GET'])
+@login_required
+def utilization():
+    """Display the consultant workload and availability heatmap."""
+    window = utilization_window()
+    if window is None:
+        flash('Invalid start month.', 'danger')
+        return redirect(url_for('consultants.utilization'))
+    start, months = window
+    status = request.args.get('status', 'Active')
+    heatmap = describe_utilization(get_utilization_matrix(start, months), status=status or None)
+    return render_template(
+        'consultants/utilization.html',
+        heatmap=heatmap,
+        start=start,
+        months=months,
+        status=status,
+        statuses=get_consultant_statuses()
+    )
+
+@consultants_bp.route('/api/utilization', methods=['GET'])
+@login_required
+def utilization_data():
+    """
+    Get planned demand, capacity and utilization per consultant and month in
+    JSON format. Query parameters: start (YYYY-MM), months and status.
+    """
+    window = utilization_window()
+    if window is None:
+        return jsonify({'success': False, 'message': 'Invalid start month, expected YYYY-MM'}), 400
+    start, months = window
+    heatmap = describe_utilization(get_utilization_matrix(start, months), status=request.args.get('status') or None)
+    return jsonify({'success': True, **heatmap})
+
 @consultants_bp.route('/update/<int:consultant_id>', methods=['POST'])
 @login_required
 @manager_required
@@ -649,8 +734,8 @@ def update_consultant_details(consultant_id):
         notes = data.get('notes')
         
         # Log the request data
-        logger.info(f"Updating consultant {consultant_id} with data: {data}")
-        admin_logger.info(f"Consultant update request for ID {consultant_id}")
+        logger.debug("Updating consultant %s", consultant_id)
+        admin_logger.info("Consultant update request for ID %s", consultant_id)
         
         # Get consultant
         consultant = Consultant.query.get_or_404(consultant_id)
@@ -660,7 +745,7 @@ def update_consultant_details(consultant_id):
         
         # Update consultant details
         if status and status != consultant.status:
-            logger.info(f"Updating status from '{consultant.status}' to '{status}'")
+            logger.info("Updating status from '%s' to '%s'", consultant.status, status)
             consultant.status = status
             changes_made = True
         
@@ -668,7 +753,7 @@ def update_consultant_details(consultant_id):
             try:
                 availability_days = int(availability_days)
                 if availability_days != consultant.availability_days_per_month:
-                    logger.info(f"Updating availability from {consultant.availability_days_per_month} to {availability_days}")
+                    logger.info("Updating availability from %s to %s", consultant.availability_days_per_month, availability_days)
                     consultant.availability_days_per_month = availability_days
                     changes_made = True
             except ValueError as e:
@@ -680,14 +765,14 @@ def update_consultant_details(consultant_id):
         if calendar_name is not None:
             new_calendar_name = calendar_name.strip() if calendar_name.strip() else None
             if new_calendar_name != consultant.calendar_name:
-                logger.info(f"Updating calendar name from '{consultant.calendar_name}' to '{new_calendar_name}'")
+                logger.info("Updating calendar name from '%s' to '%s'", consultant.calendar_name, new_calendar_name)
                 consultant.calendar_name = new_calendar_name
                 changes_made = True
         
         if notes is not None:
             new_notes = notes.strip() if notes.strip() else None
             if new_notes != consultant.notes:
-                logger.info(f"Updating notes for consultant {consultant_id}")
+                logger.info("Updating notes for consultant %s", consultant_id)
                 consultant.notes = new_notes
                 changes_made = True
         
@@ -699,15 +784,13 @@ def update_consultant_details(consultant_id):
             admin_logger.info(success_msg)
             return jsonify({'success': True, 'message': success_msg})
         else:
-            logger.info(f"No changes detected for consultant {consultant_id}")
+            logger.info("No changes detected for consultant %s", consultant_id)
             return jsonify({'success': True, 'message': 'No changes were made'})
     
     except Exception as e:
         db.session.rollback()
-        error_msg = f"Error updating consultant {consultant_id}: {str(e)}"
-        stack_trace = traceback.format_exc()
-        logger.error(f"{error_msg}\n{stack_trace}")
-        admin_logger.error(f"{error_msg}\n{stack_trace}")
+        logger.exception("Error updating consultant %s: %s", consultant_id, e)
+        admin_logger.exception("Error updating consultant %s: %s", consultant_id, e)
         return jsonify({
             'success': False, 
             'message': 'Error updating consultant. Please try again.',
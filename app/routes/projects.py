@@ -1,27 +1,33 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify
+from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, abort, current_app
 from flask_login import login_required, current_user
-from ..models import db, Project, ProjectTemplate, PhaseTemplate, User, Client, ProductService, Role, ProjectGroup, ProjectPhase, ProductGroup, List, ListItem
+from ..models import db, Project, ProjectTemplate, PhaseTemplate, User, Client, ProductService, Role, ProductGroup, ConsultantAssignment
+from sqlalchemy.orm import joinedload, lazyload
+from sqlalchemy.exc import IntegrityError
 from functools import wraps
-import os
 import json
 from datetime import datetime
 from ..utils import user_has_role as utils_user_has_role
 from ..utils import user_has_any_role as utils_user_has_any_role
+from ..reference_data import get_list, get_list_by_id, get_list_items, get_list_items_by_id, get_list_item
+from ..staffing import get_staffing_index, get_project_criteria, describe_recommendations
+from ..project_search import search_projects, count_projects, project_sort_keys, search_client_options
+from ..pagination import paginate_keyset
+from ..catalog_snapshot import get_catalog_group
+from ..exports import ExportFormatError, export_response, project_export
+from ..search_index import search, KIND_CODES, DEFAULT_SEARCH_LIMIT, MAX_SEARCH_LIMIT
+from ..project_tree import load_project_tree
+from ..project_schedule import get_project_schedule, schedule_projects
+from ..project_structure import apply_project_structure, StructureConflictError, StructureValidationError
+from ..project_instantiation import instantiate_project, instantiate_projects
+from ..project_rollout import RolloutSourceError, rollout_projects, describe_rollout
+from ..consultant_assignments import (AssignmentValidationError, validate_assignment, get_project_assignments,
+                                      is_assigned_to_project, serialize_assignment)
 
 projects_bp = Blueprint('projects', __name__, url_prefix='/projects')
 
-# Helper function to load settings
-def load_settings():
-    """Load settings from JSON file"""
-    settings_file = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'static', 'settings.json')
-    try:
-        if os.path.exists(settings_file):
-            with open(settings_file, 'r') as f:
-                return json.load(f)
-        return {}
-    except Exception as e:
-        print(f"Error loading settings: {e}")
-        return {}
+# Page size of the project list
+PROJECTS_PER_PAGE = 25
+MAX_PROJECTS_PER_PAGE = 100
 
 # Helper function to check if user has a specific role
 def user_has_role(user, role_name):
@@ -33,6 +39,14 @@ def user_has_any_role(user, role_names):
     """Check if a user has any of the specified roles."""
     return utils_user_has_any_role(user, role_names)
 
+def get_project_statuses():
+    """
+    Get project status items from ProjectStatusList.
+    Falls back to the list with ID 6 (known ProjectStatusList ID).
+    """
+    statuses_list = get_list('ProjectStatusList') or get_list_by_id(6)
+    return statuses_list.items if statuses_list else ()
+
 # Custom decorator for manager-only routes
 def manager_required(f):
     """
@@ -61,52 +75,110 @@ def project_manager_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def can_view_project(user, project):
+    """
+    Check if a user may view a project: admins, managers and the project's
+    manager can, and consultants only if they are assigned to it.
+    """
+    if user_has_role(user, 'Admin') or user_has_role(user, 'Manager') or project.manager_id == user.id:
+        return True
+    return not user_has_role(user, 'Consultant') or is_assigned_to_project(user.id, project.id)
+
 @projects_bp.route('/')
 @login_required
 def list_projects():
     """
-    Display a list of all projects with filtering options.
+    Display one page of projects with filtering options, newest first.
     
     GET: Display projects list with optional filters
     """
     # Get filter parameters
     search_query = request.args.get('search', '')
     status_filter = request.args.get('status_filter', '')
-    client_filter = request.args.get('client_filter', '')
-    
-    # Base query
-    query = Project.query
+    client_filter = request.args.get('client_filter', type=int)
     
-    # Apply filters
-    if search_query:
-        query = query.filter(Project.name.ilike(f'%{search_query}%'))
+    cursor = request.args.get('cursor')
+    per_page = min(max(request.args.get('per_page', PROJECTS_PER_PAGE, type=int), 1), MAX_PROJECTS_PER_PAGE)
     
-    if status_filter:
-        query = query.filter(Project.status == status_filter)
+    # Load the columns shown in the list only; products are not needed here
+    query = search_projects(search=search_query, status=status_filter, client_id=client_filter).options(
+        joinedload(Project.client),
+        joinedload(Project.manager),
+        joinedload(Project.status_item),
+        lazyload(Project.products)
+    )
+    page = paginate_keyset(query, project_sort_keys(), cursor=cursor, per_page=per_page, descending=True)
     
-    if client_filter:
-        query = query.filter(Project.client_id == client_filter)
+    # Cached per filter combination until projects change
+    total = count_projects(search=search_query, status=status_filter, client_id=client_filter)
     
-    # Get all projects with filters applied
-    projects = query.order_by(Project.created_at.desc()).all()
-    
-    # Get all clients for filter dropdown
-    clients = Client.query.all()
+    # Only the selected client is rendered; other options come from the typeahead endpoint
+    selected_client = db.session.get(Client, client_filter) if client_filter else None
     
     # Get project statuses for dropdown from ProjectStatusList
-    project_statuses_list = List.query.filter_by(name='ProjectStatusList').first()
-    if project_statuses_list:
-        # Directly query the ListItem table to ensure we get the items
-        project_statuses = ListItem.query.filter_by(list_id=project_statuses_list.id).order_by(ListItem.order).all()
-    else:
-        # Try to find the list by ID 6 (known ProjectStatusList ID)
-        project_statuses_list = List.query.filter_by(id=6).first()
-        if project_statuses_list:
-            project_statuses = ListItem.query.filter_by(list_id=project_statuses_list.id).order_by(ListItem.order).all()
-        else:
-            project_statuses = []
-    
-    return render_template('projects/list.html', projects=projects, clients=clients, project_statuses=project_statuses)
+    project_statuses = get_project_statuses()
+    
+    return render_template('projects/list.html',
+                          projects=page.items,
+                          next_cursor=page.next_cursor,
+                          total=total,
+                          selected_client=selected_client,
+                          project_statuses=project_statuses)
+
+@projects_bp.route('/export', methods=['GET'])
+@login_required
+def export_projects():
+    """
+    Download the projects matching the list filters as CSV, NDJSON or XLSX
+    (format parameter), newest first. Rows are streamed as they are read.
+    """
+    dataset = project_export(
+        search=request.args.get('search', ''),
+        status=request.args.get('status_filter', ''),
+        client_id=request.args.get('client_filter', type=int)
+    )
+    try:
+        return export_response(dataset, request.args.get('format', 'csv'))
+    except ExportFormatError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+
+@projects_bp.route('/api/client-options', methods=['GET'])
+@login_required
+def client_options():
+    """
+    Get client filter options matching a search term in JSON format.
+    """
+    term = request.args.get('q', '').strip()
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 50)
+    return jsonify({'success': True, 'options': search_client_options(term, limit=limit)})
+
+@projects_bp.route('/api/search', methods=['GET'])
+@login_required
+def search_api():
+    """
+    Search projects, phases and clients in JSON format, best matches first.
+    Every word of q is matched as a prefix; kind parameters ('project',
+    'phase', 'client') restrict the results. Titles and snippets are HTML
+    with matches in <mark> tags.
+    """
+    query = request.args.get('q', '').strip()
+    kinds = [kind for kind in request.args.getlist('kind') if kind in KIND_CODES] or None
+    limit = min(max(request.args.get('limit', DEFAULT_SEARCH_LIMIT, type=int), 1), MAX_SEARCH_LIMIT)
+    hits = search(query, kinds=kinds, limit=limit)
+    return jsonify({
+        'success': True,
+        'results': [
+            {
+                'kind': hit.kind,
+                'id': hit.id,
+                'project_id': hit.project_id,
+                'rank': hit.rank,
+                'title': str(hit.title),
+                'snippet': str(hit.snippet)
+            }
+            for hit in hits
+        ]
+    })
 
 @projects_bp.route('/create', methods=['GET', 'POST'])
 @login_required
@@ -127,35 +199,15 @@ def create_project():
     product_groups = ProductGroup.query.all()
     
     # Get lists for dropdowns - Use list_id=5 for Industries
-    industries_list = List.query.filter_by(id=5).first()
-    industries = industries_list.items if industries_list else []
+    industries = get_list_items_by_id(5)
     
     # Get Profit Centers from list id=2
-    profit_centers_list = List.query.filter_by(id=2).first()
-    profit_centers = profit_centers_list.items if profit_centers_list else []
+    profit_centers = get_list_items_by_id(2)
     
-    phase_durations_list = List.query.filter_by(name='PhaseDuration').first()
-    phase_durations = phase_durations_list.items if phase_durations_list else []
+    phase_durations = get_list_items('PhaseDuration')
     
     # Get project statuses for dropdown from ProjectStatusList
-    project_statuses_list = List.query.filter_by(name='ProjectStatusList').first()
-    if project_statuses_list:
-        # Directly query the ListItem table to ensure we get the items
-        project_statuses = ListItem.query.filter_by(list_id=project_statuses_list.id).order_by(ListItem.order).all()
-    else:
-        # Try to find the list by ID 6 (known ProjectStatusList ID)
-        project_statuses_list = List.query.filter_by(id=6).first()
-        if project_statuses_list:
-            project_statuses = ListItem.query.filter_by(list_id=project_statuses_list.id).order_by(ListItem.order).all()
-        else:
-            project_statuses = []
-    
-    # Debug print
-    print(f"DEBUG - Project Statuses List: {project_statuses_list}")
-    print(f"DEBUG - Project Statuses: {project_statuses}")
-    if project_statuses:
-        for status in project_statuses:
-            print(f"DEBUG - Status: {status.id} - {status.value}")
+    project_statuses = get_project_statuses()
     
     if request.method == 'POST':
         try:
@@ -173,33 +225,23 @@ def create_project():
             # Get status_id from form
             status_id = request.form.get('status_id')
             
-            # Debug print
-            print(f"DEBUG - Form data received:")
-            print(f"DEBUG - name: {name}")
-            print(f"DEBUG - client_id: {client_id}")
-            print(f"DEBUG - manager_id: {manager_id}")
-            print(f"DEBUG - status_id: {status_id}")
-            
             # Set default status to "Preparation" if not provided
             if not status_id and project_statuses:
                 # Find the "Preparation" status
                 preparation_status = next((s for s in project_statuses if s.value == "Preparation"), None)
                 if preparation_status:
                     status_id = preparation_status.id
-                    print(f"DEBUG - Using default status_id: {status_id}")
             
             # Get the status value from the status_id
             status_value = None
             if status_id:
-                status_item = ListItem.query.get(status_id)
+                status_item = get_list_item(status_id)
                 if status_item:
                     status_value = status_item.value
-                    print(f"DEBUG - Found status_value: {status_value}")
             
             # If no status_value was found, default to "Preparation"
             if not status_value:
                 status_value = "Preparation"
-                print(f"DEBUG - Using default status_value: {status_value}")
             
             # Validate form data
             if not name or not client_id or not manager_id:
@@ -217,80 +259,36 @@ def create_project():
                 start_date_obj = datetime.strptime(start_date, '%Y-%m-%d').date() if start_date else None
                 end_date_obj = datetime.strptime(end_date, '%Y-%m-%d').date() if end_date else None
             
-            # Create new project
-            new_project = Project(
-                name=name,
-                description=description,
-                client_id=client_id,
-                manager_id=manager_id,
-                template_id=template_id if template_id else None,
-                start_date=start_date_obj,
-                end_date=end_date_obj,
-                status=status_value,
-                status_id=status_id,
-                industry_id=industry_id,
-                profit_center_id=profit_center_id
-            )
-            
-            # Add project to database
-            db.session.add(new_project)
+            # Create the project with its template products, groups and phases
+            # in bulk inserts and commit them together
+            values = {
+                'name': name,
+                'description': description,
+                'client_id': client_id,
+                'manager_id': manager_id,
+                'template_id': template_id if template_id else None,
+                'start_date': start_date_obj,
+                'end_date': end_date_obj,
+                'status': status_value,
+                'status_id': status_id,
+                'industry_id': industry_id,
+                'profit_center_id': profit_center_id
+            }
+            group_data = json.loads(request.form.get('group_data') or '[]')
+            project_id = instantiate_project(values, group_data)
             db.session.commit()
-            print(f"DEBUG - Project created with ID: {new_project.id}")
-            
-            # If template was selected, copy products from template to project
-            if template_id:
-                template = ProjectTemplate.query.get(template_id)
-                if template and template.products:
-                    for product in template.products:
-                        new_project.products.append(product)
-                    db.session.commit()
-            
-            # Process project groups and phases if submitted
-            if 'group_data' in request.form:
-                try:
-                    group_data = json.loads(request.form.get('group_data'))
-                    print(f"DEBUG - Processing {len(group_data)} groups")
-                    
-                    for group_idx, group in enumerate(group_data):
-                        # Create project group
-                        new_group = ProjectGroup(
-                            project_id=new_project.id,
-                            product_group_id=group['product_group_id'],
-                            order=group_idx
-                        )
-                        db.session.add(new_group)
-                        db.session.flush()  # Get the new group ID
-                        
-                        # Create phases for this group
-                        for phase_idx, phase in enumerate(group['phases']):
-                            new_phase = ProjectPhase(
-                                group_id=new_group.id,
-                                name=phase['name'],
-                                description=phase.get('description', ''),
-                                duration_id=phase.get('duration_id'),
-                                online=phase.get('online', False),
-                                order=phase_idx
-                            )
-                            db.session.add(new_phase)
-                    
-                    db.session.commit()
-                    print(f"DEBUG - Project structure processed successfully")
-                except Exception as e:
-                    db.session.rollback()
-                    print(f"DEBUG - Error processing project structure: {str(e)}")
-                    import traceback
-                    print(traceback.format_exc())
-                    flash(f'Error processing project structure: {str(e)}', 'danger')
-                    return redirect(url_for('projects.edit_project', project_id=new_project.id))
             
             flash('Project created successfully!', 'success')
-            return redirect(url_for('projects.view_project', project_id=new_project.id))
+            return redirect(url_for('projects.view_project', project_id=project_id))
+        
+        except StructureValidationError as e:
+            db.session.rollback()
+            flash(f'Error processing project structure: {"; ".join(e.errors)}', 'danger')
+            return redirect(url_for('projects.create_project'))
         
         except Exception as e:
             db.session.rollback()
-            print(f"DEBUG - Error creating project: {str(e)}")
-            import traceback
-            print(traceback.format_exc())
+            current_app.logger.exception("Error creating project: %s", e)
             flash(f'Error creating project: {str(e)}', 'danger')
             return redirect(url_for('projects.create_project'))
     
@@ -306,6 +304,87 @@ def create_project():
         project_statuses=project_statuses
     )
 
+@projects_bp.route('/rollout', methods=['GET', 'POST'])
+@login_required
+@project_manager_required
+def rollout_project():
+    """
+    Roll a project or template out to many clients at once.
+    
+    GET: Display the rollout form, with the source project from ?project_id
+    POST: Create one project per selected client
+    """
+    source_project = db.session.get(Project, request.values.get('project_id', type=int)) \
+        if request.values.get('project_id') else None
+    
+    if request.method == 'POST':
+        client_ids = request.form.getlist('client_ids', type=int)
+        manager_id = request.form.get('manager_id', type=int)
+        start_date = request.form.get('start_date') or None
+        targets = [
+            {'client_id': client_id, 'manager_id': manager_id, 'start_date': start_date}
+            for client_id in client_ids
+        ]
+        try:
+            result = rollout_projects(
+                targets,
+                project_id=source_project.id if source_project else None,
+                template_id=request.form.get('template_id', type=int)
+            )
+            db.session.commit()
+        except (RolloutSourceError, StructureValidationError) as e:
+            db.session.rollback()
+            flash(f'Error rolling out projects: {e}', 'danger')
+            return redirect(url_for('projects.rollout_project', project_id=source_project.id if source_project else None))
+        except IntegrityError as e:
+            # References removed by a concurrent transaction since they were checked
+            db.session.rollback()
+            flash(f'Error rolling out projects: {e.orig}', 'danger')
+            return redirect(url_for('projects.rollout_project', project_id=source_project.id if source_project else None))
+        
+        if result.created:
+            flash(f'{len(result.created)} projects created.', 'success')
+        for index, errors in result.failed:
+            flash(f'Client {client_ids[index]} skipped: {"; ".join(errors)}', 'warning')
+        return redirect(url_for('projects.list_projects'))
+    
+    return render_template(
+        'projects/rollout.html',
+        source_project=source_project,
+        templates=ProjectTemplate.query.order_by(ProjectTemplate.name).all(),
+        clients=Client.query.order_by(Client.name).all(),
+        managers=User.query.join(User.roles).filter(Role.name == 'Project Manager').all()
+    )
+
+@projects_bp.route('/api/rollout', methods=['POST'])
+@login_required
+def rollout_projects_api():
+    """
+    Roll a project or template out to many clients in one transaction.
+    Expects {"project_id" or "template_id", "targets": [{"client_id",
+    "manager_id", "start_date", "end_date", "name"}]}. Invalid targets are
+    reported per row and the others are created.
+    """
+    if not (user_has_any_role(current_user, ['Admin', 'Manager', 'Project Manager']) or current_user.username == 'admin'):
+        return jsonify({'success': False, 'message': 'You do not have permission to create projects.'}), 403
+    
+    data = request.get_json(silent=True) or {}
+    try:
+        result = rollout_projects(data.get('targets'), project_id=data.get('project_id'), template_id=data.get('template_id'))
+        db.session.commit()
+    except RolloutSourceError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except StructureValidationError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': 'Invalid source structure', 'errors': e.errors}), 400
+    except IntegrityError as e:
+        # References removed by a concurrent transaction since they were checked
+        db.session.rollback()
+        return jsonify({'success': False, 'message': 'Invalid targets', 'errors': [str(e.orig)]}), 400
+    
+    return jsonify(dict(describe_rollout(result), success=True))
+
 @projects_bp.route('/edit/<int:project_id>', methods=['GET', 'POST'])
 @login_required
 @project_manager_required
@@ -317,7 +396,9 @@ def edit_project(project_id):
     POST: Process project editing form submission
     """
     # Get project
-    project = Project.query.get_or_404(project_id)
+    project, tree = load_project_tree(project_id)
+    if project is None:
+        abort(404)
     
     # Check if user has permission to edit this project
     if not user_has_role(current_user, 'Admin') and not user_has_role(current_user, 'Manager') and project.manager_id != current_user.id:
@@ -332,28 +413,15 @@ def edit_project(project_id):
     product_groups = ProductGroup.query.all()
     
     # Get lists for dropdowns
-    industries_list = List.query.filter_by(id=5).first()
-    industries = industries_list.items if industries_list else []
+    industries = get_list_items_by_id(5)
     
     # Get Profit Centers from list id=2
-    profit_centers_list = List.query.filter_by(id=2).first()
-    profit_centers = profit_centers_list.items if profit_centers_list else []
+    profit_centers = get_list_items_by_id(2)
     
-    phase_durations_list = List.query.filter_by(name='PhaseDuration').first()
-    phase_durations = phase_durations_list.items if phase_durations_list else []
+    phase_durations = get_list_items('PhaseDuration')
     
     # Get project statuses for dropdown from ProjectStatusList
-    project_statuses_list = List.query.filter_by(name='ProjectStatusList').first()
-    if project_statuses_list:
-        # Directly query the ListItem table to ensure we get the items
-        project_statuses = ListItem.query.filter_by(list_id=project_statuses_list.id).order_by(ListItem.order).all()
-    else:
-        # Try to find the list by ID 6 (known ProjectStatusList ID)
-        project_statuses_list = List.query.filter_by(id=6).first()
-        if project_statuses_list:
-            project_statuses = ListItem.query.filter_by(list_id=project_statuses_list.id).order_by(ListItem.order).all()
-        else:
-            project_statuses = []
+    project_statuses = get_project_statuses()
     
     if request.method == 'POST':
         # Get form data
@@ -371,7 +439,7 @@ def edit_project(project_id):
         if status_id:
             project.status_id = status_id
             # Get the status value from the status_id
-            status_item = ListItem.query.get(status_id)
+            status_item = get_list_item(status_id)
             if status_item:
                 project.status = status_item.value
         # Keep existing status or set default if none
@@ -409,38 +477,19 @@ def edit_project(project_id):
         else:
             project.end_date = None
         
-        # Process project groups and phases if submitted
+        # Apply changes to groups and phases if submitted
         if 'group_data' in request.form:
             try:
-                # Delete existing groups and phases
-                for group in project.groups:
-                    db.session.delete(group)  # This will cascade delete phases
-                db.session.flush()
-                
-                # Add new groups and phases
-                group_data = json.loads(request.form.get('group_data'))
-                for group_idx, group in enumerate(group_data):
-                    # Create project group
-                    new_group = ProjectGroup(
-                        project_id=project.id,
-                        product_group_id=group['product_group_id'],
-                        order=group_idx
-                    )
-                    db.session.add(new_group)
-                    db.session.flush()  # Get the new group ID
-                    
-                    # Create phases for this group
-                    for phase_idx, phase in enumerate(group['phases']):
-                        new_phase = ProjectPhase(
-                            group_id=new_group.id,
-                            name=phase['name'],
-                            description=phase.get('description', ''),
-                            duration_id=phase.get('duration_id'),
-                            online=phase.get('online', False),
-                            order=phase_idx
-                        )
-                        db.session.add(new_phase)
-            except Exception as e:
+                apply_project_structure(
+                    project.id,
+                    json.loads(request.form.get('group_data')),
+                    request.form.get('structure_version', type=int)
+                )
+            except StructureConflictError:
+                db.session.rollback()
+                flash('The project structure was changed by someone else. Please review it and try again.', 'warning')
+                return redirect(url_for('projects.edit_project', project_id=project_id))
+            except (StructureValidationError, ValueError) as e:
                 db.session.rollback()
                 flash(f'Error processing project structure: {str(e)}', 'danger')
                 return redirect(url_for('projects.edit_project', project_id=project_id))
@@ -454,6 +503,7 @@ def edit_project(project_id):
     return render_template(
         'projects/edit.html', 
         project=project,
+        tree=tree,
         clients=clients, 
         managers=managers,
         product_groups=product_groups,
@@ -480,20 +530,53 @@ def delete_project(project_id):
 @login_required
 def view_project(project_id):
     """Display project details."""
-    project = Project.query.get_or_404(project_id)
+    project, tree = load_project_tree(project_id, with_products=True)
+    if project is None:
+        abort(404)
     
     # Check if user has permission to view this project
-    if not user_has_role(current_user, 'Admin') and not user_has_role(current_user, 'Manager') and project.manager_id != current_user.id:
-        # TODO: Check if consultant is assigned to this project
-        if user_has_role(current_user, 'Consultant'):
-            flash('You do not have permission to view this project.', 'danger')
-            return redirect(url_for('projects.list_projects'))
-    
-    # Get phase durations for reference
-    phase_durations_list = List.query.filter_by(name='PhaseDuration').first()
-    phase_durations = {item.id: item.value for item in phase_durations_list.items} if phase_durations_list else {}
+    if not can_view_project(current_user, project):
+        flash('You do not have permission to view this project.', 'danger')
+        return redirect(url_for('projects.list_projects'))
     
-    return render_template('projects/view.html', project=project, phase_durations=phase_durations)
+    schedule = get_project_schedule(project.id)
+    return render_template('projects/view.html', project=project, tree=tree, schedule=schedule)
+
+@projects_bp.route('/api/<int:project_id>/tree')
+@login_required
+def project_tree(project_id):
+    """
+    Get a project's groups and phases in JSON format.
+    """
+    project, tree = load_project_tree(project_id)
+    if project is None:
+        abort(404)
+    if not can_view_project(current_user, project):
+        return jsonify({'success': False, 'message': 'You do not have permission to view this project.'}), 403
+    return jsonify({'success': True, 'project': tree.to_dict()})
+
+@projects_bp.route('/api/<int:project_id>/schedule')
+@login_required
+def project_schedule(project_id):
+    """
+    Get a project's phase dates and critical path length in JSON format.
+    """
+    project = Project.query.get_or_404(project_id)
+    if not can_view_project(current_user, project):
+        return jsonify({'success': False, 'message': 'You do not have permission to view this project.'}), 403
+    return jsonify({'success': True, 'schedule': get_project_schedule(project.id).to_dict()})
+
+@projects_bp.route('/api/schedules')
+@login_required
+def project_schedules():
+    """
+    Get the schedules of all active projects for portfolio timelines in JSON format.
+    Optional status parameters restrict the projects to those statuses.
+    """
+    if not user_has_any_role(current_user, ['Admin', 'Manager', 'Project Manager']):
+        return jsonify({'success': False, 'message': 'You do not have permission to view the portfolio.'}), 403
+    schedules = schedule_projects(request.args.getlist('status') or None)
+    return jsonify({'success': True, 'projects': [schedule.to_dict() for schedule in schedules]})
 
 # Project Template Routes
 
@@ -677,58 +760,186 @@ def view_template(template_id):
     return render_template('projects/templates/view.html', template=template)
 
 # TODO: Add routes for project tasks
-# TODO: Add routes for consultant assignment to projects
+@projects_bp.route('/api/<int:project_id>/structure', methods=['POST'])
+@login_required
+def update_project_structure(project_id):
+    """
+    Save a project's groups and phases.
+    Expects {"structure_version": <version the editor loaded>, "groups": [...]}
+    with the ids of existing groups and phases; only the differences are
+    written. Returns the new tree, or 409 if the structure changed meanwhile.
+    """
+    project = Project.query.get_or_404(project_id)
+    if not (user_has_any_role(current_user, ['Admin', 'Manager']) or project.manager_id == current_user.id):
+        return jsonify({'success': False, 'message': 'You do not have permission to edit this project.'}), 403
+    
+    data = request.get_json(silent=True) or {}
+    try:
+        changes = apply_project_structure(project.id, data.get('groups'), data.get('structure_version'))
+        db.session.commit()
+    except StructureValidationError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': 'Invalid project structure', 'errors': e.errors}), 400
+    except StructureConflictError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e), 'structure_version': e.current_version}), 409
+    
+    _, tree = load_project_tree(project_id)
+    return jsonify({'success': True, 'changes': changes, 'project': tree.to_dict()})
+
+@projects_bp.route('/api/create', methods=['POST'])
+@login_required
+def create_projects_api():
+    """
+    Create projects with their structure in one transaction.
+    Expects {"projects": [{"project": {...}, "groups": [...], "product_ids": [...]}]};
+    dates are given as YYYY-MM-DD. Returns the ids of the new projects in order.
+    """
+    if not (user_has_any_role(current_user, ['Admin', 'Manager', 'Project Manager']) or current_user.username == 'admin'):
+        return jsonify({'success': False, 'message': 'You do not have permission to create projects.'}), 403
+
+    data = request.get_json(silent=True) or {}
+    specs = data.get('projects')
+    if not isinstance(specs, list) or not specs:
+        return jsonify({'success': False, 'message': 'Expected a non-empty list of projects'}), 400
+    try:
+        project_ids = instantiate_projects(specs)
+        db.session.commit()
+    except StructureValidationError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': 'Invalid projects', 'errors': e.errors}), 400
+    except IntegrityError as e:
+        # References removed by a concurrent transaction since they were checked
+        db.session.rollback()
+        return jsonify({'success': False, 'message': 'Invalid projects', 'errors': [str(e.orig)]}), 400
+
+    return jsonify({'success': True, 'project_ids': project_ids}), 201
+
+@projects_bp.route('/api/<int:project_id>/assignments', methods=['GET', 'POST'])
+@login_required
+def project_assignments(project_id):
+    """
+    List a project's consultant assignments, or assign a consultant to one
+    of its phases.
+    
+    GET: Returns the assignments in JSON format
+    POST: Expects {"consultant_id", "phase_id", "planned_days", "start_date",
+    "end_date", "notes"}; the dates default to the project's dates
+    """
+    project = Project.query.get_or_404(project_id)
+    
+    if request.method == 'GET':
+        if not can_view_project(current_user, project):
+            return jsonify({'success': False, 'message': 'You do not have permission to view this project.'}), 403
+        assignments = get_project_assignments(project.id)
+        return jsonify({'success': True, 'assignments': [serialize_assignment(a) for a in assignments]})
+    
+    if not user_has_any_role(current_user, ['Admin', 'Manager', 'Project Manager']):
+        return jsonify({'success': False, 'message': 'You do not have permission to assign consultants.'}), 403
+    
+    try:
+        values = validate_assignment(request.get_json(silent=True), project)
+    except AssignmentValidationError as e:
+        return jsonify({'success': False, 'message': 'Invalid assignment', 'errors': e.errors}), 400
+    
+    assignment = ConsultantAssignment(**values)
+    db.session.add(assignment)
+    db.session.commit()
+    return jsonify({'success': True, 'assignment': serialize_assignment(assignment)}), 201
+
+def _get_project_assignment(project_id, assignment_id):
+    """Get an assignment of a project or abort with 404."""
+    assignment = ConsultantAssignment.query.get_or_404(assignment_id)
+    if assignment.phase.group.project_id != project_id:
+        abort(404)
+    return assignment
+
+@projects_bp.route('/api/<int:project_id>/assignments/<int:assignment_id>', methods=['POST'])
+@login_required
+def update_project_assignment(project_id, assignment_id):
+    """
+    Update a consultant assignment.
+    Expects any of the fields accepted when creating it.
+    """
+    if not user_has_any_role(current_user, ['Admin', 'Manager', 'Project Manager']):
+        return jsonify({'success': False, 'message': 'You do not have permission to assign consultants.'}), 403
+    
+    project = Project.query.get_or_404(project_id)
+    assignment = _get_project_assignment(project.id, assignment_id)
+    try:
+        values = validate_assignment(request.get_json(silent=True), project, assignment)
+    except AssignmentValidationError as e:
+        return jsonify({'success': False, 'message': 'Invalid assignment', 'errors': e.errors}), 400
+    
+    for key, value in values.items():
+        setattr(assignment, key, value)
+    db.session.commit()
+    return jsonify({'success': True, 'assignment': serialize_assignment(assignment)})
+
+@projects_bp.route('/api/<int:project_id>/assignments/<int:assignment_id>/delete', methods=['POST'])
+@login_required
+def delete_project_assignment(project_id, assignment_id):
+    """Remove a consultant assignment."""
+    if not user_has_any_role(current_user, ['Admin', 'Manager', 'Project Manager']):
+        return jsonify({'success': False, 'message': 'You do not have permission to assign consultants.'}), 403
+    
+    assignment = _get_project_assignment(project_id, assignment_id)
+    db.session.delete(assignment)
+    db.session.commit()
+    return jsonify({'success': True})
+
 # TODO: Add routes for project phases
 
 @projects_bp.route('/api/product-groups/<int:group_id>/elements')
 @login_required
 def get_product_group_elements(group_id):
     """
-    API endpoint to get product elements for a product group.
+    API endpoint to get product elements for a product group, from the
+    catalog snapshot (see /catalog/api/snapshot for the whole catalog).
     Returns a JSON object with:
     - elements: Array of elements with label, activity, and other properties
     - group: Information about the product group
     - count: Total number of elements
     """
-    try:
-        # Get product group
-        product_group = ProductGroup.query.get_or_404(group_id)
-        
-        # Get elements
-        elements = product_group.elements
-        
-        # Format elements for JSON response
-        elements_data = [
-            {
-                'id': element.id,
-                'label': element.label,
-                'activity': element.activity,
-                'group_duration_id': product_group.duration_id
-            }
-            for element in elements
-        ]
-        
-        # Include group information
-        response_data = {
-            'elements': elements_data,
-            'group': {
-                'id': product_group.id,
-                'name': product_group.name,
-                'description': product_group.description,
-                'duration_id': product_group.duration_id
-            },
-            'count': len(elements_data),
-            'success': True
-        }
-        
-        return jsonify(response_data)
-    except Exception as e:
-        # Return error response
-        return jsonify({
-            'success': False,
-            'error': str(e),
-            'message': 'Failed to retrieve product group elements'
-        }), 500
+    group = get_catalog_group(group_id)
+    if group is None:
+        abort(404)
+    
+    elements_data = [
+        dict(element, group_duration_id=group['duration_id'])
+        for element in group['elements']
+    ]
+    return jsonify({
+        'elements': elements_data,
+        'group': {
+            'id': group['id'],
+            'name': group['name'],
+            'description': group['description'],
+            'duration_id': group['duration_id']
+        },
+        'count': len(elements_data),
+        'success': True
+    })
+
+@projects_bp.route('/api/<int:project_id>/staffing')
+@login_required
+def project_staffing(project_id):
+    """
+    Recommend consultants for a project's product groups in JSON format.
+    Groups are weighted by their number of phases.
+    """
+    project = Project.query.get_or_404(project_id)
+    criteria = get_project_criteria(project.id)
+    if not criteria:
+        return jsonify({'success': True, 'recommendations': []})
+    
+    recommendations = get_staffing_index().recommend(
+        criteria,
+        min_rating=min(max(request.args.get('min_rating', 1, type=int), 1), 5),
+        limit=min(max(request.args.get('limit', 10, type=int), 1), 100),
+        require_all=request.args.get('require_all') in ('1', 'true')
+    )
+    return jsonify({'success': True, 'recommendations': describe_recommendations(recommendations)})
 
 @projects_bp.route('/debug-create')
 @login_required
@@ -742,35 +953,19 @@ def debug_create():
     product_groups = ProductGroup.query.all()
     
     # Get lists for dropdowns
-    industries_list = List.query.filter_by(id=5).first()
-    industries = industries_list.items if industries_list else []
-    print(f"DEBUG - Industries List: {industries_list}")
-    print(f"DEBUG - Industries Count: {len(industries)}")
+    industries_list = get_list_by_id(5)
+    industries = get_list_items_by_id(5)
     
     # Get Profit Centers from list id=2
-    profit_centers_list = List.query.filter_by(id=2).first()
-    profit_centers = profit_centers_list.items if profit_centers_list else []
-    print(f"DEBUG - Profit Centers List: {profit_centers_list}")
-    print(f"DEBUG - Profit Centers Count: {len(profit_centers)}")
+    profit_centers_list = get_list_by_id(2)
+    profit_centers = get_list_items_by_id(2)
     
-    phase_durations_list = List.query.filter_by(name='PhaseDuration').first()
-    phase_durations = phase_durations_list.items if phase_durations_list else []
-    print(f"DEBUG - Phase Durations List: {phase_durations_list}")
-    print(f"DEBUG - Phase Durations Count: {len(phase_durations)}")
+    phase_durations_list = get_list('PhaseDuration')
+    phase_durations = get_list_items('PhaseDuration')
     
     # Get project statuses for dropdown from ProjectStatusList
-    project_statuses_list = List.query.filter_by(name='ProjectStatusList').first()
-    print(f"DEBUG - Project Statuses List: {project_statuses_list}")
-    
-    # Try both ways to get items
-    project_statuses_1 = project_statuses_list.items if project_statuses_list else []
-    print(f"DEBUG - Project Statuses Count (using .items): {len(project_statuses_1)}")
-    
-    project_statuses_2 = ListItem.query.filter_by(list_id=project_statuses_list.id).all() if project_statuses_list else []
-    print(f"DEBUG - Project Statuses Count (using direct query): {len(project_statuses_2)}")
-    
-    # Use the direct query method
-    project_statuses = project_statuses_2
+    project_statuses_list = get_list('ProjectStatusList')
+    project_statuses = get_project_statuses()
     
     # Debug output
     debug_info = {
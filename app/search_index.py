@@ -0,0 +1,303 @@
+"""
+Full-text search over projects, phases and clients.
+
+Project names and descriptions, phase names and descriptions and client
+names are indexed in one search_index table: an FTS5 virtual table on
+SQLite and a table with a weighted tsvector column and a GIN index on
+PostgreSQL. Database triggers keep it in sync, so rows written through the
+ORM, bulk statements and other clients are all indexed in the same
+transaction. ensure_search_index() creates the table and triggers and fills
+the table; until it has run, searches fall back to ILIKE on names. Workers
+notice that it ran through a shared version, without a restart.
+
+Every query word is matched as a prefix ("lead sal" finds "Leadership" in a
+"Sales Academy" phase) and results are ranked (bm25 on SQLite, ts_rank_cd on
+PostgreSQL) with matches highlighted. Each row's id encodes its kind and the
+id of the indexed row (id * 4 + kind), so triggers update rows by key.
+"""
+import re
+import threading
+from collections import namedtuple
+from markupsafe import Markup, escape
+from sqlalchemy import text, select
+from .models import db, Client, Project, ProjectGroup, ProjectPhase
+from .utils import get_cache_version, bump_cache_version
+
+KINDS = {1: 'project', 2: 'phase', 3: 'client'}
+KIND_CODES = {kind: code for code, kind in KINDS.items()}
+
+DEFAULT_SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+# Maximum number of query words
+MAX_QUERY_TERMS = 8
+
+# Highlight markers, replaced by <mark> after escaping
+_START, _STOP = '\ue000', '\ue001'
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+SearchHit = namedtuple('SearchHit', ['kind', 'id', 'project_id', 'rank', 'title', 'snippet'])
+
+_SQLITE_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5("
+    "project_id UNINDEXED, title, body, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')",
+
+    "CREATE TRIGGER IF NOT EXISTS search_index_projects_insert AFTER INSERT ON projects BEGIN "
+    "INSERT INTO search_index (rowid, project_id, title, body) "
+    "VALUES (NEW.id * 4 + 1, NEW.id, NEW.name, COALESCE(NEW.description, '')); END",
+    "CREATE TRIGGER IF NOT EXISTS search_index_projects_update AFTER UPDATE OF name, description ON projects BEGIN "
+    "UPDATE search_index SET title = NEW.name, body = COALESCE(NEW.description, '') "
+    "WHERE rowid = NEW.id * 4 + 1; END",
+    "CREATE TRIGGER IF NOT EXISTS search_index_projects_delete AFTER DELETE ON projects BEGIN "
+    "DELETE FROM search_index WHERE rowid = OLD.id * 4 + 1; END",
+
+    "CREATE TRIGGER IF NOT EXISTS search_index_phases_insert AFTER INSERT ON project_phases BEGIN "
+    "INSERT INTO search_index (rowid, project_id, title, body) "
+    "VALUES (NEW.id * 4 + 2, (SELECT project_id FROM project_groups WHERE id = NEW.group_id), "
+    "NEW.name, COALESCE(NEW.description, '')); END",
+    "CREATE TRIGGER IF NOT EXISTS search_index_phases_update AFTER UPDATE OF name, description, group_id "
+    "ON project_phases BEGIN "
+    "UPDATE search_index SET project_id = (SELECT project_id FROM project_groups WHERE id = NEW.group_id), "
+    "title = NEW.name, body = COALESCE(NEW.description, '') WHERE rowid = NEW.id * 4 + 2; END",
+    "CREATE TRIGGER IF NOT EXISTS search_index_phases_delete AFTER DELETE ON project_phases BEGIN "
+    "DELETE FROM search_index WHERE rowid = OLD.id * 4 + 2; END",
+
+    "CREATE TRIGGER IF NOT EXISTS search_index_clients_insert AFTER INSERT ON clients BEGIN "
+    "INSERT INTO search_index (rowid, project_id, title, body) VALUES (NEW.id * 4 + 3, NULL, NEW.name, ''); END",
+    "CREATE TRIGGER IF NOT EXISTS search_index_clients_update AFTER UPDATE OF name ON clients BEGIN "
+    "UPDATE search_index SET title = NEW.name WHERE rowid = NEW.id * 4 + 3; END",
+    "CREATE TRIGGER IF NOT EXISTS search_index_clients_delete AFTER DELETE ON clients BEGIN "
+    "DELETE FROM search_index WHERE rowid = OLD.id * 4 + 3; END",
+)
+
+_POSTGRES_DDL = (
+    "CREATE TABLE IF NOT EXISTS search_index ("
+    "id BIGINT PRIMARY KEY, project_id INTEGER, title TEXT NOT NULL, body TEXT NOT NULL DEFAULT '', "
+    "document TSVECTOR GENERATED ALWAYS AS ("
+    "setweight(to_tsvector('simple', title), 'A') || setweight(to_tsvector('simple', body), 'B')) STORED)",
+    "CREATE INDEX IF NOT EXISTS ix_search_index_document ON search_index USING GIN (document)",
+    "CREATE INDEX IF NOT EXISTS ix_search_index_project_id ON search_index (project_id)",
+
+    """
+    CREATE OR REPLACE FUNCTION search_index_sync() RETURNS trigger AS $$
+    DECLARE
+        code INTEGER := TG_ARGV[0]::INTEGER;
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            DELETE FROM search_index WHERE id = OLD.id::BIGINT * 4 + code;
+            RETURN OLD;
+        END IF;
+        IF TG_TABLE_NAME = 'projects' THEN
+            INSERT INTO search_index (id, project_id, title, body)
+            VALUES (NEW.id::BIGINT * 4 + code, NEW.id, NEW.name, COALESCE(NEW.description, ''))
+            ON CONFLICT (id) DO UPDATE SET title = EXCLUDED.title, body = EXCLUDED.body;
+        ELSIF TG_TABLE_NAME = 'project_phases' THEN
+            INSERT INTO search_index (id, project_id, title, body)
+            VALUES (NEW.id::BIGINT * 4 + code, (SELECT project_id FROM project_groups WHERE id = NEW.group_id),
+                    NEW.name, COALESCE(NEW.description, ''))
+            ON CONFLICT (id) DO UPDATE SET project_id = EXCLUDED.project_id, title = EXCLUDED.title, body = EXCLUDED.body;
+        ELSE
+            INSERT INTO search_index (id, project_id, title, body)
+            VALUES (NEW.id::BIGINT * 4 + code, NULL, NEW.name, '')
+            ON CONFLICT (id) DO UPDATE SET title = EXCLUDED.title;
+        END IF;
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS search_index_projects ON projects",
+    "CREATE TRIGGER search_index_projects AFTER INSERT OR DELETE OR UPDATE OF name, description ON projects "
+    "FOR EACH ROW EXECUTE FUNCTION search_index_sync(1)",
+    "DROP TRIGGER IF EXISTS search_index_phases ON project_phases",
+    "CREATE TRIGGER search_index_phases AFTER INSERT OR DELETE OR UPDATE OF name, description, group_id "
+    "ON project_phases FOR EACH ROW EXECUTE FUNCTION search_index_sync(2)",
+    "DROP TRIGGER IF EXISTS search_index_clients ON clients",
+    "CREATE TRIGGER search_index_clients AFTER INSERT OR DELETE OR UPDATE OF name ON clients "
+    "FOR EACH ROW EXECUTE FUNCTION search_index_sync(3)",
+)
+
+_id_column = {'sqlite': 'rowid', 'postgresql': 'id'}
+
+_lock = threading.Lock()
+# (version, whether the index exists) per database URL
+_available = {}
+
+def _dialect():
+    """The name of the database dialect."""
+    return db.engine.dialect.name
+
+def search_index_available():
+    """Check whether the search index was created in this database."""
+    key = str(db.engine.url)
+    version = get_cache_version('search_index')
+    with _lock:
+        cached = _available.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    available = _dialect() in _id_column and db.inspect(db.engine).has_table('search_index')
+    with _lock:
+        _available[key] = (version, available)
+    return available
+
+def rebuild_search_index():
+    """
+    Refill the search index from the indexed tables. The caller commits.
+    """
+    id_column = _id_column[_dialect()]
+    db.session.execute(text('DELETE FROM search_index'))
+    db.session.execute(text(
+        f"INSERT INTO search_index ({id_column}, project_id, title, body) "
+        "SELECT CAST(id AS BIGINT) * 4 + 1, id, name, COALESCE(description, '') FROM projects"
+    ))
+    db.session.execute(text(
+        f"INSERT INTO search_index ({id_column}, project_id, title, body) "
+        "SELECT CAST(p.id AS BIGINT) * 4 + 2, g.project_id, p.name, COALESCE(p.description, '') "
+        "FROM project_phases p JOIN project_groups g ON g.id = p.group_id"
+    ))
+    db.session.execute(text(
+        f"INSERT INTO search_index ({id_column}, project_id, title, body) "
+        "SELECT CAST(id AS BIGINT) * 4 + 3, NULL, name, '' FROM clients"
+    ))
+
+def ensure_search_index():
+    """
+    Create the search index and its triggers if needed and fill it.
+
+    Raises:
+        RuntimeError: If the database is neither SQLite nor PostgreSQL
+    """
+    dialect = _dialect()
+    if dialect == 'sqlite':
+        statements = _SQLITE_DDL
+    elif dialect == 'postgresql':
+        statements = _POSTGRES_DDL
+    else:
+        raise RuntimeError(f'Full-text search is not supported on {dialect}')
+    for statement in statements:
+        db.session.execute(text(statement))
+    rebuild_search_index()
+    db.session.commit()
+    # Workers that found no index check again
+    version = bump_cache_version('search_index')
+    with _lock:
+        _available[str(db.engine.url)] = (version, True)
+
+def query_terms(query):
+    """Split a search query into lowercase words, at most MAX_QUERY_TERMS."""
+    return [word.lower() for word in _WORD_RE.findall(query or '')][:MAX_QUERY_TERMS]
+
+def _match_expression(terms):
+    """Compile words into a prefix query for the current dialect."""
+    if _dialect() == 'sqlite':
+        return ' '.join(f'"{term}"*' for term in terms)
+    return ' & '.join(f'{term}:*' for term in terms)
+
+def _highlight(value):
+    """Escape a highlighted value and turn the markers into <mark> tags."""
+    return Markup(str(escape(value or '')).replace(_START, '<mark>').replace(_STOP, '</mark>'))
+
+def project_search_filter(query):
+    """
+    Build a filter for projects matching a search query: by name,
+    description, phase or client name once the index exists, else by name.
+
+    Args:
+        query: The search text
+
+    Returns:
+        A filter clause for Project queries, or None for an empty query
+    """
+    terms = query_terms(query)
+    if not terms:
+        return Project.name.ilike(f'%{query.strip()}%') if query and query.strip() else None
+    if not search_index_available():
+        return Project.name.ilike(f'%{query.strip()}%')
+    if _dialect() == 'sqlite':
+        clause = (
+            "(projects.id IN (SELECT project_id FROM search_index WHERE search_index MATCH :fts_query) "
+            "OR projects.client_id IN (SELECT rowid / 4 FROM search_index "
+            "WHERE search_index MATCH :fts_query AND rowid % 4 = 3))"
+        )
+    else:
+        clause = (
+            "(projects.id IN (SELECT project_id FROM search_index "
+            "WHERE document @@ to_tsquery('simple', :fts_query)) "
+            "OR projects.client_id IN (SELECT id / 4 FROM search_index "
+            "WHERE document @@ to_tsquery('simple', :fts_query) AND id % 4 = 3))"
+        )
+    return text(clause).bindparams(fts_query=_match_expression(terms))
+
+def _search_index(terms, kinds, limit):
+    """Run a ranked query against the index."""
+    codes = ', '.join(str(KIND_CODES[kind]) for kind in kinds)
+    if _dialect() == 'sqlite':
+        sql = (
+            "SELECT rowid, project_id, bm25(search_index, 0.0, 10.0, 1.0) AS rank, "
+            "highlight(search_index, 1, :start, :stop), snippet(search_index, 2, :start, :stop, '…', 12) "
+            f"FROM search_index WHERE search_index MATCH :fts_query AND rowid % 4 IN ({codes}) "
+            "ORDER BY rank LIMIT :limit"
+        )
+    else:
+        options = f'StartSel={_START}, StopSel={_STOP}, MaxWords=20, MinWords=6, HighlightAll=false'
+        sql = (
+            "SELECT id, project_id, -ts_rank_cd(document, query) AS rank, "
+            "ts_headline('simple', title, query, :options), "
+            "CASE WHEN body = '' THEN '' ELSE ts_headline('simple', body, query, :options) END "
+            "FROM search_index, to_tsquery('simple', :fts_query) AS query "
+            f"WHERE document @@ query AND id % 4 IN ({codes}) "
+            "ORDER BY rank LIMIT :limit"
+        )
+    params = {'fts_query': _match_expression(terms), 'start': _START, 'stop': _STOP, 'limit': limit}
+    if _dialect() != 'sqlite':
+        params['options'] = options
+    return [
+        SearchHit(KINDS[row_id % 4], row_id // 4, project_id, -rank, _highlight(title), _highlight(snippet))
+        for row_id, project_id, rank, title, snippet in db.session.execute(text(sql), params)
+    ]
+
+def _search_names(terms, kinds, limit):
+    """Match names with ILIKE while the index does not exist."""
+    pattern = re.compile('(' + '|'.join(re.escape(term) for term in terms) + ')', re.IGNORECASE)
+
+    def mark(value):
+        return _highlight(pattern.sub(lambda match: _START + match.group(1) + _STOP, value or ''))
+
+    def matches(column):
+        return [column.ilike(f'%{term}%') for term in terms]
+
+    hits = []
+    if 'project' in kinds:
+        rows = db.session.execute(select(Project.id, Project.name).where(*matches(Project.name)).limit(limit))
+        hits.extend(SearchHit('project', row_id, row_id, 0, mark(name), Markup('')) for row_id, name in rows)
+    if 'phase' in kinds:
+        rows = db.session.execute(
+            select(ProjectPhase.id, ProjectGroup.project_id, ProjectPhase.name)
+            .join(ProjectGroup, ProjectGroup.id == ProjectPhase.group_id)
+            .where(*matches(ProjectPhase.name)).limit(limit)
+        )
+        hits.extend(SearchHit('phase', row_id, project_id, 0, mark(name), Markup('')) for row_id, project_id, name in rows)
+    if 'client' in kinds:
+        rows = db.session.execute(select(Client.id, Client.name).where(*matches(Client.name)).limit(limit))
+        hits.extend(SearchHit('client', row_id, None, 0, mark(name), Markup('')) for row_id, name in rows)
+    return hits[:limit]
+
+def search(query, kinds=None, limit=DEFAULT_SEARCH_LIMIT):
+    """
+    Search projects, phases and clients.
+
+    Args:
+        query: The search text; every word is matched as a prefix
+        kinds: The kinds of results to include ('project', 'phase',
+            'client'), all by default
+        limit: Maximum number of results
+
+    Returns:
+        list: SearchHit per result, best first, with highlighted title and
+        snippet as Markup
+    """
+    terms = query_terms(query)
+    kinds = [kind for kind in (kinds or KINDS.values()) if kind in KIND_CODES]
+    if not terms or not kinds:
+        return []
+    if search_index_available():
+        return _search_index(terms, kinds, limit)
+    return _search_names(terms, kinds, limit)
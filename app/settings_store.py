@@ -0,0 +1,96 @@
+"""
+Settings store for the JSON settings file (app/static/settings.json).
+
+The file is parsed once and served from memory. Every read checks the file's
+stat signature, so edits made by another gunicorn worker are picked up on
+the next read. Writes go to a temporary file that atomically replaces the
+settings file, so readers never see a truncated file.
+"""
+import copy
+import json
+import os
+import tempfile
+import threading
+from flask import current_app
+
+SETTINGS_FILE = os.path.join(os.path.dirname(__file__), 'static', 'settings.json')
+
+_lock = threading.Lock()
+# Parsed settings and the stat signature of the file they were parsed from
+_settings = {}
+_signature = None
+
+def _file_signature():
+    """Get the stat signature of the settings file, or None if it does not exist."""
+    try:
+        stat = os.stat(SETTINGS_FILE)
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        return None
+
+def _refresh():
+    """Re-parse the settings file if it changed since it was last read."""
+    global _settings, _signature
+    signature = _file_signature()
+    if signature == _signature:
+        return
+
+    if signature is None:
+        _settings, _signature = {}, None
+        return
+
+    try:
+        with open(SETTINGS_FILE, 'r') as f:
+            _settings = json.load(f)
+        _signature = signature
+    except Exception as e:
+        current_app.logger.error(f"Error loading settings: {e}")
+        _settings, _signature = {}, None
+
+def load_settings():
+    """
+    Load settings from the in-memory store.
+
+    Returns:
+        dict: A copy of the settings that the caller may modify
+    """
+    with _lock:
+        _refresh()
+        return copy.deepcopy(_settings)
+
+def save_settings(settings):
+    """
+    Save settings atomically and update the in-memory store.
+
+    Args:
+        settings (dict): The complete settings to save
+
+    Returns:
+        bool: True if the settings were saved, False otherwise
+    """
+    global _settings, _signature
+    settings_dir = os.path.dirname(SETTINGS_FILE)
+    with _lock:
+        tmp_path = None
+        try:
+            os.makedirs(settings_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=settings_dir, prefix='.settings.', suffix='.json')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(settings, f, indent=4)
+                f.flush()
+                os.fsync(f.fileno())
+            # mkstemp creates the file as 0600; keep the settings file readable
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, SETTINGS_FILE)
+            tmp_path = None
+
+            _settings = copy.deepcopy(settings)
+            _signature = _file_signature()
+            current_app.logger.info("Settings saved successfully")
+            return True
+        except Exception as e:
+            current_app.logger.error(f"Error saving settings: {e}")
+            return False
+        finally:
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
@@ -0,0 +1,349 @@
+"""
+Staffing recommendations.
+
+An in-process inverted index maps every product group and element to the
+consultants rated on it, best rating first. Each posting list is a pair of
+compact arrays (consultant ids, ratings), so the whole expertise table costs
+a few bytes per rating and a "top K consultants for groups A, B and C"
+query only reads the posting lists of A, B and C, stopping at the first
+rating below the requested minimum.
+
+The index is built from three queries (ratings, statuses and the element
+to group map). Commits that change a consultant's
+expertise or status patch only that consultant's postings in the worker
+that made the change; other gunicorn workers see the shared version change
+and rebuild on their next query.
+"""
+import heapq
+import threading
+from array import array
+from collections import namedtuple
+from sqlalchemy import func, select
+from .models import db, Consultant, ConsultantExpertise, ProductElement, ProductGroup, ProjectGroup, ProjectPhase, User
+from .utils import get_cache_version, bump_cache_version, swap_cache_version, track_cache_invalidation
+
+Recommendation = namedtuple('Recommendation', ['consultant_id', 'score', 'coverage', 'ratings'])
+
+class StaffingIndex:
+    """
+    Inverted index from catalog items to rated consultants.
+
+    Items are keyed as ('product_group', id) or ('product_element', id).
+    """
+
+    def __init__(self, ratings, statuses, element_groups):
+        """
+        Args:
+            ratings: (consultant_id, item_type, item_id, rating) tuples
+            statuses: Mapping of consultant id to status
+            element_groups: Mapping of product element id to its group id
+        """
+        self.statuses = dict(statuses)
+        self.group_elements = {}
+        for element_id, group_id in element_groups.items():
+            self.group_elements.setdefault(group_id, []).append(element_id)
+
+        self._postings = {}
+        self._consultant_items = {}
+        pairs_by_item = {}
+        for consultant_id, item_type, item_id, rating in ratings:
+            pairs_by_item.setdefault((item_type, item_id), []).append((consultant_id, rating))
+            self._consultant_items.setdefault(consultant_id, set()).add((item_type, item_id))
+        for key, pairs in pairs_by_item.items():
+            self._postings[key] = self._pack(pairs)
+
+    @staticmethod
+    def _pack(pairs):
+        """Pack (consultant_id, rating) pairs into arrays sorted by rating, then id."""
+        pairs.sort(key=lambda pair: (-pair[1], pair[0]))
+        return array('i', [consultant_id for consultant_id, _ in pairs]), array('b', [rating for _, rating in pairs])
+
+    def _rated(self, key, min_rating):
+        """Yield (consultant_id, rating) for an item, best first, down to min_rating."""
+        postings = self._postings.get(key)
+        if postings is None:
+            return
+        for consultant_id, rating in zip(*postings):
+            if rating < min_rating:
+                break
+            yield consultant_id, rating
+
+    def best_ratings(self, item_type, item_id, min_rating=1):
+        """
+        Get each consultant's best rating for an item.
+        A product group is covered by a rating on the group itself or on any
+        of its elements.
+
+        Returns:
+            dict: Consultant id -> best rating of at least min_rating
+        """
+        keys = [(item_type, item_id)]
+        if item_type == 'product_group':
+            keys.extend(('product_element', element_id) for element_id in self.group_elements.get(item_id, ()))
+        best = {}
+        for key in keys:
+            for consultant_id, rating in self._rated(key, min_rating):
+                if rating > best.get(consultant_id, 0):
+                    best[consultant_id] = rating
+        return best
+
+    def recommend(self, criteria, min_rating=1, statuses=('Active',), limit=10, require_all=False):
+        """
+        Rank consultants against weighted catalog items.
+
+        Consultants are ranked by the number of items they cover, then by
+        the weighted sum of their ratings, then by id.
+
+        Args:
+            criteria: Mapping of (item_type, item_id) to weight
+            min_rating: Minimum rating for an item to count as covered
+            statuses: Consultant statuses to include, or None for any
+            limit: Maximum number of recommendations
+            require_all: Only include consultants covering every item
+
+        Returns:
+            list: Recommendation tuples, best first
+        """
+        scores = {}
+        for (item_type, item_id), weight in criteria.items():
+            for consultant_id, rating in self.best_ratings(item_type, item_id, min_rating).items():
+                if statuses is not None and self.statuses.get(consultant_id) not in statuses:
+                    continue
+                entry = scores.get(consultant_id)
+                if entry is None:
+                    entry = scores[consultant_id] = [0, 0, {}]
+                entry[0] += weight * rating
+                entry[1] += 1
+                entry[2][(item_type, item_id)] = rating
+
+        candidates = scores.items()
+        if require_all:
+            candidates = [(consultant_id, entry) for consultant_id, entry in candidates if entry[1] == len(criteria)]
+        top = heapq.nlargest(limit, candidates, key=lambda item: (item[1][1], item[1][0], -item[0]))
+        return [Recommendation(consultant_id, score, coverage, ratings) for consultant_id, (score, coverage, ratings) in top]
+
+    def update_consultants(self, consultant_ids, ratings, statuses):
+        """
+        Replace the postings and statuses of some consultants.
+
+        Args:
+            consultant_ids: Ids of the consultants to replace
+            ratings: Their current (consultant_id, item_type, item_id, rating) tuples
+            statuses: Their current statuses; missing ids are dropped
+        """
+        consultant_ids = set(consultant_ids)
+        affected = set()
+        for consultant_id in consultant_ids:
+            affected |= self._consultant_items.pop(consultant_id, set())
+            self.statuses.pop(consultant_id, None)
+
+        added = {}
+        for consultant_id, item_type, item_id, rating in ratings:
+            added.setdefault((item_type, item_id), []).append((consultant_id, rating))
+            self._consultant_items.setdefault(consultant_id, set()).add((item_type, item_id))
+        affected |= added.keys()
+
+        for key in affected:
+            postings = self._postings.get(key)
+            pairs = [pair for pair in zip(*postings) if pair[0] not in consultant_ids] if postings else []
+            pairs.extend(added.get(key, ()))
+            if pairs:
+                self._postings[key] = self._pack(pairs)
+            else:
+                self._postings.pop(key, None)
+        self.statuses.update(statuses)
+
+_lock = threading.Lock()
+_index = None
+_version = None
+# Consultants changed by commits in this worker, applied on the next query
+_pending_ids = set()
+
+def _load_ratings(consultant_ids=None):
+    """Load (consultant_id, item_type, item_id, rating) tuples."""
+    query = db.session.query(
+        ConsultantExpertise.consultant_id,
+        ConsultantExpertise.product_group_id,
+        ConsultantExpertise.product_element_id,
+        ConsultantExpertise.rating
+    )
+    if consultant_ids is not None:
+        query = query.filter(ConsultantExpertise.consultant_id.in_(consultant_ids))
+    for consultant_id, group_id, element_id, rating in query:
+        if group_id is not None:
+            yield consultant_id, 'product_group', group_id, rating
+        elif element_id is not None:
+            yield consultant_id, 'product_element', element_id, rating
+
+def _load_statuses(consultant_ids=None):
+    """Load a mapping of consultant id to status."""
+    query = db.session.query(Consultant.id, Consultant.status)
+    if consultant_ids is not None:
+        query = query.filter(Consultant.id.in_(consultant_ids))
+    return dict(query.all())
+
+def _build_index():
+    """Build the index from the expertise, consultant and element tables."""
+    element_groups = dict(db.session.query(ProductElement.id, ProductElement.group_id).all())
+    return StaffingIndex(list(_load_ratings()), _load_statuses(), element_groups)
+
+def get_staffing_index():
+    """
+    Get the staffing index, rebuilding or patching it as needed.
+
+    Returns:
+        StaffingIndex: The current index
+    """
+    global _index, _version
+    with _lock:
+        version = get_cache_version('staffing_index')
+        if _index is None or version != _version:
+            _index = _build_index()
+            _version = version
+            _pending_ids.clear()
+        elif _pending_ids:
+            consultant_ids = list(_pending_ids)
+            _index.update_consultants(consultant_ids, list(_load_ratings(consultant_ids)), _load_statuses(consultant_ids))
+            _pending_ids.clear()
+        return _index
+
+def invalidate_staffing_index():
+    """
+    Drop the staffing index in every worker.
+    Called automatically after commits that change the catalog structure or
+    bulk-change consultants outside the expertise batch API.
+    """
+    global _index
+    with _lock:
+        _index = None
+        _pending_ids.clear()
+    bump_cache_version('staffing_index')
+
+def _consultants_changed(consultant_ids):
+    """Patch the given consultants locally and make other workers rebuild."""
+    global _index, _version
+    with _lock:
+        # The bump returns the version it replaced, so another worker's
+        # bump in between shows up as a version we have not seen
+        previous, new_version = swap_cache_version('staffing_index')
+        if _index is not None and previous == _version and new_version is not None:
+            # Our index was up to date, so only these consultants need reloading
+            _pending_ids.update(consultant_ids)
+            _version = new_version
+        else:
+            _index = None
+            _pending_ids.clear()
+
+def parse_criteria(groups='', elements=''):
+    """
+    Parse staffing criteria from comma-separated 'id' or 'id:weight' values.
+
+    Args:
+        groups: Product group ids, e.g. '3,5:2'
+        elements: Product element ids, e.g. '12'
+
+    Returns:
+        dict: (item_type, item_id) -> weight, or None if a value is invalid
+    """
+    criteria = {}
+    for item_type, values in (('product_group', groups), ('product_element', elements)):
+        for value in filter(None, (part.strip() for part in (values or '').split(','))):
+            item_id, _, weight = value.partition(':')
+            try:
+                key = (item_type, int(item_id))
+                weight = float(weight) if weight else 1
+            except ValueError:
+                return None
+            if weight <= 0:
+                return None
+            criteria[key] = criteria.get(key, 0) + weight
+    return criteria
+
+def get_project_criteria(project_id):
+    """
+    Get staffing criteria for a project's product groups, weighted by the
+    number of phases planned for each group.
+
+    Args:
+        project_id: The id of the project
+
+    Returns:
+        dict: ('product_group', id) -> weight
+    """
+    rows = db.session.query(
+        ProjectGroup.product_group_id, func.count(ProjectPhase.id)
+    ).outerjoin(ProjectPhase, ProjectPhase.group_id == ProjectGroup.id).filter(
+        ProjectGroup.project_id == project_id
+    ).group_by(ProjectGroup.id, ProjectGroup.product_group_id).all()
+
+    criteria = {}
+    for group_id, phase_count in rows:
+        key = ('product_group', group_id)
+        criteria[key] = criteria.get(key, 0) + max(phase_count, 1)
+    return criteria
+
+def describe_recommendations(recommendations):
+    """
+    Serialize recommendations with consultant names for JSON responses.
+
+    Args:
+        recommendations: Recommendation tuples
+
+    Returns:
+        list: One dict per recommendation, in the same order
+    """
+    consultant_ids = [rec.consultant_id for rec in recommendations]
+    details = {}
+    if consultant_ids:
+        rows = db.session.execute(
+            select(Consultant.id, User.first_name, User.last_name, Consultant.status, Consultant.availability_days_per_month)
+            .join(User, User.id == Consultant.user_id)
+            .where(Consultant.id.in_(consultant_ids))
+        )
+        details = {row[0]: row[1:] for row in rows}
+
+    results = []
+    for rec in recommendations:
+        first_name, last_name, status, availability = details.get(rec.consultant_id, (None, None, None, None))
+        results.append({
+            'consultant_id': rec.consultant_id,
+            'name': f"{first_name or ''} {last_name or ''}".strip(),
+            'status': status,
+            'availability_days_per_month': availability,
+            'score': rec.score,
+            'coverage': rec.coverage,
+            'ratings': [
+                {'type': item_type, 'id': item_id, 'rating': rating}
+                for (item_type, item_id), rating in sorted(rec.ratings.items())
+            ]
+        })
+    return results
+
+def _staffing_row_changes(session, obj):
+    """Consultants whose expertise or status a flushed row changed, or True to rebuild."""
+    if isinstance(obj, ConsultantExpertise):
+        return {obj.consultant_id}
+    if isinstance(obj, Consultant):
+        if obj in session.new or obj in session.deleted or db.inspect(obj).attrs.status.history.has_changes():
+            return {obj.id}
+    elif obj in session.new or obj in session.deleted or db.inspect(obj).attrs.group_id.history.has_changes():
+        # A product element moved to another group
+        return True
+    return None
+
+def _staffing_keys_changed(consultant_ids):
+    """Patch the consultants changed by a commit."""
+    consultant_ids.discard(None)
+    if consultant_ids:
+        _consultants_changed(consultant_ids)
+
+# Bulk statements on the catalog structure or on consultants require a full
+# rebuild; the expertise batch API records the consultants it changes
+track_cache_invalidation(
+    'staffing_changes', invalidate_staffing_index,
+    models=(ConsultantExpertise, Consultant, ProductElement),
+    tables=(ProductElement.__tablename__, ProductGroup.__tablename__, Consultant.__tablename__),
+    predicate=_staffing_row_changes,
+    keyed_tables=(ConsultantExpertise.__tablename__,),
+    on_keys=_staffing_keys_changed,
+)
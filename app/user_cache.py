@@ -0,0 +1,67 @@
+"""
+Cached user loading for Flask-Login.
+
+Users are loaded once per process together with their roles and kept as
+detached snapshots. Each request merges the snapshot into the request
+session without touching the database.
+
+Every gunicorn worker keeps its own cache, so changes are signalled through
+a version file in the instance folder. The file is replaced after any commit
+that changes a user or a role, and a worker drops its cache as soon as it
+sees a new version. A deactivated user or a role change therefore takes
+effect on the next request in every worker.
+"""
+from sqlalchemy.orm import Session, selectinload
+from .models import db, User, Role
+from .utils import get_cache_version, bump_cache_version, track_cache_invalidation
+
+# Detached User snapshots keyed by user id
+_users = {}
+# Version of the version file the cached snapshots were loaded under
+_version = None
+
+def invalidate_user_cache():
+    """
+    Drop all cached users in every worker.
+    Called automatically after commits that change users or roles; call it
+    directly after changing users with raw SQL.
+    """
+    _users.clear()
+    bump_cache_version('user_cache')
+
+def _load_user_snapshot(user_id):
+    """Load a user and their roles in a private session and return it detached."""
+    with Session(db.engine) as session:
+        return session.get(User, user_id, options=[selectinload(User.roles)])
+
+def load_cached_user(user_id):
+    """
+    Load a user for Flask-Login.
+
+    Args:
+        user_id: The id of the user to load
+
+    Returns:
+        User: The user attached to the request session, or None if the user
+        does not exist or is deactivated
+    """
+    global _version
+    version = get_cache_version('user_cache')
+    if version != _version:
+        _users.clear()
+        _version = version
+
+    user = _users.get(user_id)
+    if user is None:
+        user = _load_user_snapshot(user_id)
+        if user is None:
+            return None
+        _users[user_id] = user
+
+    if not user.is_active:
+        return None
+
+    # Copy the snapshot into the request session without emitting any SQL
+    return db.session.merge(user, load=False)
+
+track_cache_invalidation('user_cache_stale', invalidate_user_cache, models=(User, Role))
@@ -0,0 +1,348 @@
+"""
+Consultant utilization.
+
+Builds a consultants x months matrix of planned demand (from consultant
+assignments) and capacity (from each consultant's monthly availability,
+prorated by their start and end dates) for workload and availability
+heatmaps.
+
+Each row is a pair of compact arrays of per-month values. Demand is loaded
+with a single query over the assignments that overlap the window, and each
+assignment is spread over the months it touches in proportion to their
+working days (Monday to Friday), so the cost grows with the number of
+assignments rather than with consultants x days.
+
+Matrices are cached per window. Commits that change assignments or a
+consultant's availability recompute only the affected rows in the worker
+that made the change; other gunicorn workers see the shared version change
+and rebuild on their next request.
+"""
+import bisect
+import threading
+from array import array
+from datetime import date, timedelta
+from sqlalchemy import select
+from .models import db, Consultant, ConsultantAssignment, User
+from .utils import get_cache_version, bump_cache_version, swap_cache_version, track_cache_invalidation
+
+DEFAULT_MONTHS = 12
+MAX_MONTHS = 36
+# Number of windows kept per worker
+MAX_CACHED_MATRICES = 8
+
+def _month_index(day):
+    """Number of months since year 0, for month arithmetic."""
+    return day.year * 12 + day.month - 1
+
+def _month_start(index):
+    """First day of the month with the given _month_index()."""
+    return date(index // 12, index % 12 + 1, 1)
+
+def _working_days(start, end):
+    """Count Monday to Friday days in [start, end)."""
+    days = (end - start).days
+    if days <= 0:
+        return 0
+    weeks, extra = divmod(days, 7)
+    first = start.weekday()
+    return weeks * 5 + sum(1 for i in range(extra) if (first + i) % 7 < 5)
+
+def _cumulative_working_days(start, days):
+    """Working days in [start, start + k) for every k from 0 to days."""
+    week = [1 if (start.weekday() + i) % 7 < 5 else 0 for i in range(7)]
+    counts = array('i', bytes(4 * (days + 1)))
+    total = 0
+    for k in range(days):
+        total += week[k % 7]
+        counts[k + 1] = total
+    return counts
+
+class UtilizationMatrix:
+    """
+    Planned demand and capacity in days per consultant and month.
+    """
+
+    def __init__(self, start, months, consultants, assignments):
+        """
+        Args:
+            start: Any day in the first month of the window
+            months: The number of months in the window
+            consultants: (consultant_id, availability_days_per_month,
+                start_date, end_date) tuples
+            assignments: (consultant_id, planned_days, start_date, end_date)
+                tuples overlapping the window
+        """
+        self._first = _month_index(start)
+        self.months = [_month_start(self._first + i) for i in range(months)]
+        # Month boundaries, including the end of the last month
+        self._bounds = self.months + [_month_start(self._first + months)]
+        # Day offsets of the month boundaries, and the working days before
+        # each day of the window, so overlaps are counted without walking days
+        self._offsets = [(bound - self._bounds[0]).days for bound in self._bounds]
+        self._cumulative = _cumulative_working_days(self._bounds[0], self._offsets[-1])
+        self._month_days = [
+            self._cumulative[hi] - self._cumulative[lo] for lo, hi in zip(self._offsets, self._offsets[1:])
+        ]
+        self.capacity = {}
+        self.demand = {}
+        self._load(consultants, assignments)
+
+    @property
+    def start(self):
+        """The first day of the window."""
+        return self._bounds[0]
+
+    @property
+    def end(self):
+        """The first day after the window."""
+        return self._bounds[-1]
+
+    def _load(self, consultants, assignments):
+        """Compute the rows of the given consultants."""
+        for consultant_id, availability, start_date, end_date in consultants:
+            self.capacity[consultant_id] = self._capacity_row(availability, start_date, end_date)
+            self.demand[consultant_id] = array('d', bytes(8 * len(self.months)))
+        for consultant_id, planned_days, start_date, end_date in assignments:
+            row = self.demand.get(consultant_id)
+            if row is not None:
+                self._spread(row, planned_days or 0, start_date, end_date)
+
+    def _offset(self, day):
+        """Day offset of a date from the window start, clamped to the window."""
+        return min(max((day - self._bounds[0]).days, 0), self._offsets[-1])
+
+    def _month_of(self, offset):
+        """Index of the month containing a day offset."""
+        return bisect.bisect_right(self._offsets, offset) - 1
+
+    def _overlap(self, i, lo, hi):
+        """Working days of month i within the day offsets [lo, hi)."""
+        lo = max(lo, self._offsets[i])
+        hi = min(hi, self._offsets[i + 1])
+        return self._cumulative[hi] - self._cumulative[lo] if hi > lo else 0
+
+    def _capacity_row(self, availability, start_date, end_date):
+        """Monthly availability, prorated to the months the consultant is employed."""
+        months = len(self.months)
+        row = array('d', [float(availability or 0)]) * months
+        if start_date is None and end_date is None:
+            return row
+        lo = self._offset(start_date) if start_date else 0
+        hi = self._offset(end_date + timedelta(days=1)) if end_date else self._offsets[-1]
+        if hi <= lo:
+            return array('d', bytes(8 * months))
+        first = self._month_of(lo)
+        last = self._month_of(hi - 1)
+        # Months outside the employment are empty and months inside it are
+        # full; only the months it starts and ends in are prorated
+        row[:first] = array('d', bytes(8 * first))
+        row[last + 1:] = array('d', bytes(8 * (months - last - 1)))
+        for i in {first, last}:
+            month_days = self._month_days[i]
+            row[i] *= self._overlap(i, lo, hi) / month_days if month_days else 0
+        return row
+
+    def _spread(self, row, planned_days, start_date, end_date):
+        """Add an assignment's days to the months it overlaps, by working days."""
+        end = end_date + timedelta(days=1)
+        span = (end - start_date).days
+        if span <= 0:
+            return
+        lo = self._offset(start_date)
+        hi = self._offset(end)
+        if hi <= lo:
+            return
+        total = _working_days(start_date, end)
+        first = self._month_of(lo)
+        last = self._month_of(hi - 1)
+        if total:
+            rate = planned_days / total
+            for i in range(first, last + 1):
+                row[i] += rate * self._overlap(i, lo, hi)
+        else:
+            # Weekend-only assignments are spread by calendar days
+            rate = planned_days / span
+            for i in range(first, last + 1):
+                row[i] += rate * (min(hi, self._offsets[i + 1]) - max(lo, self._offsets[i]))
+
+    def update_consultants(self, consultant_ids, consultants, assignments):
+        """
+        Recompute the rows of the given consultants.
+
+        Args:
+            consultant_ids: The consultants to recompute
+            consultants: Fresh consultant tuples for those still existing
+            assignments: Fresh assignment tuples for those consultants
+        """
+        for consultant_id in consultant_ids:
+            self.capacity.pop(consultant_id, None)
+            self.demand.pop(consultant_id, None)
+        self._load(consultants, assignments)
+
+    def utilization(self, consultant_id):
+        """
+        Get a consultant's demand as a fraction of capacity per month.
+
+        Returns:
+            list: Ratios, or None for months without capacity
+        """
+        return [
+            demand / capacity if capacity else None
+            for demand, capacity in zip(self.demand[consultant_id], self.capacity[consultant_id])
+        ]
+
+_lock = threading.Lock()
+_matrices = {}
+_version = None
+# Consultants changed by commits in this worker, applied on the next request
+_pending_ids = set()
+
+def _load_consultants(consultant_ids=None):
+    """Load (consultant_id, availability, start_date, end_date) tuples."""
+    query = select(Consultant.id, Consultant.availability_days_per_month, Consultant.start_date, Consultant.end_date)
+    if consultant_ids is not None:
+        query = query.where(Consultant.id.in_(consultant_ids))
+    return db.session.execute(query).all()
+
+def _load_assignments(start, end, consultant_ids=None):
+    """Load (consultant_id, planned_days, start_date, end_date) tuples overlapping [start, end)."""
+    query = select(
+        ConsultantAssignment.consultant_id,
+        ConsultantAssignment.planned_days,
+        ConsultantAssignment.start_date,
+        ConsultantAssignment.end_date
+    ).where(ConsultantAssignment.start_date < end, ConsultantAssignment.end_date >= start)
+    if consultant_ids is not None:
+        query = query.where(ConsultantAssignment.consultant_id.in_(consultant_ids))
+    return db.session.execute(query).all()
+
+def _build_matrix(start, months):
+    """Build the matrix for a window."""
+    first = _month_start(_month_index(start))
+    end = _month_start(_month_index(start) + months)
+    return UtilizationMatrix(first, months, _load_consultants(), _load_assignments(first, end))
+
+def get_utilization_matrix(start, months=DEFAULT_MONTHS):
+    """
+    Get the utilization matrix for a window, building or patching it as needed.
+
+    Args:
+        start: Any day in the first month of the window
+        months: The number of months in the window
+
+    Returns:
+        UtilizationMatrix: The current matrix
+    """
+    global _version
+    key = (_month_index(start), months)
+    with _lock:
+        version = get_cache_version('utilization')
+        if version != _version:
+            _matrices.clear()
+            _pending_ids.clear()
+            _version = version
+        elif _pending_ids:
+            consultant_ids = list(_pending_ids)
+            consultants = _load_consultants(consultant_ids)
+            for matrix in _matrices.values():
+                assignments = _load_assignments(matrix.start, matrix.end, consultant_ids)
+                matrix.update_consultants(consultant_ids, consultants, assignments)
+            _pending_ids.clear()
+
+        matrix = _matrices.get(key)
+        if matrix is None:
+            if len(_matrices) >= MAX_CACHED_MATRICES:
+                _matrices.pop(next(iter(_matrices)))
+            matrix = _matrices[key] = _build_matrix(start, months)
+        return matrix
+
+def invalidate_utilization():
+    """
+    Drop the utilization matrices in every worker.
+    Called automatically after commits that bulk-change assignments or
+    consultants.
+    """
+    global _version
+    with _lock:
+        _matrices.clear()
+        _pending_ids.clear()
+        _version = None
+    bump_cache_version('utilization')
+
+def _consultants_changed(consultant_ids):
+    """Recompute the given consultants locally and make other workers rebuild."""
+    global _version
+    with _lock:
+        # The bump returns the version it replaced, so another worker's
+        # bump in between shows up as a version we have not seen
+        previous, new_version = swap_cache_version('utilization')
+        if _matrices and previous == _version and new_version is not None:
+            # Our matrices were up to date, so only these rows need recomputing
+            _pending_ids.update(consultant_ids)
+            _version = new_version
+        else:
+            _matrices.clear()
+            _pending_ids.clear()
+            _version = None
+
+def describe_utilization(matrix, status=None):
+    """
+    Serialize a utilization matrix with consultant names for JSON responses.
+
+    Args:
+        matrix: The UtilizationMatrix
+        status: Only include consultants with this status
+
+    Returns:
+        dict: The months of the window and one row per consultant, by name
+    """
+    query = select(Consultant.id, User.first_name, User.last_name, Consultant.status).join(
+        User, User.id == Consultant.user_id
+    ).order_by(User.last_name, User.first_name, Consultant.id)
+    if status:
+        query = query.where(Consultant.status == status)
+
+    rows = []
+    for consultant_id, first_name, last_name, consultant_status in db.session.execute(query):
+        if consultant_id not in matrix.demand:
+            continue
+        rows.append({
+            'consultant_id': consultant_id,
+            'name': f"{first_name or ''} {last_name or ''}".strip(),
+            'status': consultant_status,
+            'demand': [round(days, 2) for days in matrix.demand[consultant_id]],
+            'capacity': [round(days, 2) for days in matrix.capacity[consultant_id]],
+            'utilization': [None if ratio is None else round(ratio, 3) for ratio in matrix.utilization(consultant_id)]
+        })
+    return {
+        'months': [month.strftime('%Y-%m') for month in matrix.months],
+        'consultants': rows
+    }
+
+# Consultant columns that change capacity
+_CAPACITY_ATTRS = ('availability_days_per_month', 'start_date', 'end_date')
+
+def _utilization_row_changes(session, obj):
+    """Consultants whose assignments or availability a flushed row changed."""
+    if isinstance(obj, ConsultantAssignment):
+        # Include the previous consultant of a reassigned row
+        return {obj.consultant_id, *(db.inspect(obj).attrs.consultant_id.history.deleted or ())}
+    state = db.inspect(obj)
+    if obj in session.new or obj in session.deleted or \
+            any(state.attrs[attr].history.has_changes() for attr in _CAPACITY_ATTRS):
+        return {obj.id}
+    return None
+
+def _utilization_keys_changed(consultant_ids):
+    """Recompute the rows of the consultants changed by a commit."""
+    consultant_ids.discard(None)
+    if consultant_ids:
+        _consultants_changed(consultant_ids)
+
+# Bulk statements whose affected consultants are unknown require a rebuild
+track_cache_invalidation(
+    'utilization_changes', invalidate_utilization,
+    models=(ConsultantAssignment, Consultant),
+    predicate=_utilization_row_changes,
+    on_keys=_utilization_keys_changed,
+)
@@ -1,50 +1,133 @@
 """
 Utility functions for the application.
 """
-from flask import current_app
+from collections import namedtuple
+from contextlib import contextmanager
+from flask import current_app, g, has_app_context, has_request_context
+from sqlalchemy import event, text
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
 from .models import Role, db
+from .logging_pipeline import attach_queue_handler, create_file_handler
 import logging
 import os
 import sys
+import tempfile
+import time
 
-def user_has_role(user, role_name):
+try:
+    import fcntl
+except ImportError:  # Not available on Windows
+    fcntl = None
+
+# Process-wide mapping of role name to role id. Roles are created by the setup
+# scripts and almost never change, so the map is loaded once and only reloaded
+# on a miss or after invalidate_role_cache().
+_role_ids = None
+
+def get_role_ids():
     """
-    Check if a user has a specific role.
-    This function handles potential database issues and provides a fallback mechanism.
+    Get the process-wide mapping of role names to role ids.
+    
+    Returns:
+        dict: Role name -> role id
+    """
+    global _role_ids
+    if _role_ids is None:
+        _role_ids = {name: role_id for role_id, name in db.session.query(Role.id, Role.name)}
+    return _role_ids
+
+def get_role_id(role_name):
+    """
+    Get the id of a role by name, reloading the role map once on a miss so
+    roles created by another process are picked up.
     
     Args:
-        user: The user object to check
-        role_name: The name of the role to check for
+        role_name: The name of the role
         
     Returns:
-        bool: True if the user has the role, False otherwise
+        int: The role id, or None if the role does not exist
     """
-    if not user or not user.is_authenticated:
-        return False
-    
+    global _role_ids
+    role_id = get_role_ids().get(role_name)
+    if role_id is None:
+        _role_ids = None
+        role_id = get_role_ids().get(role_name)
+    return role_id
+
+def invalidate_role_cache():
+    """
+    Drop cached role data after roles or role assignments change.
+    Clears the process-wide role map and the role names resolved for the current request.
+    """
+    global _role_ids
+    _role_ids = None
+    if has_request_context():
+        g.pop('_user_role_names', None)
+
+def _load_user_role_names(user):
+    """Load the role names of a user from the database."""
     try:
         # Try the ORM approach first
-        role = Role.query.filter_by(name=role_name).first()
-        if role and role in user.roles:
-            return True
-            
-        # If that doesn't work, try direct SQL
-        if role:
-            result = db.session.execute("""
-                SELECT COUNT(*) FROM user_roles 
-                WHERE user_id = :user_id AND role_id = :role_id
-            """, {"user_id": user.id, "role_id": role.id}).scalar()
-            return result > 0
-            
+        return frozenset(role.name for role in user.roles)
     except SQLAlchemyError as e:
-        current_app.logger.error(f"Error checking role {role_name} for user {user.username}: {str(e)}")
+        current_app.logger.error(f"Error getting roles for user {user.username}: {str(e)}")
+        db.session.rollback()
+        
+        # Try direct SQL
+        try:
+            results = db.session.execute(text("""
+                SELECT r.name FROM roles r
+                JOIN user_roles ur ON r.id = ur.role_id
+                WHERE ur.user_id = :user_id
+            """), {"user_id": user.id}).fetchall()
+            return frozenset(row[0] for row in results)
+        except SQLAlchemyError as e2:
+            current_app.logger.error(f"Error getting roles via SQL for user {user.username}: {str(e2)}")
+            
+            # Last resort: if username is admin, return Admin role
+            if user.username == 'admin':
+                return frozenset(['Admin'])
+    
+    return frozenset()
+
+def get_user_role_names(user):
+    """
+    Get the role names of a user as a frozen set.
+    Roles are resolved once per request and cached on flask.g, so repeated
+    permission checks during a request do not hit the database.
+    
+    Args:
+        user: The user object to get roles for
         
-        # Last resort: check username for admin
-        if role_name == 'Admin' and user.username == 'admin':
-            return True
+    Returns:
+        frozenset: The role names of the user
+    """
+    if not user or not user.is_authenticated:
+        return frozenset()
+    
+    if not has_request_context():
+        return _load_user_role_names(user)
     
-    return False
+    cache = g.setdefault('_user_role_names', {})
+    role_names = cache.get(user.id)
+    if role_names is None:
+        role_names = cache[user.id] = _load_user_role_names(user)
+    return role_names
+
+def user_has_role(user, role_name):
+    """
+    Check if a user has a specific role.
+    Uses the role names resolved once per request by get_user_role_names().
+    
+    Args:
+        user: The user object to check
+        role_name: The name of the role to check for
+        
+    Returns:
+        bool: True if the user has the role, False otherwise
+    """
+    return role_name in get_user_role_names(user)
 
 def user_has_any_role(user, role_names):
     """
@@ -57,14 +140,10 @@ def user_has_any_role(user, role_names):
     Returns:
         bool: True if the user has any of the roles, False otherwise
     """
-    if not user or not user.is_authenticated or not role_names:
+    if not role_names:
         return False
     
-    for role_name in role_names:
-        if user_has_role(user, role_name):
-            return True
-    
-    return False
+    return not get_user_role_names(user).isdisjoint(role_names)
 
 def get_user_roles(user):
     """
@@ -77,44 +156,230 @@ def get_user_roles(user):
     Returns:
         list: A list of role names for the user
     """
-    if not user or not user.is_authenticated:
-        return []
+    return sorted(get_user_role_names(user))
+
+def _cache_version_file(name):
+    """Get the path of the version file for a named cache."""
+    return os.path.join(current_app.instance_path, f'{name}.version')
+
+def get_cache_version(name):
+    """
+    Get the current version of a named cache shared between worker processes.
+    The version file holds a counter that every bump increments.
     
-    try:
-        # Try the ORM approach first
-        return [role.name for role in user.roles]
-    except SQLAlchemyError as e:
-        current_app.logger.error(f"Error getting roles for user {user.username}: {str(e)}")
+    Args:
+        name (str): Name of the cache
         
-        # Try direct SQL
+    Returns:
+        int: The current version, or None if the cache was never bumped
+    """
+    try:
+        with open(_cache_version_file(name)) as version_file:
+            return int(version_file.read())
+    except (OSError, ValueError):
+        return None
+
+@contextmanager
+def _cache_version_lock(path):
+    """Serialize bumps of a cache version across worker processes."""
+    if fcntl is None:
+        yield
+        return
+    with open(f'{path}.lock', 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
         try:
-            results = db.session.execute("""
-                SELECT r.name FROM roles r
-                JOIN user_roles ur ON r.id = ur.role_id
-                WHERE ur.user_id = :user_id
-            """, {"user_id": user.id}).fetchall()
-            return [row[0] for row in results]
-        except SQLAlchemyError as e2:
-            current_app.logger.error(f"Error getting roles via SQL for user {user.username}: {str(e2)}")
-            
-            # Last resort: if username is admin, return Admin role
-            if user.username == 'admin':
-                return ['Admin']
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def swap_cache_version(name):
+    """
+    Signal all worker processes that a named cache is stale, and get the
+    version this bump replaced. Bumps are serialized across processes, so a
+    worker whose cache was built under the previous version knows that no
+    other process changed the cache in between.
+    
+    Args:
+        name (str): Name of the cache
+        
+    Returns:
+        tuple: (previous version, new version). The previous version is None
+        if the cache was never bumped, the new one if the version file could
+        not be written.
+    """
+    path = _cache_version_file(name)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with _cache_version_lock(path):
+            previous = get_cache_version(name)
+            # A missing file starts from the clock rather than from zero, so
+            # a version file deleted by hand cannot bring back an old version
+            version = previous + 1 if previous is not None else time.time_ns()
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=f'.{name}.')
+            with os.fdopen(fd, 'w') as version_file:
+                version_file.write(str(version))
+            # Readers see either the old file or the complete new one
+            os.replace(tmp_path, path)
+            return previous, version
+    except OSError as e:
+        current_app.logger.error(f"Error updating {name} version: {str(e)}")
+        return None, None
+
+def bump_cache_version(name):
+    """
+    Signal all worker processes that a named cache is stale.
     
-    return []
+    Args:
+        name (str): Name of the cache
+        
+    Returns:
+        int: The new version, or None if the version file could not be written.
+        get_cache_version() returns the same value until the next bump.
+    """
+    return swap_cache_version(name)[1]
+
+_CacheTracker = namedtuple('_CacheTracker', 'flag models tables keyed_tables predicate on_commit on_keys')
+
+# Registered trackers, checked by the session listeners below
+_cache_trackers = []
 
-def setup_logger(name, log_file=None, level=logging.INFO):
+# Session key of the keys recorded by note_bulk_changes()
+_BULK_CHANGES = 'bulk_changes'
+
+def track_cache_invalidation(flag, on_commit, models=(), tables=None, predicate=None,
+                             keyed_tables=(), on_keys=None):
+    """
+    Invalidate a cache after commits that change the rows it is built from.
+    Changes are collected in session.info[flag] while the transaction runs
+    and dropped on rollback.
+    
+    Args:
+        flag (str): Session info key of the pending changes
+        on_commit (callable): Called without arguments after a commit with changes
+        models: Models whose added, deleted or modified rows are changes. A dict
+            maps a model to the only columns whose modification counts, or to
+            None for any column.
+        tables: Tables whose bulk INSERT, UPDATE and DELETE statements are
+            changes. Defaults to the tables of the models.
+        predicate (callable, optional): predicate(session, obj) decides for
+            the flushed rows of the models instead: it returns True for a
+            change, keys of the changed entries, or None
+        keyed_tables: Tables whose bulk statements change only the keys given
+            to note_bulk_changes() before they ran, if any
+        on_keys (callable, optional): Called with the set of changed keys
+            instead of on_commit when only keys were collected
+    """
+    models = dict(models) if isinstance(models, dict) else dict.fromkeys(models)
+    if tables is None:
+        tables = [model.__tablename__ for model in models]
+    _cache_trackers.append(_CacheTracker(
+        flag, models, frozenset(tables) | frozenset(keyed_tables), frozenset(keyed_tables),
+        predicate, on_commit, on_keys
+    ))
+
+def note_bulk_changes(session, table_name, keys):
+    """
+    Record the keys a bulk statement is about to change, so caches that
+    track the table by key patch those entries instead of rebuilding.
+    
+    Args:
+        session: The session executing the statement
+        table_name (str): Name of the changed table
+        keys: Keys of the changed entries, such as consultant ids
+    """
+    session.info.setdefault(_BULK_CHANGES, {}).setdefault(table_name, set()).update(keys)
+
+def _record_changes(session, flag, changes):
+    """Add changes to the pending changes of a tracker."""
+    if not changes:
+        return
+    pending = session.info.get(flag)
+    if changes is True or pending is True:
+        session.info[flag] = True
+    else:
+        session.info.setdefault(flag, set()).update(changes)
+
+def _row_changed(session, obj, attrs):
+    """Whether a flushed row was added, deleted or modified in the given columns."""
+    if obj in session.new or obj in session.deleted:
+        return True
+    if attrs is None:
+        return session.is_modified(obj)
+    state = db.inspect(obj)
+    return any(state.attrs[attr].history.has_changes() for attr in attrs)
+
+@event.listens_for(Session, 'after_flush')
+def _track_cache_changes(session, flush_context):
+    """Collect the changes of a flush for every tracked cache."""
+    objs = list(session.new) + list(session.dirty) + list(session.deleted)
+    for tracker in _cache_trackers:
+        for obj in objs:
+            if session.info.get(tracker.flag) is True:
+                break
+            if type(obj) not in tracker.models:
+                continue
+            if tracker.predicate is not None:
+                _record_changes(session, tracker.flag, tracker.predicate(session, obj))
+            elif _row_changed(session, obj, tracker.models[type(obj)]):
+                _record_changes(session, tracker.flag, True)
+
+@event.listens_for(Session, 'do_orm_execute')
+def _track_cache_statements(orm_execute_state):
+    """Collect bulk INSERT, UPDATE and DELETE statements on tracked tables."""
+    if orm_execute_state.is_select:
+        return
+    table_name = getattr(getattr(orm_execute_state.statement, 'table', None), 'name', None)
+    if table_name is None:
+        return
+    session = orm_execute_state.session
+    noted = session.info.get(_BULK_CHANGES, {}).get(table_name)
+    for tracker in _cache_trackers:
+        if table_name in tracker.tables:
+            keyed = noted and table_name in tracker.keyed_tables
+            _record_changes(session, tracker.flag, set(noted) if keyed else True)
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_caches_after_commit(session):
+    """Invalidate the tracked caches once their changes are committed."""
+    session.info.pop(_BULK_CHANGES, None)
+    pending = [(tracker, session.info.pop(tracker.flag, None)) for tracker in _cache_trackers]
+    if not has_app_context():
+        return
+    for tracker, changes in pending:
+        if changes is True or (changes and tracker.on_keys is None):
+            tracker.on_commit()
+        elif changes:
+            tracker.on_keys(changes)
+
+@event.listens_for(Session, 'after_rollback')
+def _reset_caches_after_rollback(session):
+    """Forget pending cache changes that were rolled back."""
+    session.info.pop(_BULK_CHANGES, None)
+    for tracker in _cache_trackers:
+        session.info.pop(tracker.flag, None)
+
+def setup_logger(name, log_file=None, level=None, sample_every=1):
     """
     Set up a logger for any module in the application.
+    Records are handed to a background thread that writes them to the console
+    and to a rotating log file, so logging never blocks the calling thread.
     
     Args:
         name (str): Name of the logger
         log_file (str, optional): Path to the log file. If None, a default path will be used.
-        level (int, optional): Logging level. Defaults to INFO.
+        level (int, optional): Logging level. Defaults to the LOG_LEVEL environment
+            variable, or INFO if it is not set.
+        sample_every (int, optional): Log only every Nth occurrence of each message below
+            WARNING. Defaults to 1 (no sampling). Single calls can pass extra={'sample': N}.
         
     Returns:
         logging.Logger: Configured logger
     """
+    if level is None:
+        level = logging.getLevelName(os.environ.get('LOG_LEVEL', 'INFO').upper())
+        if not isinstance(level, int):
+            level = logging.INFO
+    
     # Create logger
     logger = logging.getLogger(name)
     logger.setLevel(level)
@@ -130,11 +395,10 @@ def setup_logger(name, log_file=None, level=logging.INFO):
     # Create formatter
     formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
     console_handler.setFormatter(formatter)
-    
-    # Add console handler to logger
-    logger.addHandler(console_handler)
+    handlers = [console_handler]
     
     # Try to set up file handler if possible
+    file_error = None
     try:
         # Create log directory if it doesn't exist
         log_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'logs')
@@ -144,16 +408,19 @@ def setup_logger(name, log_file=None, level=logging.INFO):
         if log_file is None:
             log_file = os.path.join(log_dir, f'{name}.log')
         
-        # Create file handler
-        file_handler = logging.FileHandler(log_file)
+        # Create rotating file handler
+        file_handler = create_file_handler(log_file)
         file_handler.setLevel(level)
         file_handler.setFormatter(formatter)
-        
-        # Add file handler to logger
-        logger.addHandler(file_handler)
+        handlers.append(file_handler)
     except Exception as e:
         # If file logging fails, just log to console
         console_handler.setLevel(logging.DEBUG)  # Ensure we get all messages
-        logger.warning(f"Could not set up file logging: {str(e)}. Logging to console only.")
+        file_error = e
+    
+    # Route the logger through a queue to the handlers
+    attach_queue_handler(logger, handlers, sample_every=sample_every)
+    if file_error is not None:
+        logger.warning("Could not set up file logging: %s. Logging to console only.", file_error)
     
-    return logger 
\ No newline at end of file
+    return logger
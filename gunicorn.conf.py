@@ -0,0 +1,8 @@
+# Gunicorn settings, read from the working directory by every gunicorn command
+# (Procfile, Dockerfile, docker-compose.yml).
+
+# Threaded workers keep reporting to the arbiter while a request runs, so
+# long streaming downloads such as exports are not killed by the worker
+# timeout; the sync worker only reports between requests.
+worker_class = 'gthread'
+threads = 4
@@ -0,0 +1,41 @@
+import sys
+import os
+import logging
+
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app, db
+from app.models import Client, Project
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+app = create_app()
+
+def migrate_client_list_indexes():
+    """
+    Migration script to add the indexes used to paginate and filter the client list:
+    (lower(name), id) alone and after active or country_id on clients, and
+    (manager_id, client_id) on projects for the project manager scope.
+    """
+    with app.app_context():
+        try:
+            inspector = db.inspect(db.engine)
+            for model in (Client, Project):
+                existing = {index['name'] for index in inspector.get_indexes(model.__tablename__)}
+                for index in model.__table__.indexes:
+                    if index.name in existing:
+                        logger.info(f"Index {index.name} already exists.")
+                        continue
+                    logger.info(f"Creating index {index.name}...")
+                    index.create(db.engine)
+            logger.info("Migration completed successfully.")
+            
+        except Exception as e:
+            logger.error(f"Error during migration: {str(e)}")
+            raise
+
+if __name__ == "__main__":
+    migrate_client_list_indexes()
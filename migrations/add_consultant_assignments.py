@@ -0,0 +1,37 @@
+import sys
+import os
+import logging
+
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app, db
+from app.models import ConsultantAssignment
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+app = create_app()
+
+def migrate_consultant_assignments():
+    """
+    Migration script to create the consultant_assignments table that links consultants to project phases.
+    """
+    with app.app_context():
+        try:
+            inspector = db.inspect(db.engine)
+
+            if 'consultant_assignments' not in inspector.get_table_names():
+                logger.info("Creating consultant_assignments table...")
+                ConsultantAssignment.__table__.create(db.engine)
+                logger.info("Table created successfully.")
+            else:
+                logger.info("consultant_assignments table already exists.")
+
+        except Exception as e:
+            logger.error(f"Error during migration: {str(e)}")
+            raise
+
+if __name__ == "__main__":
+    migrate_consultant_assignments()
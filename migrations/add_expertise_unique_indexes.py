@@ -0,0 +1,51 @@
+import sys
+import os
+import logging
+from sqlalchemy import text
+
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app, db
+from app.models import ConsultantExpertise
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+app = create_app()
+
+def migrate_expertise_unique_indexes():
+    """
+    Migration script to add the unique indexes on consultant_expertise that back the expertise upserts.
+    Duplicate ratings left by concurrent saves are removed first, keeping the most recent row.
+    """
+    with app.app_context():
+        try:
+            inspector = db.inspect(db.engine)
+            existing = {index['name'] for index in inspector.get_indexes('consultant_expertise')}
+            
+            with db.engine.connect() as conn:
+                for item_column in ('product_group_id', 'product_element_id'):
+                    result = conn.execute(text(
+                        f"DELETE FROM consultant_expertise WHERE {item_column} IS NOT NULL AND id NOT IN ("
+                        f"SELECT MAX(id) FROM consultant_expertise WHERE {item_column} IS NOT NULL "
+                        f"GROUP BY consultant_id, {item_column})"
+                    ))
+                    logger.info(f"Removed {result.rowcount} duplicate ratings by {item_column}.")
+                conn.commit()
+            
+            for index in ConsultantExpertise.__table__.indexes:
+                if index.name in existing:
+                    logger.info(f"Index {index.name} already exists.")
+                    continue
+                logger.info(f"Creating index {index.name}...")
+                index.create(db.engine)
+            logger.info("Migration completed successfully.")
+            
+        except Exception as e:
+            logger.error(f"Error during migration: {str(e)}")
+            raise
+
+if __name__ == "__main__":
+    migrate_expertise_unique_indexes()
@@ -0,0 +1,41 @@
+import sys
+import os
+import logging
+from sqlalchemy import text
+
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app, db
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+app = create_app()
+
+def migrate_project_group_parallel():
+    """
+    Migration script to add the parallel flag of project groups used by the schedule engine.
+    """
+    with app.app_context():
+        try:
+            # Check if the column exists
+            inspector = db.inspect(db.engine)
+            columns = [column['name'] for column in inspector.get_columns('project_groups')]
+            
+            if 'parallel' not in columns:
+                logger.info("Adding parallel column to project_groups table...")
+                with db.engine.connect() as conn:
+                    conn.execute(text("ALTER TABLE project_groups ADD COLUMN parallel BOOLEAN NOT NULL DEFAULT FALSE"))
+                    conn.commit()
+                logger.info("Column added successfully.")
+            else:
+                logger.info("parallel column already exists in project_groups table.")
+            
+        except Exception as e:
+            logger.error(f"Error during migration: {str(e)}")
+            raise
+
+if __name__ == "__main__":
+    migrate_project_group_parallel()
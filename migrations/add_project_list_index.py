@@ -0,0 +1,45 @@
+import sys
+import os
+import logging
+from sqlalchemy import text
+
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app, db
+from app.models import Project
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+app = create_app()
+
+def migrate_project_list_index():
+    """
+    Migration script to add the (created_at, id) index used to paginate the project list.
+    Projects without a creation time are given the current time first, since the list is sorted by it.
+    """
+    with app.app_context():
+        try:
+            with db.engine.connect() as conn:
+                result = conn.execute(text("UPDATE projects SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL"))
+                logger.info(f"Set created_at on {result.rowcount} projects.")
+                conn.commit()
+            
+            inspector = db.inspect(db.engine)
+            existing = {index['name'] for index in inspector.get_indexes('projects')}
+            for index in Project.__table__.indexes:
+                if index.name in existing:
+                    logger.info(f"Index {index.name} already exists.")
+                    continue
+                logger.info(f"Creating index {index.name}...")
+                index.create(db.engine)
+            logger.info("Migration completed successfully.")
+            
+        except Exception as e:
+            logger.error(f"Error during migration: {str(e)}")
+            raise
+
+if __name__ == "__main__":
+    migrate_project_list_index()
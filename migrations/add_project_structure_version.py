@@ -0,0 +1,41 @@
+import sys
+import os
+import logging
+from sqlalchemy import text
+
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app, db
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+app = create_app()
+
+def migrate_project_structure_version():
+    """
+    Migration script to add the structure_version column used for optimistic checks when saving project structures.
+    """
+    with app.app_context():
+        try:
+            # Check if the column exists
+            inspector = db.inspect(db.engine)
+            columns = [column['name'] for column in inspector.get_columns('projects')]
+            
+            if 'structure_version' not in columns:
+                logger.info("Adding structure_version column to projects table...")
+                with db.engine.connect() as conn:
+                    conn.execute(text("ALTER TABLE projects ADD COLUMN structure_version INTEGER NOT NULL DEFAULT 1"))
+                    conn.commit()
+                logger.info("Column added successfully.")
+            else:
+                logger.info("structure_version column already exists in projects table.")
+            
+        except Exception as e:
+            logger.error(f"Error during migration: {str(e)}")
+            raise
+
+if __name__ == "__main__":
+    migrate_project_structure_version()
@@ -0,0 +1,33 @@
+import sys
+import os
+import logging
+
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from app.search_index import ensure_search_index
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+app = create_app()
+
+def migrate_search_index():
+    """
+    Migration script to create the full-text search index over projects, phases and clients, with the triggers that keep it in sync, and to fill it.
+    Running it again rebuilds the index.
+    """
+    with app.app_context():
+        try:
+            logger.info("Creating and filling the search index...")
+            ensure_search_index()
+            logger.info("Search index created successfully.")
+            
+        except Exception as e:
+            logger.error(f"Error during migration: {str(e)}")
+            raise
+
+if __name__ == "__main__":
+    migrate_search_index()
@@ -6,6 +6,8 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from app import db, create_app
 from app.models import User, Role
+from app.utils import invalidate_role_cache
+from app.user_cache import invalidate_user_cache
 from sqlalchemy.exc import SQLAlchemyError
 
 def populate_roles():
@@ -45,6 +47,7 @@ def populate_roles():
             print("Consultant role assigned to all users")
         
         db.session.commit()
+        invalidate_role_cache()
         print("Roles populated and associated with users successfully.")
     except SQLAlchemyError as e:
         db.session.rollback()
@@ -112,6 +115,8 @@ def populate_roles():
                     """, {"user_id": user_id, "role_id": consultant_role_id})
             
             db.session.commit()
+            invalidate_role_cache()
+            invalidate_user_cache()
             print("Roles populated using direct SQL successfully.")
         except Exception as e2:
             db.session.rollback()
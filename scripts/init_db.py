@@ -6,6 +6,7 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from app import db, create_app
 from app.models import User, Role, Consultant, ExpertiseCategory, ConsultantExpertise
+from app.utils import invalidate_role_cache
 from werkzeug.security import generate_password_hash
 from datetime import datetime, date
 from sqlalchemy.exc import SQLAlchemyError
@@ -68,6 +69,7 @@ def init_db():
             print("Assigned Consultant role to consultant user")
         
         db.session.commit()
+        invalidate_role_cache()
         
         # Create expertise categories if they don't exist
         categories = ['Java', 'Python', 'JavaScript', 'DevOps', 'Database', 'Cloud']